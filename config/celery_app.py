@@ -1,5 +1,6 @@
 import os
 from celery import Celery
+from celery.signals import worker_process_init
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings.production")
 
@@ -8,3 +9,10 @@ app = Celery("phasma_food_v2")
 app.config_from_object("django.conf:settings", namespace="CELERY")
 
 app.autodiscover_tasks()
+
+
+@worker_process_init.connect
+def reset_mongo_client(**kwargs):
+    """Every prefork child opens its own Mongo connection pool."""
+    from phasma_food_v2.samples.mongo_db import reset_client
+    reset_client()
@@ -32,6 +32,37 @@ DATABASES = {"default": env.db("DATABASE_URL", default="postgres:///phasma_food_
 DATABASES["default"]["ATOMIC_REQUESTS"] = True
 MONGO_DEFAULT_DB = env("MONGO_DEFAULT_DB", None)
 MONGO_DEFAULT_COLLECTION = env("MONGO_DEFAULT_COLLECTION", None)
+MONGO_BATCH_SIZE = env.int("MONGO_BATCH_SIZE", default=500)
+MONGO_COUNT_CACHE_TIMEOUT = env.int("MONGO_COUNT_CACHE_TIMEOUT", default=60)
+MONGO_STREAM_BATCH_SIZE = env.int("MONGO_STREAM_BATCH_SIZE", default=200)
+# Cached results of samples queries, per collection timeouts as "Collection=seconds,...", 0 disables cache
+MONGO_QUERY_CACHE_ENABLED = env.bool("MONGO_QUERY_CACHE_ENABLED", default=True)
+MONGO_QUERY_CACHE_TIMEOUT = env.int("MONGO_QUERY_CACHE_TIMEOUT", default=5 * 60)
+MONGO_QUERY_CACHE_TIMEOUTS = env.dict("MONGO_QUERY_CACHE_TIMEOUTS", cast={"value": int}, default={})
+# Hit/miss counters of query cache, one more cache round trip per query
+MONGO_QUERY_CACHE_STATS = env.bool("MONGO_QUERY_CACHE_STATS", default=False)
+# Collections of default DB in platform statistic, all collections of DB when empty
+MONGO_STATISTIC_COLLECTIONS = env.list("MONGO_STATISTIC_COLLECTIONS", default=[
+    "AltSplitSamples", "AlcoholicBeverages", "AltJsonSamples",
+    "EdibleOils", "SkimmedMilkPowder", "UseCaseOne", "UseCaseTwo"
+])
+MONGO_STATISTIC_WORKERS = env.int("MONGO_STATISTIC_WORKERS", default=8)
+# Connection pool of Mongo client that is shared by process
+MONGO_MAX_POOL_SIZE = env.int("MONGO_MAX_POOL_SIZE", default=50)
+MONGO_MIN_POOL_SIZE = env.int("MONGO_MIN_POOL_SIZE", default=0)
+MONGO_MAX_IDLE_TIME_MS = env.int("MONGO_MAX_IDLE_TIME_MS", default=5 * 60 * 1000)
+MONGO_WAIT_QUEUE_TIMEOUT_MS = env.int("MONGO_WAIT_QUEUE_TIMEOUT_MS", default=10 * 1000)
+MONGO_CONNECT_TIMEOUT_MS = env.int("MONGO_CONNECT_TIMEOUT_MS", default=5 * 1000)
+MONGO_SERVER_SELECTION_TIMEOUT_MS = env.int("MONGO_SERVER_SELECTION_TIMEOUT_MS", default=5 * 1000)
+MONGO_SOCKET_TIMEOUT_MS = env.int("MONGO_SOCKET_TIMEOUT_MS", default=60 * 1000)
+# Scheduled push of new and changed measurements to collection of their use case and food type
+MONGO_SYNC_ENABLED = env.bool("MONGO_SYNC_ENABLED", default=False)
+MONGO_SYNC_DB = env("MONGO_SYNC_DB", default=MONGO_DEFAULT_DB)
+MONGO_SYNC_INTERVAL = env.int("MONGO_SYNC_INTERVAL", default=5 * 60)
+MONGO_SYNC_BATCHES = env.int("MONGO_SYNC_BATCHES", default=20)
+MONGO_SYNC_LOCK_TIMEOUT = env.int("MONGO_SYNC_LOCK_TIMEOUT", default=60 * 60)
+# Seconds, measurements younger than this can still be committed with earlier date_updated, they wait for next run
+MONGO_SYNC_LAG = env.int("MONGO_SYNC_LAG", default=60)
 
 # APPS
 # ----------------------------------------------------------------------------------------------------------------------
@@ -65,6 +96,7 @@ LOCAL_APPS = [
     "phasma_food_v2.measurements.apps.MeasurementsConfig",
     "phasma_food_v2.devices.apps.DevicesConfig",
     "phasma_food_v2.dashboard.apps.DashboardConfig",
+    "phasma_food_v2.samples.apps.SamplesConfig",
 ]
 INSTALLED_APPS = DJANGO_APPS + THIRD_PARTY_APPS + LOCAL_APPS
 
@@ -178,6 +210,7 @@ STATICFILES_FINDERS = [
 # ----------------------------------------------------------------------------------------------------------------------
 MEDIA_ROOT = str(APPS_DIR("media"))
 MEDIA_URL = "/media/"
+IMAGE_THUMBNAIL_SIZE = (env.int("IMAGE_THUMBNAIL_WIDTH", 256), env.int("IMAGE_THUMBNAIL_HEIGHT", 256))
 
 # TEMPLATES
 # ----------------------------------------------------------------------------------------------------------------------
@@ -273,6 +306,50 @@ CELERY_RESULT_SERIALIZER = "json"
 CELERY_TASK_TIME_LIMIT = 60 * 60 * 12
 CELERY_TASK_SOFT_TIME_LIMIT = 60 * 60 * 24
 CELERY_BEAT_SCHEDULER = "django_celery_beat.schedulers:DatabaseScheduler"
+CELERY_BEAT_SCHEDULE = {
+    "expire-export-jobs": {
+        "task": "phasma_food_v2.dashboard.tasks.expire_export_jobs",
+        "schedule": 60 * 60,
+    },
+    "sync-to-mongo": {
+        "task": "phasma_food_v2.dashboard.tasks.sync_to_mongo",
+        "schedule": MONGO_SYNC_INTERVAL,
+    },
+    "requeue-stale-results": {
+        "task": "phasma_food_v2.measurements.tasks.requeue_stale_results",
+        "schedule": 5 * 60,
+    },
+}
+
+# RULE ENGINE
+# ----------------------------------------------------------------------------------------------------------------------
+# "use case/food type/sensor" -> path relative to MEDIA_ROOT, "*" matches any use case or food type
+RULE_ENGINE_MODELS = env.json("RULE_ENGINE_MODELS", default={
+    "*/*/FUSION": "trained_models/smp_fusion_bagging.pkl",
+})
+RULE_ENGINE_MODELS_CACHE_SIZE = env.int("RULE_ENGINE_MODELS_CACHE_SIZE", default=8)
+# Seconds to collect measurements before they are analyzed together, 0 analyzes every measurement immediately
+RULE_ENGINE_BATCH_WINDOW = env.int("RULE_ENGINE_BATCH_WINDOW", default=2)
+RULE_ENGINE_BATCH_SIZE = env.int("RULE_ENGINE_BATCH_SIZE", default=64)
+RULE_ENGINE_FEATURES_TIMEOUT = env.int("RULE_ENGINE_FEATURES_TIMEOUT", default=60 * 60)
+# Results that are running longer than this (seconds) were lost with their worker and are queued again
+RULE_ENGINE_RUNNING_TIMEOUT = env.int("RULE_ENGINE_RUNNING_TIMEOUT", default=10 * 60)
+# Batch is started again for results that are pending longer than batch window and grace period (seconds)
+RULE_ENGINE_PENDING_GRACE = env.int("RULE_ENGINE_PENDING_GRACE", default=60)
+# Sensor and FUSION models run concurrently, model that runs longer than timeout (seconds) is skipped
+RULE_ENGINE_WORKERS = env.int("RULE_ENGINE_WORKERS", default=4)
+RULE_ENGINE_MODEL_TIMEOUT = env.float("RULE_ENGINE_MODEL_TIMEOUT", default=30)
+
+# EXPORT
+# ----------------------------------------------------------------------------------------------------------------------
+# Excel files of big exports are generated chunk by chunk in parallel Celery tasks, 1 generates them in one task
+EXPORT_WORKERS = env.int("EXPORT_WORKERS", default=4)
+EXPORT_CHUNK_SIZE = env.int("EXPORT_CHUNK_SIZE", default=50)
+# Generated excel files are kept for next exports, least recently used are removed above max size (bytes)
+EXPORT_CACHE_DIR = env("EXPORT_CACHE_DIR", default=str(APPS_DIR("media", "excel_cache")))
+EXPORT_CACHE_MAX_SIZE = env.int("EXPORT_CACHE_MAX_SIZE", default=1024 ** 3)
+# Hours that zip archives of export jobs can be downloaded
+EXPORT_JOB_TTL_HOURS = env.int("EXPORT_JOB_TTL_HOURS", default=24)
 
 # FIREBASE
 # ----------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,16 @@
+from django.contrib import admin
+
+from .models import ExportJob, MongoSyncWatermark
+
+
+@admin.register(ExportJob)
+class ExportJobAdmin(admin.ModelAdmin):
+    list_display = ("id", "owner", "status", "chunks_done", "chunks_total", "size", "date_created", "date_expires")
+    list_filter = ("status",)
+    readonly_fields = ("date_created", "date_started", "date_finished")
+    ordering = ("-date_created",)
+
+
+@admin.register(MongoSyncWatermark)
+class MongoSyncWatermarkAdmin(admin.ModelAdmin):
+    list_display = ("db", "collection", "last_updated", "last_sample_id", "synced", "date_synced")
@@ -0,0 +1,178 @@
+import zipfile
+import tempfile
+from io import BytesIO
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+
+from phasma_food_v2.measurements.models import Measurement
+from phasma_food_v2.measurements.spectrum import Spectrum
+from .utils import ZipStream
+
+# Blocks of every sensor that are exported as (n_samples x n_waves) float32 matrices
+DATASET_BLOCKS = {
+    "vis": ("preprocessed", "avgData", "avgWhite", "avgDark"),
+    "fluo": ("preprocessed", "avgData", "avgWhite", "avgDark"),
+    "nir": ("preprocessed", "whiteReference", "darkReference"),
+}
+# Measurement field -> type of metadata column
+DATASET_METADATA = (
+    ("sample_id", "int64"), ("date_created", "datetime64[ms]"), ("white_reference_id", "int64"),
+    ("use_case", "str"), ("food_type", "str"), ("food_subtype", "str"), ("laboratory", "str"),
+    ("granularity", "str"), ("mycotoxins", "str"), ("aflatoxin_name", "str"), ("aflatoxin_unit", "str"),
+    ("aflatoxin_value", "str"), ("temperature", "float64"), ("temperature_exposure_hours", "str"),
+    ("microbiological_id", "str"), ("microbiological_unit", "str"), ("microbiological_value", "str"),
+    ("other_species", "str"), ("adulteration_id", "str"), ("alcohol_label", "str"), ("authentic", "str"),
+    ("purity_smp", "str"), ("low_value_filler", "str"), ("nitrogen_enhancer", "str"), ("hazard_one_name", "str"),
+    ("hazard_one_pct", "str"), ("hazard_two_name", "str"), ("hazard_two_pct", "str"), ("diluted_pct", "str"),
+    ("package", "str"), ("adulterated", "str"),
+)
+# Format -> content type of file
+DATASET_FORMATS = {
+    "npz": "application/octet-stream",
+}
+_DTYPE = np.dtype("<f4")
+_COPY_SIZE = 1024 * 1024
+
+
+def _metadata_array(values: list, dtype: str) -> np.ndarray:
+    """Typed metadata column, missing values are "" for text, NaN for floats and -1 for integers."""
+    if dtype == "str":
+        return np.array(["" if value is None else str(value) for value in values], dtype=str)
+    if dtype == "int64":
+        return np.array([-1 if value is None else value for value in values], dtype=np.int64)
+    if dtype == "float64":
+        return np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+    return np.array([np.datetime64(value.replace(tzinfo=None), "ms") for value in values], dtype=dtype)
+
+
+class DatasetWriter:
+    """Collects measurements into per-block float32 matrices.
+
+    Wavelength axis of every sensor is taken from first measurement that has
+    that sensor, blocks of other measurements are interpolated to it when
+    their axis is different (NaN outside of their range). Rows are appended to
+    one temporary file per block, so memory does not grow with number of
+    measurements, only metadata columns are kept in memory.
+    """
+    def __init__(self):
+        self.rows = 0
+        self.axes = {}
+        self.pending = {sensor: 0 for sensor in DATASET_BLOCKS}
+        self.files = {}
+        self.metadata = {name: [] for name, _ in DATASET_METADATA}
+
+    def add(self, measurement: Measurement) -> None:
+        for sensor, blocks in DATASET_BLOCKS.items():
+            self._add_sensor(sensor, blocks, getattr(measurement, sensor))
+        for name, _ in DATASET_METADATA:
+            self.metadata[name].append(getattr(measurement, name))
+        self.rows += 1
+
+    def _add_sensor(self, sensor: str, blocks: Tuple[str, ...], spectrum: Optional[Spectrum]) -> None:
+        if isinstance(spectrum, dict):
+            spectrum = Spectrum.from_legacy(spectrum)
+        axis = self.axes.get(sensor)
+        if axis is None and spectrum is not None:
+            axis = next((spectrum.wave(block) for block in blocks if spectrum.wave(block) is not None), None)
+            if axis is not None:
+                axis = self.axes[sensor] = np.array(axis, dtype=_DTYPE)
+                empty = np.full(axis.size, np.nan, dtype=_DTYPE).tobytes()
+                for block in blocks:
+                    self.files[(sensor, block)] = tempfile.TemporaryFile()
+                    self.files[(sensor, block)].write(empty * self.pending[sensor])
+        if axis is None:
+            self.pending[sensor] += 1
+            return
+        for block in blocks:
+            self.files[(sensor, block)].write(self._row(spectrum, block, axis).tobytes())
+
+    @staticmethod
+    def _row(spectrum: Optional[Spectrum], block: str, axis: np.ndarray) -> np.ndarray:
+        """Values of block on sensor wavelength axis."""
+        wave = spectrum.wave(block) if spectrum is not None else None
+        values = spectrum.array(block) if spectrum is not None else None
+        if values is None or values.ndim != 1:
+            return np.full(axis.size, np.nan, dtype=_DTYPE)
+        if np.array_equal(wave, axis):
+            return values.astype(_DTYPE)
+        order = np.argsort(wave)
+        return np.interp(axis, wave[order], values[order], left=np.nan, right=np.nan).astype(_DTYPE)
+
+    def metadata_arrays(self) -> Iterator[Tuple[str, np.ndarray]]:
+        for name, dtype in DATASET_METADATA:
+            yield name, _metadata_array(self.metadata[name], dtype)
+
+    def matrices(self) -> Iterator[Tuple[str, Optional[np.ndarray], bytes, object]]:
+        """Sensor axes and block matrices.
+
+        Returns:
+            members (iterator): Name, wave axis, .npy header and temporary file with rows
+        """
+        for sensor, blocks in DATASET_BLOCKS.items():
+            axis = self.axes.get(sensor, np.empty(0, dtype=_DTYPE))
+            yield "{}_wave".format(sensor), axis, b"", None
+            for block in blocks:
+                header = BytesIO()
+                np.lib.format.write_array_header_1_0(header, {
+                    "descr": _DTYPE.str, "fortran_order": False, "shape": (self.rows, axis.size)
+                })
+                yield "{}_{}".format(sensor, block), None, header.getvalue(), self.files.get((sensor, block))
+
+    def close(self) -> None:
+        for file in self.files.values():
+            file.close()
+
+
+def dataset_sample_ids(measurements: List[str] = None, use_case: str = None, food_type: str = None) -> List[int]:
+    """IDs of measurements in dataset, in order of measurements in DB."""
+    queryset = Measurement.objects.all()
+    if measurements:
+        queryset = queryset.filter(sample_id__in=measurements)
+    if use_case:
+        queryset = queryset.filter(use_case=use_case)
+    if food_type:
+        queryset = queryset.filter(food_type=food_type)
+    return list(queryset.values_list("sample_id", flat=True))
+
+
+def stream_dataset(sample_ids: List[int]) -> Iterator[bytes]:
+    """NPZ archive (numpy.load) with metadata columns, wavelength axis
+    of every sensor and float32 matrix of every sensor block.
+    Measurements are loaded in chunks of EXPORT_CHUNK_SIZE.
+
+    Parameter:
+        sample_ids (list): Measurement IDs in order
+
+    Returns:
+        chunks (iterator): Bytes of NPZ archive
+    """
+    writer = DatasetWriter()
+    try:
+        chunk_size = max(settings.EXPORT_CHUNK_SIZE, 1)
+        for start in range(0, len(sample_ids), chunk_size):
+            chunk = sample_ids[start:start + chunk_size]
+            measurements = Measurement.objects.in_bulk(chunk)
+            for sample_id in chunk:
+                if sample_id in measurements:
+                    writer.add(measurements[sample_id])
+
+        stream = ZipStream()
+        with zipfile.ZipFile(stream, mode="w", compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+            members = [(name, array, b"", None) for name, array in writer.metadata_arrays()]
+            for name, array, header, file in members + list(writer.matrices()):
+                with archive.open("{}.npy".format(name), mode="w", force_zip64=True) as member:
+                    if array is not None:
+                        np.lib.format.write_array(member, array, allow_pickle=False)
+                    else:
+                        member.write(header)
+                        if file is not None:
+                            file.seek(0)
+                            for data in iter(lambda: file.read(_COPY_SIZE), b""):
+                                member.write(data)
+                                yield stream.pop()
+                yield stream.pop()
+        yield stream.pop()
+    finally:
+        writer.close()
@@ -0,0 +1,39 @@
+from django.conf import settings
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('measurements', django.contrib.postgres.fields.jsonb.JSONField(help_text='IDs of exported measurements.')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed'), ('expired', 'Expired')], db_index=True, default='pending', max_length=15)),
+                ('chunks_done', models.PositiveIntegerField(default=0, help_text='Number of generated chunks of measurements.')),
+                ('chunks_total', models.PositiveIntegerField(default=0, help_text='Number of all chunks of measurements.')),
+                ('path', models.CharField(blank=True, help_text='Path of generated zip archive.', max_length=255)),
+                ('size', models.BigIntegerField(blank=True, help_text='Size of generated zip archive in bytes.', null=True)),
+                ('error', models.TextField(blank=True)),
+                ('date_created', models.DateTimeField(default=django.utils.timezone.now, verbose_name='date created')),
+                ('date_started', models.DateTimeField(blank=True, null=True)),
+                ('date_finished', models.DateTimeField(blank=True, null=True)),
+                ('date_expires', models.DateTimeField(blank=True, db_index=True, help_text='Date when zip archive is removed.', null=True)),
+                ('owner', models.ForeignKey(help_text='User that requested export.', on_delete=django.db.models.deletion.CASCADE, related_name='export_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ('-date_created',),
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MongoSyncWatermark',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('db', models.CharField(max_length=127)),
+                ('collection', models.CharField(max_length=127)),
+                ('last_updated', models.DateTimeField(blank=True, help_text='date_updated of last synced measurement.', null=True)),
+                ('last_sample_id', models.IntegerField(blank=True, help_text='ID of last synced measurement.', null=True)),
+                ('synced', models.PositiveIntegerField(default=0, help_text='Number of synced measurements.')),
+                ('date_synced', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'unique_together': {('db', 'collection')},
+            },
+        ),
+    ]
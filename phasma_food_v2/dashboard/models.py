@@ -0,0 +1,120 @@
+import os
+import uuid
+from typing import Optional
+
+from django.db import models
+from django.conf import settings
+from django.utils import timezone
+from django.utils.translation import ugettext_lazy as _
+from django.contrib.postgres.fields import JSONField
+
+
+class ExportJob(models.Model):
+    """Excel export that is generated in background and downloaded when it is done."""
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    EXPIRED = "expired"
+    STATUS_CHOICES = (
+        (PENDING, _("Pending")),
+        (RUNNING, _("Running")),
+        (DONE, _("Done")),
+        (FAILED, _("Failed")),
+        (EXPIRED, _("Expired")),
+    )
+
+    id = models.UUIDField(primary_key=True,
+                          default=uuid.uuid4,
+                          editable=False
+                          )
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL,
+                              on_delete=models.CASCADE,
+                              help_text=_("User that requested export."),
+                              related_name="export_jobs"
+                              )
+    measurements = JSONField(help_text=_("IDs of exported measurements."))
+    status = models.CharField(max_length=15,
+                              choices=STATUS_CHOICES,
+                              default=PENDING,
+                              db_index=True
+                              )
+    chunks_done = models.PositiveIntegerField(default=0,
+                                              help_text=_("Number of generated chunks of measurements.")
+                                              )
+    chunks_total = models.PositiveIntegerField(default=0,
+                                               help_text=_("Number of all chunks of measurements.")
+                                               )
+    path = models.CharField(max_length=255,
+                            blank=True,
+                            help_text=_("Path of generated zip archive.")
+                            )
+    size = models.BigIntegerField(null=True,
+                                  blank=True,
+                                  help_text=_("Size of generated zip archive in bytes.")
+                                  )
+    error = models.TextField(blank=True)
+    date_created = models.DateTimeField(_('date created'),
+                                        default=timezone.now
+                                        )
+    date_started = models.DateTimeField(null=True, blank=True)
+    date_finished = models.DateTimeField(null=True, blank=True)
+    date_expires = models.DateTimeField(null=True,
+                                        blank=True,
+                                        db_index=True,
+                                        help_text=_("Date when zip archive is removed.")
+                                        )
+
+    class Meta:
+        ordering = ('-date_created',)
+
+    def __str__(self) -> str:
+        return str(self.id)
+
+    @property
+    def progress(self) -> float:
+        """Percent of export that is done."""
+        if self.status == self.DONE:
+            return 100.0
+        if not self.chunks_total:
+            return 0.0
+        return round(100.0 * self.chunks_done / self.chunks_total, 1)
+
+    @property
+    def eta(self) -> Optional[float]:
+        """Estimated seconds until export is done, from average time of finished chunks."""
+        if self.status != self.RUNNING or not self.chunks_done or not self.date_started:
+            return None
+        elapsed = (timezone.now() - self.date_started).total_seconds()
+        return round(elapsed / self.chunks_done * (self.chunks_total - self.chunks_done), 1)
+
+    def remove_file(self) -> None:
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class MongoSyncWatermark(models.Model):
+    """Last measurement that is synced to Mongo DB collection.
+    Measurements are synced in order of (date_updated, sample_id), so
+    sync continues after last saved watermark.
+    """
+    db = models.CharField(max_length=127)
+    collection = models.CharField(max_length=127)
+    last_updated = models.DateTimeField(null=True,
+                                        blank=True,
+                                        help_text=_("date_updated of last synced measurement.")
+                                        )
+    last_sample_id = models.IntegerField(null=True,
+                                         blank=True,
+                                         help_text=_("ID of last synced measurement.")
+                                         )
+    synced = models.PositiveIntegerField(default=0,
+                                         help_text=_("Number of synced measurements.")
+                                         )
+    date_synced = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ("db", "collection")
+
+    def __str__(self) -> str:
+        return "{}.{}".format(self.db, self.collection)
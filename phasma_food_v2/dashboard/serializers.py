@@ -1,9 +1,13 @@
-from typing import Any
+from typing import Any, Optional
 
+from django.urls import reverse
 from rest_framework import serializers
 from django.utils.translation import gettext_lazy as _
 
 from phasma_food_v2.measurements.models import Measurement
+from .dataset import DATASET_FORMATS
+from .models import ExportJob
+from .utils import mongo_collection_name
 
 
 class ListMeasurementSerializer(serializers.Serializer):
@@ -83,6 +87,43 @@ class MeasurementDownloadSerializer(serializers.Serializer):
     )
 
 
+class ExportJobSerializer(serializers.ModelSerializer):
+    """Status of export job, download URL is set when zip archive is ready."""
+    progress = serializers.FloatField(read_only=True)
+    eta = serializers.FloatField(read_only=True)
+    download = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ExportJob
+        fields = ["id", "status", "progress", "eta", "size", "error", "download",
+                  "date_created", "date_started", "date_finished", "date_expires"]
+        read_only_fields = fields
+
+    def get_download(self, instance: ExportJob) -> Optional[str]:
+        if instance.status != ExportJob.DONE:
+            return None
+        url = reverse("download_export_job", kwargs={"pk": instance.pk})
+        request = self.context.get("request")
+        return request.build_absolute_uri(url) if request else url
+
+
+class MeasurementDatasetSerializer(serializers.Serializer):
+    """Filters of measurements that are exported as one dataset file."""
+    measurements = serializers.ListField(
+        child=serializers.CharField(max_length=254),
+        required=False
+    )
+    useCase = serializers.CharField(source="use_case", max_length=127, required=False)
+    foodType = serializers.CharField(source="food_type", max_length=127, required=False)
+    format = serializers.ChoiceField(choices=list(DATASET_FORMATS), default="npz")
+
+    def validate(self, attrs: dict) -> Any:
+        """At least one filter is required, so whole DB is not exported by mistake."""
+        if not any(attrs.get(name) for name in ("measurements", "use_case", "food_type")):
+            raise serializers.ValidationError(_("Select measurements, use case or food type."))
+        return attrs
+
+
 class MeasurementMongoSerializer(serializers.Serializer):
     """Measurements list to be saved to Mongo DB."""
     measurements = serializers.ListField(
@@ -112,7 +153,7 @@ class MeasurementMongoSerializer(serializers.Serializer):
             "use_case",
             "food_type"
         )
-        collections_names = ["_".join(name).replace(" ", "").lower() for name in check_use_cases]
+        collections_names = [mongo_collection_name(*name) for name in check_use_cases]
         if len(collections_names) > 1:
             raise serializers.ValidationError(
                 _('You have selected more than one use case and food type {} when one per push is allowed.').format(
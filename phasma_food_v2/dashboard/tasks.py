@@ -1,28 +1,105 @@
 import os
-import shutil
-from typing import List
+import logging
+from datetime import timedelta
+from typing import List, Optional, Tuple
 
 from django.conf import settings
+from django.core.cache import cache
 from django.core.mail import EmailMessage
-from celery import shared_task
+from django.db.models import F, Q
+from django.utils import timezone
+from celery import chord, shared_task
+from celery.canvas import Signature
 
 from phasma_food_v2.measurements.models import Measurement
+from phasma_food_v2.measurements.spectrum import Spectrum, as_float_list
 from phasma_food_v2.samples.mongo_db import MongoDB
-from .utils import excel_zip
+from .models import ExportJob, MongoSyncWatermark
+from .utils import (
+    archive_name, build_chunk, export_chunks, export_path, mongo_collection_name,
+    white_references_prefetched, write_zip
+)
+
+logger = logging.getLogger(__name__)
+MONGO_SYNC_LOCK = "mongo-sync"
+
+MONGO_VIS_BLOCKS = (
+    ("data", "rawData"), ("avgData", "avgData"), ("dark", "rawDark"), ("avgDark", "avgDark"),
+    ("white", "rawWhite"), ("avgWhite", "avgWhite"), ("preprocessed", "preprocessed"),
+    ("darkReference", "darkReference"), ("whiteReference", "whiteReference")
+)
+MONGO_FLUO_BLOCKS = MONGO_VIS_BLOCKS
+MONGO_NIR_BLOCKS = (
+    ("preprocessed", "preprocessed"), ("darkReference", "darkReference"), ("whiteReference", "whiteReference")
+)
+
+
+def export_in_chunks(measurements: List[str], callback: Signature, job_id: str = None) -> int:
+    """Generate excel files of export in parallel chunk tasks (Celery chord) and
+    run callback when all chunks are in workbook cache. Chunks run in Celery worker
+    processes, `iter_workbooks` itself never starts processes.
+    Callback writes archive from cache, chunks that are missing from cache
+    (e.g. cache folder is not shared by all workers) are generated again.
+
+    Parameters:
+        measurements (list): Measurement IDs
+        callback (obj): Task signature that writes archive
+        job_id (str): Export job whose progress is updated by chunk tasks
+
+    Returns:
+        chunks (int): Number of chunk tasks, 0 when export is not split and callback is not run
+    """
+    chunks = export_chunks(measurements)
+    if settings.EXPORT_WORKERS <= 1 or len(chunks) <= 1:
+        return 0
+    if job_id:
+        ExportJob.objects.filter(pk=job_id).update(chunks_done=0, chunks_total=len(chunks))
+    chord(build_export_chunk.si(chunk, job_id) for chunk in chunks)(callback)
+    return len(chunks)
+
+
+@shared_task
+def build_export_chunk(sample_ids: List[int], job_id: str = None) -> int:
+    """Generate excel files of chunk into workbook cache.
+
+    Parameters:
+        sample_ids (list): Measurement IDs of chunk
+        job_id (str): Export job whose progress is updated
+
+    Returns:
+        count (int): Number of measurements in chunk
+    """
+    try:
+        build_chunk(sample_ids)
+    except Exception as error:
+        if job_id:
+            ExportJob.objects.filter(pk=job_id).update(status=ExportJob.FAILED, error=str(error),
+                                                      date_finished=timezone.now())
+        raise
+    if job_id:
+        ExportJob.objects.filter(pk=job_id).update(chunks_done=F("chunks_done") + 1)
+    return len(sample_ids)
 
 
 @shared_task
-def create_excel_to_zip(email: str, measurements: List[str]) -> None:
-    """Task check if excel files and zip are prepared.
-    If not, it will create them and send via email.
+def create_excel_to_zip(email: str, measurements: List[str], path: str = None, prepared: bool = False) -> None:
+    """Send zip archive with excel files via email.
+    Archive that is already written while it was downloaded is reused,
+    otherwise excel files are generated, in chunk tasks when there are more chunks.
+
+    Parameters:
+        email (str): User email
+        measurements (list): Measurement IDs
+        path (str): Path of zip archive that is already written
+        prepared (bool): Excel files are already generated by chunk tasks
     """
-    folder_name = email.split("@")[0]
-    location = settings.MEDIA_ROOT
-    full_folder_path = "{}/excel/".format(location)
-    if not os.path.exists("{}{}".format(full_folder_path, folder_name)):
-        full_folder_path, folder_name = excel_zip(
-            email=email,
-            measurements=measurements
+    if not path or not os.path.exists(path):
+        if not prepared and export_in_chunks(measurements, create_excel_to_zip.si(email, measurements, prepared=True)):
+            return
+        path = write_zip(
+            export_path(),
+            measurements,
+            progress=lambda done, total: logger.info("Export for %s: %s/%s chunks finished", email, done, total)
         )
     message = EmailMessage(
         subject="Collection of PhasmaFOOD measurements",
@@ -32,151 +109,241 @@ def create_excel_to_zip(email: str, measurements: List[str]) -> None:
         to=[email],
     )
     message.content_subtype = "html"
-    message.attach_file("{}{}.zip".format(
-        full_folder_path,
-        folder_name.replace(".", ""))
-    )
+    with open(path, "rb") as file:
+        message.attach(archive_name(email), file.read(), "application/zip")
     message.send()
-    shutil.rmtree("{}{}".format(
-        full_folder_path,
-        folder_name)
-    )
-    os.remove("{}{}.zip".format(
-        full_folder_path,
-        folder_name.replace(".", ""))
+    os.remove(path)
+
+
+@shared_task
+def run_export_job(job_id: str, prepared: bool = False) -> None:
+    """Generate zip archive of export job and save progress after every chunk.
+    Excel files of bigger exports are generated by chunk tasks first,
+    then this task runs again to write archive.
+
+    Parameters:
+        job_id (str): Export job ID
+        prepared (bool): Excel files are already generated by chunk tasks
+    """
+    job = ExportJob.objects.get(pk=job_id)
+    if job.status != (ExportJob.RUNNING if prepared else ExportJob.PENDING):
+        return
+    if not prepared:
+        ExportJob.objects.filter(pk=job.pk).update(status=ExportJob.RUNNING, date_started=timezone.now())
+        if export_in_chunks(job.measurements, run_export_job.si(job_id, prepared=True), job_id=job_id):
+            return
+
+    def progress(done: int, total: int) -> None:
+        ExportJob.objects.filter(pk=job.pk).update(chunks_done=done, chunks_total=total)
+
+    path = export_path()
+    try:
+        write_zip(path, job.measurements, progress=progress)
+    except Exception as error:
+        if os.path.exists(path):
+            os.remove(path)
+        ExportJob.objects.filter(pk=job.pk).update(status=ExportJob.FAILED, error=str(error),
+                                                  date_finished=timezone.now())
+        raise
+
+    finished = timezone.now()
+    ExportJob.objects.filter(pk=job.pk).update(
+        status=ExportJob.DONE,
+        path=path,
+        size=os.path.getsize(path),
+        date_finished=finished,
+        date_expires=finished + timedelta(hours=settings.EXPORT_JOB_TTL_HOURS)
     )
 
 
+@shared_task
+def expire_export_jobs() -> None:
+    """Remove zip archives of export jobs that are expired."""
+    expired = ExportJob.objects.filter(status=ExportJob.DONE, date_expires__lte=timezone.now())
+    for job in expired:
+        job.remove_file()
+    count = expired.update(status=ExportJob.EXPIRED, path="")
+    if count:
+        logger.info("Removed %s expired exports", count)
+
+
+def spectrum_to_mongo(spectrum: Optional[Spectrum], wave_key: str, blocks: tuple) -> dict:
+    """Flat lists of measurements for every block of spectrum
+    in format that is used by Mongo DB collections.
+
+    Parameters:
+        spectrum (obj): Spectrum of one sensor
+        wave_key (str): Block that wavelength axis is taken from
+        blocks (tuple): Pairs of Mongo key and spectrum block
+
+    Returns:
+        data (dict): Sensor data for Mongo DB document
+    """
+    if not spectrum:
+        return {}
+    data = {}
+    wave = spectrum.wave(wave_key)
+    if wave is not None:
+        data["wave"] = as_float_list(wave)
+    for mongo_key, block in blocks:
+        values = spectrum.array(block)
+        if values is not None:
+            data[mongo_key] = as_float_list(values.ravel())
+    return data
+
+
+def measurement_to_mongo(measurement: Measurement, white_reference: Optional[Measurement]) -> dict:
+    """Mongo DB document of measurement.
+
+    Parameters:
+        measurement (obj): Measurement
+        white_reference (obj): White reference measurement of measurement
+
+    Returns:
+        mongo_dict (dict): Document that is pushed to Mongo DB
+    """
+    mongo_dict = {"sampleId": measurement.sample_id, "laboratory": measurement.laboratory,
+                  "foodType": measurement.food_type, "useCase": measurement.use_case,
+                  "granularity": measurement.granularity, "mycotoxins": measurement.mycotoxins,
+                  "temperature": measurement.temperature,
+                  "tempExposureHours": measurement.temperature_exposure_hours,
+                  "microbioSampleId": measurement.microbiological_id,
+                  "microbiologicalUnit": measurement.microbiological_unit,
+                  "microbiologicalValue": measurement.microbiological_value,
+                  "otherSpecies": measurement.other_species, "foodSubtype": measurement.food_subtype,
+                  "adulterationSampleId": measurement.adulteration_id, "alcoholLabel": measurement.alcohol_label,
+                  "authentic": measurement.authentic, "puritySMP": measurement.purity_smp,
+                  "lowValueFiller": measurement.low_value_filler, "nitrogenEnhancer": measurement.nitrogen_enhancer,
+                  "hazardOneName": measurement.hazard_one_name, "hazardOnePct": measurement.hazard_one_pct,
+                  "hazardTwoName": measurement.hazard_two_name, "hazardTwoPct": measurement.hazard_two_pct,
+                  "dilutedPct": measurement.diluted_pct, "package": measurement.package,
+                  "dateTime": measurement.date_created.isoformat(), "adul": measurement.adulterated,
+                  "configuration": measurement.configuration,
+                  "whiteReferenceTime": measurement.white_reference_time,
+                  "aflatoxin": {
+                      "name": measurement.aflatoxin_name,
+                      "value": measurement.aflatoxin_value,
+                      "unit": measurement.aflatoxin_unit
+                  }
+                  }
+
+    mongo_dict["VIS"] = spectrum_to_mongo(measurement.vis, wave_key="rawData", blocks=MONGO_VIS_BLOCKS)
+    if measurement.vis and white_reference and white_reference.vis:
+        dark_for_white = white_reference.vis.array("rawDark")
+        if dark_for_white is not None:
+            mongo_dict["VIS"]["dark_for_white"] = as_float_list(dark_for_white.ravel())
+    mongo_dict["NIR"] = spectrum_to_mongo(measurement.nir, wave_key="preprocessed", blocks=MONGO_NIR_BLOCKS)
+    mongo_dict["FLUO"] = spectrum_to_mongo(measurement.fluo, wave_key="rawData", blocks=MONGO_FLUO_BLOCKS)
+
+    return mongo_dict
+
+
 @shared_task
 def save_to_mongo(
     measurements: List[str], db: str = settings.MONGO_DEFAULT_DB, collection: str = settings.MONGO_DEFAULT_COLLECTION
-) -> None:
-    """Push measurement from Postgresql to Mongo DB."""
-
-    measurements_all = Measurement.objects.all()
-    measurements_filtered = measurements_all.filter(sample_id__in=measurements)
-    for measurement in measurements_filtered:
-        measurement_data_time = measurement.date_created
-        white_reference = measurements_all.filter(
-            use_case="White Reference"
-        ).filter(
-            date_created__lt=measurement_data_time
-        ).order_by(
-            '-date_created'
-        ).first()
-        mongo_dict = {"sampleId": measurement.sample_id, "laboratory": measurement.laboratory,
-                      "foodType": measurement.food_type, "useCase": measurement.use_case,
-                      "granularity": measurement.granularity, "mycotoxins": measurement.mycotoxins,
-                      "temperature": measurement.temperature,
-                      "tempExposureHours": measurement.temperature_exposure_hours,
-                      "microbioSampleId": measurement.microbiological_id,
-                      "microbiologicalUnit": measurement.microbiological_unit,
-                      "microbiologicalValue": measurement.microbiological_value,
-                      "otherSpecies": measurement.other_species, "foodSubtype": measurement.food_subtype,
-                      "adulterationSampleId": measurement.adulteration_id, "alcoholLabel": measurement.alcohol_label,
-                      "authentic": measurement.authentic, "puritySMP": measurement.purity_smp,
-                      "lowValueFiller": measurement.low_value_filler, "nitrogenEnhancer": measurement.nitrogen_enhancer,
-                      "hazardOneName": measurement.hazard_one_name, "hazardOnePct": measurement.hazard_one_pct,
-                      "hazardTwoName": measurement.hazard_two_name, "hazardTwoPct": measurement.hazard_two_pct,
-                      "dilutedPct": measurement.diluted_pct, "package": measurement.package,
-                      "dateTime": measurement.date_created.isoformat(), "adul": measurement.adulterated,
-                      "configuration": measurement.configuration,
-                      "whiteReferenceTime": measurement.white_reference_time,
-                      "aflatoxin": {
-                          "name": measurement.aflatoxin_name,
-                          "value": measurement.aflatoxin_value,
-                          "unit": measurement.aflatoxin_unit
-                      }
-                      }
-
-        if measurement.vis:
-            wave = [data["wave"] for data in measurement.vis["rawData"][0]]
-            mongo_dict["VIS"] = {"wave": wave}
-
-            raw_data = [x["measurement"] for data in measurement.vis["rawData"] for x in data]
-            mongo_dict["VIS"] = {"data": raw_data}
-
-            avg_data = [data["measurement"] for data in measurement.vis["avgData"]]
-            mongo_dict["VIS"].update({"avgData": avg_data})
-
-            if white_reference:
-                raw_dark_for_white = [data["measurement"] for data in white_reference.vis["rawDark"]]
-                mongo_dict["VIS"].update({"dark_for_white": raw_dark_for_white})
-
-            raw_dark = [x["measurement"] for data in measurement.vis["rawDark"] for x in data]
-            mongo_dict["VIS"].update({"dark": raw_dark})
-
-            avg_dark = [data["measurement"] for data in measurement.vis["avgDark"]]
-            mongo_dict["VIS"].update({"avgDark": avg_dark})
-
-            raw_white = [x["measurement"] for data in measurement.vis["rawWhite"] for x in data]
-            mongo_dict["VIS"].update({"white": raw_white})
-
-            avg_white = [data["measurement"] for data in measurement.vis["avgWhite"]]
-            mongo_dict["VIS"].update({"avgWhite": avg_white})
-
-            preprocessed = [data["measurement"] for data in measurement.vis["preprocessed"]]
-            mongo_dict["VIS"].update({"preprocessed": preprocessed})
-
-            dark_reference = [data["measurement"] for data in measurement.vis["darkReference"]]
-            mongo_dict["VIS"].update({"darkReference": dark_reference})
-
-            white_reference = [data["measurement"] for data in measurement.vis["whiteReference"]]
-            mongo_dict["VIS"].update({"whiteReference": white_reference})
-        else:
-            mongo_dict["VIS"] = {}
-
-        if measurement.nir:
-            wave = [data["wave"] for data in measurement.nir["preprocessed"]]
-            mongo_dict["NIR"] = {"wave": wave}
-
-            preprocessed = [data["measurement"] for data in measurement.nir["preprocessed"]]
-            mongo_dict["NIR"] = {"preprocessed": preprocessed}
-
-            dark_reference = [data["measurement"] for data in measurement.nir["darkReference"]]
-            mongo_dict["NIR"].update({"darkReference": dark_reference})
-
-            white_reference = [data["measurement"] for data in measurement.nir["whiteReference"]]
-            mongo_dict["NIR"].update({"whiteReference": white_reference})
-        else:
-            mongo_dict["NIR"] = {}
-
-        if measurement.fluo:
-            wave = [data["wave"] for data in measurement.fluo["rawData"][0]]
-            mongo_dict["FLUO"] = {"wave": wave}
-
-            raw_data = [x["measurement"] for data in measurement.fluo["rawData"] for x in data]
-            mongo_dict["FLUO"] = {"data": raw_data}
-
-            avg_data = [data["measurement"] for data in measurement.fluo["avgData"]]
-            mongo_dict["FLUO"].update({"avgData": avg_data})
-
-            raw_dark = [x["measurement"] for data in measurement.fluo["rawDark"] for x in data]
-            mongo_dict["FLUO"].update({"dark": raw_dark})
-
-            avg_dark = [data["measurement"] for data in measurement.fluo["avgDark"]]
-            mongo_dict["FLUO"].update({"avgDark": avg_dark})
-
-            raw_white = [x["measurement"] for data in measurement.fluo["rawWhite"] for x in data]
-            mongo_dict["FLUO"].update({"white": raw_white})
-
-            avg_white = [data["measurement"] for data in measurement.fluo["avgWhite"]]
-            mongo_dict["FLUO"].update({"avgWhite": avg_white})
-
-            preprocessed = [data["measurement"] for data in measurement.fluo["preprocessed"]]
-            mongo_dict["FLUO"].update({"preprocessed": preprocessed})
-
-            dark_reference = [data["measurement"] for data in measurement.fluo["darkReference"]]
-            mongo_dict["FLUO"].update({"darkReference": dark_reference})
-
-            white_reference = [data["measurement"] for data in measurement.fluo["whiteReference"]]
-            mongo_dict["FLUO"].update({"whiteReference": white_reference})
-        else:
-            mongo_dict["FLUO"] = {}
+) -> dict:
+    """Push measurements from Postgresql to Mongo DB in batches of MONGO_BATCH_SIZE.
+    Documents are upserted by sampleId, so pushing measurement again replaces it.
 
-        client = MongoDB()
-        client.insert_one(
-            measurement=mongo_dict,
-            db=db,
-            collection=collection
-        )
+    Returns:
+        total (dict): Number of inserted, updated and failed documents
+    """
+    client = MongoDB()
+    batch_size = max(settings.MONGO_BATCH_SIZE, 1)
+    total = {"inserted": 0, "updated": 0, "failed": 0}
+    for start in range(0, len(measurements), batch_size):
+        documents = [
+            measurement_to_mongo(measurement, measurement.white_reference)
+            for measurement in white_references_prefetched(measurements[start:start + batch_size])
+        ]
+        summary = client.bulk_upsert(documents, key="sampleId", db=db, collection=collection)
+        logger.info("Pushed measurements %s-%s to %s.%s: %s", start, start + len(documents), db, collection, summary)
+        for name in total:
+            total[name] += summary[name]
+    return total
+
+
+@shared_task
+def sync_to_mongo() -> dict:
+    """Push new and changed measurements to Mongo DB collection of their use case
+    and food type. Every collection has watermark with last synced measurement,
+    measurements after it are pushed in batches of MONGO_BATCH_SIZE and watermark
+    is saved after every batch, so interrupted sync continues where it stopped.
+    At most MONGO_SYNC_BATCHES batches are pushed per collection in one run.
+
+    Returns:
+        synced (dict): Collection -> number of pushed measurements
+    """
+    if not settings.MONGO_SYNC_ENABLED or not cache.add(MONGO_SYNC_LOCK, 1, timeout=settings.MONGO_SYNC_LOCK_TIMEOUT):
+        return {}
+    try:
+        collections = {}
+        for use_case, food_type in Measurement.objects.exclude(
+            use_case__isnull=True
+        ).exclude(
+            food_type__isnull=True
+        ).order_by().values_list("use_case", "food_type").distinct():
+            collections.setdefault(mongo_collection_name(use_case, food_type), []).append((use_case, food_type))
+
+        return {
+            collection: sync_collection(collection, pairs)
+            for collection, pairs in collections.items()
+        }
+    finally:
+        cache.delete(MONGO_SYNC_LOCK)
+
+
+def sync_collection(collection: str, pairs: List[Tuple[str, str]]) -> int:
+    """Push measurements after watermark of collection.
+
+    Parameters:
+        collection (str): Mongo DB collection
+        pairs (list): Use cases and food types of measurements in collection
+
+    Returns:
+        synced (int): Number of pushed measurements
+    """
+    db = settings.MONGO_SYNC_DB
+    watermark, _ = MongoSyncWatermark.objects.get_or_create(db=db, collection=collection)
+    selection = Q()
+    for use_case, food_type in pairs:
+        selection |= Q(use_case=use_case, food_type=food_type)
+    queryset = Measurement.objects.filter(
+        selection,
+        date_updated__lt=timezone.now() - timedelta(seconds=settings.MONGO_SYNC_LAG)
+    ).order_by("date_updated", "sample_id")
+    client = MongoDB()
+    batch_size = max(settings.MONGO_BATCH_SIZE, 1)
+
+    synced = 0
+    for _ in range(settings.MONGO_SYNC_BATCHES):
+        batch = queryset
+        if watermark.last_updated is not None:
+            batch = batch.filter(
+                Q(date_updated__gt=watermark.last_updated) |
+                Q(date_updated=watermark.last_updated, sample_id__gt=watermark.last_sample_id)
+            )
+        rows = list(batch.values_list("sample_id", "date_updated")[:batch_size])
+        if not rows:
+            break
+
+        documents = [
+            measurement_to_mongo(measurement, measurement.white_reference)
+            for measurement in white_references_prefetched([sample_id for sample_id, _ in rows])
+        ]
+        summary = client.bulk_upsert(documents, key="sampleId", db=db, collection=collection)
+        if summary["failed"]:
+            logger.error("Sync to %s.%s stopped, %s documents failed", db, collection, summary["failed"])
+            break
+
+        watermark.last_sample_id, watermark.last_updated = rows[-1]
+        watermark.synced += len(rows)
+        watermark.date_synced = timezone.now()
+        watermark.save()
+        synced += len(rows)
+        if len(rows) < batch_size:
+            break
+
+    if synced:
+        logger.info("Synced %s measurements to %s.%s", synced, db, collection)
+    return synced
@@ -0,0 +1,92 @@
+from io import BytesIO
+
+import numpy as np
+import pytest
+
+from phasma_food_v2.dashboard.dataset import DATASET_BLOCKS, DATASET_METADATA, dataset_sample_ids, stream_dataset
+from phasma_food_v2.measurements.models import Measurement
+
+pytestmark = pytest.mark.django_db
+
+
+def _points(waves: list, values: list) -> list:
+    return [{"wave": wave, "measurement": value} for wave, value in zip(waves, values)]
+
+
+@pytest.fixture
+def measurements(settings) -> list:
+    settings.EXPORT_CHUNK_SIZE = 2
+    Measurement.objects.create(sample_id=1, use_case="UC", food_type="FT", temperature="5",
+                               vis={"preprocessed": _points([400, 401, 402, 403, 404], [0, 1, 2, 3, 4]),
+                                    "avgData": _points([400, 401, 402, 403, 404], [5, 6, 7, 8, 9])})
+    # Other wavelength axis, interpolated to axis of first measurement
+    Measurement.objects.create(sample_id=2, use_case="UC", food_type="Other",
+                               vis={"preprocessed": _points([405, 403, 401], [50, 30, 10])})
+    Measurement.objects.create(sample_id=3, use_case="Other", food_type="FT",
+                               nir={"preprocessed": _points([900, 950], [1, 2])})
+    return [1, 2, 3]
+
+
+def _load(sample_ids: list) -> dict:
+    with np.load(BytesIO(b"".join(stream_dataset(sample_ids))), allow_pickle=False) as dataset:
+        return {name: dataset[name] for name in dataset.files}
+
+
+class TestStreamDataset:
+    def test_every_block_and_metadata_column_is_saved(self, measurements):
+        dataset = _load(measurements)
+
+        names = {name for name, _ in DATASET_METADATA}
+        for sensor, blocks in DATASET_BLOCKS.items():
+            names.add("{}_wave".format(sensor))
+            names.update("{}_{}".format(sensor, block) for block in blocks)
+        assert set(dataset) == names
+        for sensor, blocks in DATASET_BLOCKS.items():
+            for block in blocks:
+                matrix = dataset["{}_{}".format(sensor, block)]
+                assert matrix.dtype == np.float32
+                assert matrix.shape == (3, dataset["{}_wave".format(sensor)].size)
+
+    def test_metadata_columns(self, measurements):
+        dataset = _load(measurements)
+
+        assert dataset["sample_id"].tolist() == [1, 2, 3]
+        assert dataset["use_case"].tolist() == ["UC", "UC", "Other"]
+        assert dataset["white_reference_id"].tolist() == [-1, -1, -1]
+        assert dataset["temperature"][0] == 5
+        assert np.isnan(dataset["temperature"][1:]).all()
+        assert dataset["date_created"].dtype == np.dtype("datetime64[ms]")
+
+    def test_blocks_are_interpolated_to_axis_of_first_measurement(self, measurements):
+        dataset = _load(measurements)
+
+        assert dataset["vis_wave"].tolist() == [400, 401, 402, 403, 404]
+        np.testing.assert_array_equal(dataset["vis_preprocessed"], [
+            [0, 1, 2, 3, 4],
+            [np.nan, 10, 20, 30, 40],
+            [np.nan] * 5,
+        ])
+        np.testing.assert_array_equal(dataset["vis_avgData"], [
+            [5, 6, 7, 8, 9],
+            [np.nan] * 5,
+            [np.nan] * 5,
+        ])
+
+    def test_rows_before_first_sensor_axis_are_padded(self, measurements):
+        dataset = _load(measurements)
+
+        assert dataset["nir_wave"].tolist() == [900, 950]
+        np.testing.assert_array_equal(dataset["nir_preprocessed"], [[np.nan, np.nan], [np.nan, np.nan], [1, 2]])
+        assert dataset["fluo_wave"].size == 0
+        assert dataset["fluo_preprocessed"].shape == (3, 0)
+
+    def test_order_of_sample_ids_is_kept(self, measurements):
+        assert _load([3, 1])["sample_id"].tolist() == [3, 1]
+
+
+class TestDatasetSampleIds:
+    def test_filters(self, measurements):
+        assert sorted(dataset_sample_ids()) == [1, 2, 3]
+        assert sorted(dataset_sample_ids(use_case="UC")) == [1, 2]
+        assert dataset_sample_ids(use_case="UC", food_type="FT") == [1]
+        assert sorted(dataset_sample_ids(measurements=["2", "3"])) == [2, 3]
@@ -0,0 +1,133 @@
+from datetime import timedelta
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+
+from phasma_food_v2.dashboard import tasks
+from phasma_food_v2.dashboard.models import ExportJob, MongoSyncWatermark
+from phasma_food_v2.measurements.models import Measurement
+
+pytestmark = pytest.mark.django_db
+
+
+class FakeMongoDB:
+    """Records upserted sample IDs, documents of `fail` batch fail."""
+    batches = []
+    fail = None
+
+    def bulk_upsert(self, documents: list, key: str, db: str, collection: str) -> dict:
+        sample_ids = sorted(document[key] for document in documents)
+        self.batches.append(sample_ids)
+        if len(self.batches) == self.fail:
+            return {"inserted": 0, "updated": 0, "failed": len(sample_ids)}
+        return {"inserted": len(sample_ids), "updated": 0, "failed": 0}
+
+
+@pytest.fixture
+def mongo(settings, monkeypatch) -> FakeMongoDB:
+    settings.MONGO_BATCH_SIZE = 2
+    settings.MONGO_SYNC_BATCHES = 10
+    settings.MONGO_SYNC_LAG = 60
+    FakeMongoDB.batches, FakeMongoDB.fail = [], None
+    monkeypatch.setattr(tasks, "MongoDB", FakeMongoDB)
+    monkeypatch.setattr(tasks, "measurement_to_mongo",
+                        lambda measurement, white_reference: {"sampleId": measurement.sample_id})
+    return FakeMongoDB
+
+
+@pytest.fixture
+def measurements() -> list:
+    updated = timezone.now() - timedelta(hours=1)
+    for sample_id in range(1, 6):
+        Measurement.objects.create(sample_id=sample_id, use_case="UC", food_type="FT")
+    # Same date_updated, order is decided by sample ID
+    Measurement.objects.update(date_updated=updated)
+    return [1, 2, 3, 4, 5]
+
+
+def _sync() -> int:
+    return tasks.sync_collection("uc_ft", [("UC", "FT")])
+
+
+def _watermark() -> MongoSyncWatermark:
+    return MongoSyncWatermark.objects.get(collection="uc_ft")
+
+
+class TestSyncCollection:
+    def test_sync_continues_after_watermark(self, settings, mongo, measurements):
+        settings.MONGO_SYNC_BATCHES = 2
+
+        assert _sync() == 4
+        assert _watermark().last_sample_id == 4
+        assert _sync() == 1
+        assert _sync() == 0
+        assert mongo.batches == [[1, 2], [3, 4], [5]]
+        assert _watermark().synced == 5
+
+    def test_changed_measurement_is_synced_again(self, mongo, measurements):
+        _sync()
+        Measurement.objects.filter(sample_id=2).update(date_updated=timezone.now() - timedelta(minutes=30))
+
+        assert _sync() == 1
+        assert mongo.batches[-1] == [2]
+
+    def test_recently_updated_measurements_wait_for_next_run(self, mongo, measurements):
+        Measurement.objects.filter(sample_id=5).update(date_updated=timezone.now())
+
+        assert _sync() == 4
+        assert 5 not in sum(mongo.batches, [])
+
+    def test_sync_stops_on_failed_batch(self, mongo, measurements):
+        mongo.fail = 2
+
+        assert _sync() == 2
+        assert mongo.batches == [[1, 2], [3, 4]]
+        assert _watermark().last_sample_id == 2
+
+        mongo.fail = None
+        assert _sync() == 3
+        assert mongo.batches[2:] == [[3, 4], [5]]
+
+
+class TestSaveToMongo:
+    def test_measurements_are_pushed_in_batches(self, mongo, measurements):
+        assert tasks.save_to_mongo([str(sample_id) for sample_id in measurements], db="db", collection="uc_ft") == {
+            "inserted": 5, "updated": 0, "failed": 0
+        }
+        assert mongo.batches == [[1, 2], [3, 4], [5]]
+
+    def test_failed_batch_is_counted(self, mongo, measurements):
+        mongo.fail = 2
+
+        assert tasks.save_to_mongo(measurements) == {"inserted": 3, "updated": 0, "failed": 2}
+        assert len(mongo.batches) == 3
+
+
+class TestExportInChunks:
+    @pytest.fixture
+    def chords(self, settings, monkeypatch) -> list:
+        settings.EXPORT_CHUNK_SIZE = 2
+        chords = []
+        monkeypatch.setattr(tasks, "chord", lambda header: lambda callback: chords.append((list(header), callback)))
+        return chords
+
+    def test_chunks_run_in_parallel_tasks(self, settings, chords, measurements):
+        settings.EXPORT_WORKERS = 4
+        user = get_user_model().objects.create_user(email="user@example.com", password="password")
+        job = ExportJob.objects.create(owner=user, measurements=measurements)
+
+        assert tasks.export_in_chunks(measurements, "callback", job_id=str(job.pk)) == 3
+        header, callback = chords[0]
+        # Newest measurements first, same as order of measurements in DB
+        assert [signature.args[0] for signature in header] == [[5, 4], [3, 2], [1]]
+        assert callback == "callback"
+        job.refresh_from_db()
+        assert (job.chunks_done, job.chunks_total) == (0, 3)
+
+    @pytest.mark.parametrize("workers, sample_ids", [(1, [1, 2, 3]), (4, [1, 2])])
+    def test_export_is_not_split(self, settings, chords, measurements, workers, sample_ids):
+        settings.EXPORT_WORKERS = workers
+
+        assert tasks.export_in_chunks(sample_ids, "callback") == 0
+        assert chords == []
@@ -0,0 +1,113 @@
+from io import BytesIO
+
+import openpyxl
+import pytest
+
+from phasma_food_v2.dashboard import utils
+from phasma_food_v2.measurements.models import Measurement
+from phasma_food_v2.measurements.spectrum import Spectrum
+
+
+def _chunk(sample_ids: list) -> list:
+    return [("{}.xlsx".format(sample_id), b"") for sample_id in sample_ids]
+
+
+class TestIterWorkbooks:
+    @pytest.fixture
+    def chunks(self, monkeypatch) -> list:
+        built = []
+        monkeypatch.setattr(utils, "export_chunks", lambda measurements: [[1, 2], [3], [4, 5]])
+        monkeypatch.setattr(utils, "build_chunk", lambda sample_ids: built.append(sample_ids) or _chunk(sample_ids))
+        return built
+
+    def test_chunks_are_yielded_in_order(self, chunks):
+        progress = []
+
+        files = list(utils.iter_workbooks(["1"], lambda done, total: progress.append((done, total))))
+
+        assert [name for name, _ in files] == ["{}.xlsx".format(sample_id) for sample_id in range(1, 6)]
+        assert progress == [(1, 3), (2, 3), (3, 3)]
+
+    def test_closed_generator_does_not_build_next_chunks(self, chunks, monkeypatch):
+        evicted = []
+        monkeypatch.setattr(utils.workbook_cache, "evict_if_needed", lambda: evicted.append(True))
+        files = utils.iter_workbooks(["1"])
+
+        assert next(files) == ("1.xlsx", b"")
+        files.close()
+
+        assert chunks == [[1, 2]]
+        assert evicted == [True]
+
+
+def _points(offset: float, count: int = 3) -> list:
+    return [{"wave": 400 + i, "measurement": offset + i} for i in range(count)]
+
+
+class TestColumnSpec:
+    def test_columns(self):
+        assert utils.column_spec(["wave", "preprocessed", "rawData1", "rawData10", "correctedWhite",
+                                  "rawDarkforWhite3"]) == [
+            ("measurement", "wave", None),
+            ("measurement", "preprocessed", None),
+            ("measurement", "rawData", 0),
+            ("measurement", "rawData", 9),
+            ("measurement", "whiteReference", None),
+            ("white_reference", "rawDark", 2),
+        ]
+
+    def test_every_sheet_column_has_source(self):
+        for _, _, header in utils.SHEETS:
+            assert len(utils.column_spec(header)) == len(header)
+
+
+class TestSheetRows:
+    def test_rows_go_from_last_wavelength(self):
+        spectrum = {"preprocessed": _points(0), "rawData": [_points(10), _points(20)]}
+        white_reference = {"rawDark": [_points(30)]}
+        spec = utils.column_spec(["wave", "preprocessed", "rawData2", "rawData3", "rawDarkforWhite1", "avgData"])
+
+        assert utils.sheet_rows(spectrum, white_reference, spec) == [
+            [402, 2, 22, None, 32, None],
+            [401, 1, 21, None, 31, None],
+            [400, 0, 20, None, 30, None],
+        ]
+        assert spectrum["rawData"][1] == _points(20)
+
+    def test_packed_and_legacy_spectrum_give_same_rows(self):
+        spectrum = {"preprocessed": _points(0.5), "rawData": [_points(1.5)], "avgData": _points(2.5)}
+        spec = utils.column_spec(utils.HEADER_FLUO)
+
+        assert utils.sheet_rows(Spectrum.from_legacy(spectrum), None, spec) == utils.sheet_rows(spectrum, None, spec)
+
+    def test_spectrum_without_preprocessed_values(self):
+        spec = utils.column_spec(utils.HEADER_NIR)
+
+        assert utils.sheet_rows(None, None, spec) == []
+        assert utils.sheet_rows({"rawData": [_points(0)]}, None, spec) == []
+
+
+class TestBuildWorkbook:
+    def test_workbook_layout(self):
+        measurement = Measurement(
+            sample_id=7, use_case="Mycotoxins detection", food_type="Maize flour", aflatoxin_value="5",
+            nir=Spectrum.from_legacy({"preprocessed": _points(0), "darkReference": _points(10)}),
+        )
+        white_reference = Measurement(sample_id=6, vis=Spectrum.from_legacy({"rawDark": [_points(30)]}))
+
+        name, content = utils.build_workbook(measurement, white_reference)
+
+        assert name.endswith("-Maize flour-7.xlsx")
+        workbook = openpyxl.load_workbook(BytesIO(content), read_only=True)
+        assert workbook.sheetnames == ["Sample Info", "VIS", "NIR", "FLUO"]
+
+        def rows(title: str) -> list:
+            return [list(row) for row in workbook[title].iter_rows(values_only=True)]
+
+        assert rows("Sample Info") == [
+            utils.HEADER_MYCOTOXINS_DETECTION, ["Maize flour", None, None, None, None, "5"]
+        ]
+        # Empty cells at the end of row are not written
+        assert rows("NIR") == [utils.HEADER_NIR, [402, 2, 12], [401, 1, 11], [400, 0, 10]]
+        assert rows("VIS") == [utils.HEADER_VIS]
+        assert rows("FLUO") == [utils.HEADER_FLUO]
@@ -0,0 +1,147 @@
+import io
+import os
+import zipfile
+
+import pytest
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from phasma_food_v2.dashboard.models import ExportJob
+from phasma_food_v2.dashboard import views
+from phasma_food_v2.dashboard.views import ExportJobDownload, download_export_job, download_measurement
+
+CONTENT = bytes(range(100))
+
+
+class TestParseRange:
+    @pytest.mark.parametrize("header, expected", [
+        ("bytes=0-9", (0, 9)),
+        ("bytes=10-", (10, 99)),
+        ("bytes=90-200", (90, 99)),
+        ("bytes=-10", (90, 99)),
+        ("bytes=-200", (0, 99)),
+        (" bytes=0-0 ", (0, 0)),
+    ])
+    def test_satisfiable_range(self, header, expected):
+        assert ExportJobDownload.parse_range(header, 100) == expected
+
+    @pytest.mark.parametrize("header", ["bytes=100-", "bytes=100-200", "bytes=20-10", "bytes=-0"])
+    def test_out_of_bounds_range(self, header):
+        assert ExportJobDownload.parse_range(header, 100) is False
+
+    @pytest.mark.parametrize("header", [None, "", "bytes=-", "bytes=a-b", "items=0-9", "bytes=0-9,20-29", "0-9"])
+    def test_malformed_range_is_ignored(self, header):
+        assert ExportJobDownload.parse_range(header, 100) is None
+
+    def test_empty_file(self):
+        assert ExportJobDownload.parse_range("bytes=0-", 0) is False
+
+
+@pytest.mark.django_db
+class TestExportJobDownload:
+    @pytest.fixture
+    def job(self) -> ExportJob:
+        user = get_user_model().objects.create_user(email="user@example.com", password="password")
+        path = os.path.join(settings.MEDIA_ROOT, "export.zip")
+        with open(path, "wb") as file:
+            file.write(CONTENT)
+        return ExportJob.objects.create(owner=user, measurements=[], status=ExportJob.DONE, path=path)
+
+    @staticmethod
+    def download(job: ExportJob, **headers):
+        request = APIRequestFactory().get("/fake-url/", **headers)
+        force_authenticate(request, user=job.owner)
+        return download_export_job(request, pk=job.pk)
+
+    def test_whole_archive(self, job):
+        response = self.download(job)
+
+        assert response.status_code == 200
+        assert b"".join(response.streaming_content) == CONTENT
+        assert response["Content-Length"] == "100"
+        assert not response.has_header("Content-Range")
+
+    def test_suffix_range(self, job):
+        response = self.download(job, HTTP_RANGE="bytes=-10")
+
+        assert response.status_code == 206
+        assert b"".join(response.streaming_content) == CONTENT[90:]
+        assert response["Content-Range"] == "bytes 90-99/100"
+        assert response["Content-Length"] == "10"
+
+    def test_range_bigger_than_archive(self, job):
+        response = self.download(job, HTTP_RANGE="bytes=95-1000")
+
+        assert response.status_code == 206
+        assert b"".join(response.streaming_content) == CONTENT[95:]
+        assert response["Content-Range"] == "bytes 95-99/100"
+
+    def test_out_of_bounds_range(self, job):
+        response = self.download(job, HTTP_RANGE="bytes=100-")
+
+        assert response.status_code == 416
+        assert response["Content-Range"] == "bytes */100"
+
+    def test_malformed_range_returns_whole_archive(self, job):
+        response = self.download(job, HTTP_RANGE="bytes=x-y")
+
+        assert response.status_code == 200
+        assert b"".join(response.streaming_content) == CONTENT
+
+
+class FakeEmailTask:
+    def __init__(self):
+        self.calls = []
+
+    def delay(self, **kwargs) -> None:
+        self.calls.append(kwargs)
+
+
+@pytest.mark.django_db
+class TestMeasurementDownload:
+    @pytest.fixture
+    def email_task(self, settings, tmpdir, monkeypatch) -> FakeEmailTask:
+        settings.MEDIA_ROOT = str(tmpdir)
+        email_task = FakeEmailTask()
+        monkeypatch.setattr(views, "create_excel_to_zip", email_task)
+        monkeypatch.setattr(views, "iter_workbooks", lambda measurements: (
+            ("{}.xlsx".format(sample_id), CONTENT) for sample_id in measurements
+        ))
+        return email_task
+
+    @staticmethod
+    def download():
+        user = get_user_model().objects.create_user(email="user@example.com", password="password")
+        request = APIRequestFactory().post("/fake-url/", {"measurements": ["1", "2"]}, format="json")
+        force_authenticate(request, user=user)
+        return download_measurement(request)
+
+    @staticmethod
+    def archives() -> list:
+        return os.listdir(os.path.join(settings.MEDIA_ROOT, "excel"))
+
+    def test_finished_download_is_attached_to_email(self, email_task):
+        response = self.download()
+        content = b"".join(response.streaming_content)
+        response.close()
+
+        assert zipfile.ZipFile(io.BytesIO(content)).namelist() == ["1.xlsx", "2.xlsx"]
+        assert len(email_task.calls) == 1
+        with open(email_task.calls[0]["path"], "rb") as file:
+            assert file.read() == content
+
+    def test_disconnect_before_first_chunk(self, email_task):
+        response = self.download()
+        response.close()
+
+        assert email_task.calls == [{"email": "user@example.com", "measurements": ["1", "2"]}]
+
+    def test_disconnect_mid_stream(self, email_task):
+        response = self.download()
+        next(iter(response.streaming_content))
+        response.close()
+        response.close()
+
+        assert email_task.calls == [{"email": "user@example.com", "measurements": ["1", "2"]}]
+        assert self.archives() == []
@@ -0,0 +1,75 @@
+import pytest
+from django.core.cache import cache
+
+from phasma_food_v2.dashboard.workbook_cache import EVICT_LOCK_KEY, SIZE_KEY, WorkbookCache
+
+
+@pytest.fixture
+def workbook_cache(tmpdir) -> WorkbookCache:
+    cache.clear()
+    return WorkbookCache(root=str(tmpdir), max_size=10)
+
+
+class TestWorkbookCache:
+    def test_cache_under_limit_is_not_walked(self, workbook_cache, monkeypatch):
+        workbook_cache.put("aa", b"12345")
+        monkeypatch.setattr(workbook_cache, "files", lambda: pytest.fail("cache folder was walked"))
+
+        assert workbook_cache.evict_if_needed() == 0
+
+    def test_least_recently_used_files_are_evicted_over_limit(self, workbook_cache):
+        workbook_cache.put("aa", b"12345")
+        workbook_cache.put("bb", b"12345")
+        workbook_cache.put("cc", b"12345")
+
+        assert workbook_cache.evict_if_needed() == 1
+        assert workbook_cache.get("aa") is None
+        assert workbook_cache.get("cc") == b"12345"
+        assert workbook_cache.evict_if_needed() == 0
+
+    def test_overwritten_file_is_counted_once(self, workbook_cache):
+        workbook_cache.put("aa", b"12345")
+        workbook_cache.put("aa", b"12345")
+        assert cache.get(SIZE_KEY) == 5
+
+        workbook_cache.put("aa", b"123")
+        assert cache.get(SIZE_KEY) == 3
+
+
+class TestWorkbookCacheProcesses:
+    """Two caches with same folder and Django cache act as two processes."""
+
+    @pytest.fixture
+    def other(self, workbook_cache) -> WorkbookCache:
+        return WorkbookCache(root=workbook_cache.root, max_size=workbook_cache.max_size)
+
+    @staticmethod
+    def disk_size(workbook_cache: WorkbookCache) -> int:
+        return sum(file_size for _, file_size, _ in workbook_cache.files())
+
+    def test_file_written_during_eviction_stays_counted(self, workbook_cache, other, monkeypatch):
+        for key in ("aa", "bb", "cc"):
+            workbook_cache.put(key, b"12345")
+        files = workbook_cache.files
+
+        def files_and_put():
+            walked = files()
+            other.put("dd", b"1234")
+            return walked
+
+        monkeypatch.setattr(workbook_cache, "files", files_and_put)
+
+        assert workbook_cache.evict_if_needed() == 1
+        assert cache.get(SIZE_KEY) == self.disk_size(other) == 14
+
+    def test_only_one_process_evicts(self, workbook_cache, other):
+        for key in ("aa", "bb", "cc"):
+            workbook_cache.put(key, b"12345")
+        cache.add(EVICT_LOCK_KEY, 0)
+
+        assert other.evict_if_needed() == 0
+        assert self.disk_size(other) == 15
+
+        cache.delete(EVICT_LOCK_KEY)
+        assert other.evict_if_needed() == 1
+        assert cache.get(EVICT_LOCK_KEY) is None
@@ -4,14 +4,24 @@ from .views import (
     list_measurements,
     rud_measurement,
     download_measurement,
+    dataset_measurement,
+    export_jobs,
+    export_job_detail,
+    download_export_job,
     save_to_mongo_measurement,
-    filter_measurements
+    filter_measurements,
+    export_cache_stats
 )
 
 urlpatterns = [
     path('filters/', filter_measurements, name="filter_measurements"),
     path('measurements/', list_measurements, name="list_measurements"),
     path('measurement/download/', download_measurement, name="download_measurement"),
+    path('measurement/download/cache/', export_cache_stats, name="export_cache_stats"),
+    path('measurement/dataset/', dataset_measurement, name="dataset_measurement"),
+    path('exports/', export_jobs, name="export_jobs"),
+    path('exports/<uuid:pk>/', export_job_detail, name="export_job_detail"),
+    path('exports/<uuid:pk>/download/', download_export_job, name="download_export_job"),
     path('measurement/save/', save_to_mongo_measurement, name="save_to_mongo_measurement"),
     path('measurement/<str:sample_id>/', rud_measurement, name="rud_measurement")
 ]
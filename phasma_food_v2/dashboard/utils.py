@@ -1,11 +1,22 @@
 import os
-import shutil
-from typing import List
+import re
+import logging
+import time
+import uuid
+import zipfile
+from io import BytesIO
+from typing import BinaryIO, Callable, Iterable, Iterator, List, Optional, Tuple
 
+import numpy as np
 import openpyxl
 from django.conf import settings
+from django.db.models import Prefetch, QuerySet
 
 from phasma_food_v2.measurements.models import Measurement
+from phasma_food_v2.measurements.spectrum import Spectrum, as_float_list
+from .workbook_cache import workbook_cache
+
+logger = logging.getLogger(__name__)
 
 HEADER_NIR = [
     'wave',
@@ -32,6 +43,15 @@ HEADER_VIS = HEADER_FLUO + [
     "rawDarkforWhite6", "rawDarkforWhite7", "rawDarkforWhite8", "rawDarkforWhite9", "rawDarkforWhite10"
 ]
 
+# Sensor sheets, columns are filled by header names (see `column_spec`)
+SHEETS = (
+    ("VIS", "vis", HEADER_VIS),
+    ("NIR", "nir", HEADER_NIR),
+    ("FLUO", "fluo", HEADER_FLUO),
+)
+REPLICATE_COLUMN = re.compile(r"^(?P<block>[A-Za-z]+?)(?P<index>\d+)$")
+COLUMN_BLOCKS = {"correctedWhite": "whiteReference"}
+
 HEADER_FOOD_ADULTERATION = [
     'Food Type', 'Food Subtype', 'Adulteration Sample ID', 'Other species', 'Purity SMP', 'Alcohol label', 'Authentic',
     'Low value filler', 'Nitrogen enhancer', 'Diluted %', 'Hazard 1 name', 'Hazard 1 %', 'Hazard 2 name', 'Hazard 2 %'
@@ -45,262 +65,315 @@ HEADER_MYCOTOXINS_DETECTION = [
 ]
 
 
-def excel_zip(email: str, measurements: List[str]) -> List[str]:
-    """Generate excel files and compress them into zip."""
-    measurements_all = Measurement.objects.all()
-    measurements_filtered = measurements_all.filter(sample_id__in=measurements)
-    location = settings.MEDIA_ROOT
-    folder_name = email.split("@")[0]
-    full_folder_path = "{}/excel/".format(location)
-    if not os.path.exists(full_folder_path):
-        os.makedirs(full_folder_path, 0o777)
-    if not os.path.exists("{}{}/".format(full_folder_path, folder_name)):
-        os.makedirs("{}{}/".format(full_folder_path, folder_name), 0o777)
-
-    for measurement in measurements_filtered:
-        measurement_data_time = measurement.date_created
-        measurement_sample_id = measurement.sample_id
-        white_reference = measurements_all.filter(
-            use_case="White Reference"
-        ).filter(
-            date_created__lt=measurement_data_time
-        ).order_by(
-            '-date_created'
-        ).first()
-
-        wb = openpyxl.Workbook()
-        ws_sample_info = wb.create_sheet("Sample Info")
-        ws_vis = wb.create_sheet("VIS")
-        ws_vis.append(HEADER_VIS)
-        ws_nir = wb.create_sheet("NIR")
-        ws_nir.append(HEADER_NIR)
-        ws_fluo = wb.create_sheet("FLUO")
-        ws_fluo.append(HEADER_FLUO)
-        wb.remove(wb["Sheet"])
-
-        # VIS
-        preprocessed_vis = measurement.vis["preprocessed"] if "preprocessed" in measurement.vis else None
-        corrected_white_vis = measurement.vis["whiteReference"] if "whiteReference" in measurement.vis else None
-        raw_data_vis = measurement.vis["rawData"] if "rawData" in measurement.vis else None
-        avg_data_vis = measurement.vis["avgData"] if "avgData" in measurement.vis else None
-        raw_white_vis = measurement.vis["rawWhite"] if "rawWhite" in measurement.vis else None
-        avg_white_vis = measurement.vis["avgWhite"] if "avgWhite" in measurement.vis else None
-        raw_dark_vis = measurement.vis["rawDark"] if "rawDark" in measurement.vis else None
-        avg_dark_vis = measurement.vis["avgDark"] if "avgDark" in measurement.vis else None
-        raw_dark_vis_wr = white_reference.vis["rawDark"] if white_reference else None
-        if raw_data_vis:
-            raw_data_01, raw_data_02, raw_data_03, raw_data_04, raw_data_05, \
-            raw_data_06, raw_data_07, raw_data_08, raw_data_09, raw_data_10 = raw_data_vis
-        else:
-            raw_data_01 = raw_data_02 = raw_data_03 = raw_data_04 = raw_data_05 = \
-                raw_data_06 = raw_data_07 = raw_data_08 = raw_data_09 = raw_data_10 = None
-        if raw_white_vis:
-            raw_white_01, raw_white_02, raw_white_03, raw_white_04, raw_white_05, \
-            raw_white_06, raw_white_07, raw_white_08, raw_white_09, raw_white_10 = raw_white_vis
-        else:
-            raw_white_01 = raw_white_02 = raw_white_03 = raw_white_04 = raw_white_05 = \
-                raw_white_06 = raw_white_07 = raw_white_08 = raw_white_09 = raw_white_10 = None
-        if raw_dark_vis:
-            raw_dark_01, raw_dark_02, raw_dark_03, raw_dark_04, raw_dark_05, \
-            raw_dark_06, raw_dark_07, raw_dark_08, raw_dark_09, raw_dark_10 = raw_dark_vis
-        else:
-            raw_dark_01 = raw_dark_02 = raw_dark_03 = raw_dark_04 = raw_dark_05 = \
-                raw_dark_06 = raw_dark_07 = raw_dark_08 = raw_dark_09 = raw_dark_10 = None
-        if raw_dark_vis_wr:
-            raw_dark_wr_01, raw_dark_wr_02, raw_dark_wr_03, raw_dark_wr_04, raw_dark_wr_05, \
-            raw_dark_wr_06, raw_dark_wr_07, raw_dark_wr_08, raw_dark_wr_09, raw_dark_wr_10 = raw_dark_vis_wr
-        else:
-            raw_dark_wr_01 = raw_dark_wr_02 = raw_dark_wr_03 = raw_dark_wr_04 = raw_dark_wr_05 = \
-                raw_dark_wr_06 = raw_dark_wr_07 = raw_dark_wr_08 = raw_dark_wr_09 = raw_dark_wr_10 = None
-        while preprocessed_vis:
-            preprocessed = preprocessed_vis.pop()
-            preprocessed_wave, preprocessed_measurement = preprocessed["wave"], preprocessed["measurement"]
-            corrected_white = corrected_white_vis.pop()["measurement"] if corrected_white_vis else None
-            raw_data_one = raw_data_01.pop()["measurement"] if raw_data_01 else None
-            raw_data_two = raw_data_02.pop()["measurement"] if raw_data_02 else None
-            raw_data_three = raw_data_03.pop()["measurement"] if raw_data_03 else None
-            raw_data_four = raw_data_04.pop()["measurement"] if raw_data_04 else None
-            raw_data_five = raw_data_05.pop()["measurement"] if raw_data_05 else None
-            raw_data_six = raw_data_06.pop()["measurement"] if raw_data_06 else None
-            raw_data_seven = raw_data_07.pop()["measurement"] if raw_data_07 else None
-            raw_data_eight = raw_data_08.pop()["measurement"] if raw_data_08 else None
-            raw_data_nine = raw_data_09.pop()["measurement"] if raw_data_09 else None
-            raw_data_ten = raw_data_10.pop()["measurement"] if raw_data_10 else None
-            avg_data = avg_data_vis.pop()["measurement"] if avg_data_vis else None
-            raw_white_one = raw_white_01.pop()["measurement"] if raw_white_01 else None
-            raw_white_two = raw_white_02.pop()["measurement"] if raw_white_02 else None
-            raw_white_three = raw_white_03.pop()["measurement"] if raw_white_03 else None
-            raw_white_four = raw_white_04.pop()["measurement"] if raw_white_04 else None
-            raw_white_five = raw_white_05.pop()["measurement"] if raw_white_05 else None
-            raw_white_six = raw_white_06.pop()["measurement"] if raw_white_06 else None
-            raw_white_seven = raw_white_07.pop()["measurement"] if raw_white_07 else None
-            raw_white_eight = raw_white_08.pop()["measurement"] if raw_white_08 else None
-            raw_white_nine = raw_white_09.pop()["measurement"] if raw_white_09 else None
-            raw_white_ten = raw_white_10.pop()["measurement"] if raw_white_10 else None
-            avg_white = avg_white_vis.pop()["measurement"] if avg_white_vis else None
-            raw_dark_one = raw_dark_01.pop()["measurement"] if raw_dark_01 else None
-            raw_dark_two = raw_dark_02.pop()["measurement"] if raw_dark_02 else None
-            raw_dark_three = raw_dark_03.pop()["measurement"] if raw_dark_03 else None
-            raw_dark_four = raw_dark_04.pop()["measurement"] if raw_dark_04 else None
-            raw_dark_five = raw_dark_05.pop()["measurement"] if raw_dark_05 else None
-            raw_dark_six = raw_dark_06.pop()["measurement"] if raw_dark_06 else None
-            raw_dark_seven = raw_dark_07.pop()["measurement"] if raw_dark_07 else None
-            raw_dark_eight = raw_dark_08.pop()["measurement"] if raw_dark_08 else None
-            raw_dark_nine = raw_dark_09.pop()["measurement"] if raw_dark_09 else None
-            raw_dark_ten = raw_dark_10.pop()["measurement"] if raw_dark_10 else None
-            avg_dark = avg_dark_vis.pop()["measurement"] if avg_dark_vis else None
-            raw_dark_wr_one = raw_dark_wr_01.pop()["measurement"] if raw_dark_wr_01 else None
-            raw_dark_wr_two = raw_dark_wr_02.pop()["measurement"] if raw_dark_wr_02 else None
-            raw_dark_wr_three = raw_dark_wr_03.pop()["measurement"] if raw_dark_wr_03 else None
-            raw_dark_wr_four = raw_dark_wr_04.pop()["measurement"] if raw_dark_wr_04 else None
-            raw_dark_wr_five = raw_dark_wr_05.pop()["measurement"] if raw_dark_wr_05 else None
-            raw_dark_wr_six = raw_dark_wr_06.pop()["measurement"] if raw_dark_wr_06 else None
-            raw_dark_wr_seven = raw_dark_wr_07.pop()["measurement"] if raw_dark_wr_07 else None
-            raw_dark_wr_eight = raw_dark_wr_08.pop()["measurement"] if raw_dark_wr_08 else None
-            raw_dark_wr_nine = raw_dark_wr_09.pop()["measurement"] if raw_dark_wr_09 else None
-            raw_dark_wr_ten = raw_dark_wr_10.pop()["measurement"] if raw_dark_wr_10 else None
-            data_vis = [
-                preprocessed_wave, preprocessed_measurement, raw_data_one, raw_data_two, raw_data_three,
-                raw_data_four, raw_data_five, raw_data_six, raw_data_seven, raw_data_eight, raw_data_nine,
-                raw_data_ten, avg_data, raw_white_one, raw_white_two, raw_white_three, raw_white_four,
-                raw_white_five, raw_white_six, raw_white_seven, raw_white_eight, raw_white_nine, raw_white_ten,
-                corrected_white, avg_white, raw_dark_one, raw_dark_two, raw_dark_three, raw_dark_four,
-                raw_dark_five, raw_dark_six, raw_dark_seven, raw_dark_eight, raw_dark_nine, raw_dark_ten, avg_dark,
-                raw_dark_wr_one, raw_dark_wr_two, raw_dark_wr_three, raw_dark_wr_four, raw_dark_wr_five,
-                raw_dark_wr_six, raw_dark_wr_seven, raw_dark_wr_eight, raw_dark_wr_nine, raw_dark_wr_ten
-            ]
-            ws_vis.append(data_vis)
-
-        # NIR
-        preprocessed_nir = measurement.nir["preprocessed"] if "preprocessed" in measurement.nir else None
-        dark_reference_nir = measurement.nir["darkReference"] if "darkReference" in measurement.nir else None
-        white_reference_nir = measurement.nir["whiteReference"] if "whiteReference" in measurement.nir else None
-        while preprocessed_nir:
-            preprocessed = preprocessed_nir.pop()
-            preprocessed_wave, preprocessed_measurement = preprocessed["wave"], preprocessed["measurement"]
-            dark_reference = dark_reference_nir.pop()["measurement"] if dark_reference_nir else None
-            white_reference = white_reference_nir.pop()["measurement"] if white_reference_nir else None
-            data = [preprocessed_wave, preprocessed_measurement, dark_reference, white_reference]
-            ws_nir.append(data)
-
-        # FLUO
-        preprocessed_fluo = measurement.fluo["preprocessed"] if "preprocessed" in measurement.fluo else None
-        raw_data_fluo = measurement.fluo["rawData"] if "rawData" in measurement.fluo else None
-        avg_data_fluo = measurement.fluo["avgData"] if "avgData" in measurement.fluo else None
-        raw_white_fluo = measurement.fluo["rawWhite"] if "rawWhite" in measurement.fluo else None
-        avg_white_fluo = measurement.fluo["avgWhite"] if "avgWhite" in measurement.fluo else None
-        raw_dark_fluo = measurement.fluo["rawDark"] if "rawDark" in measurement.fluo else None
-        avg_dark_fluo = measurement.fluo["avgDark"] if "avgDark" in measurement.fluo else None
-        if len(raw_data_fluo):
-            raw_data_fluo_01, raw_data_fluo_02, raw_data_fluo_03, raw_data_fluo_04, raw_data_fluo_05, \
-            raw_data_fluo_06, raw_data_fluo_07, raw_data_fluo_08, raw_data_fluo_09, raw_data_fluo_10 = raw_data_fluo
-        else:
-            raw_data_fluo_01 = raw_data_fluo_02 = raw_data_fluo_03 = raw_data_fluo_04 = raw_data_fluo_05 = \
-                raw_data_fluo_06 = raw_data_fluo_07 = raw_data_fluo_08 = raw_data_fluo_09 = raw_data_fluo_10 = None
-        if len(raw_white_fluo):
-            raw_white_fluo_01, raw_white_fluo_02, raw_white_fluo_03, raw_white_fluo_04, raw_white_fluo_05, \
-            raw_white_fluo_06, raw_white_fluo_07, raw_white_fluo_08, raw_white_fluo_09, raw_white_fluo_10 = raw_white_fluo
-        else:
-            raw_white_fluo_01 = raw_white_fluo_02 = raw_white_fluo_03 = raw_white_fluo_04 = raw_white_fluo_05 = \
-                raw_white_fluo_06 = raw_white_fluo_07 = raw_white_fluo_08 = raw_white_fluo_09 = raw_white_fluo_10 = None
-        if len(raw_dark_fluo):
-            raw_dark_fluo_01, raw_dark_fluo_02, raw_dark_fluo_03, raw_dark_fluo_04, raw_dark_fluo_05, \
-            raw_dark_fluo_06, raw_dark_fluo_07, raw_dark_fluo_08, raw_dark_fluo_09, raw_dark_fluo_10 = raw_dark_fluo
-        else:
-            raw_dark_fluo_01 = raw_dark_fluo_02 = raw_dark_fluo_03 = raw_dark_fluo_04 = raw_dark_fluo_05 = \
-                raw_dark_fluo_06 = raw_dark_fluo_07 = raw_dark_fluo_08 = raw_dark_fluo_09 = raw_dark_fluo_10 = None
-        while preprocessed_fluo:
-            preprocessed = preprocessed_fluo.pop()
-            preprocessed_wave, preprocessed_measurement = preprocessed["wave"], preprocessed["measurement"]
-            raw_data_one = raw_data_fluo_01.pop()["measurement"] if raw_data_fluo_01 else None
-            raw_data_two = raw_data_fluo_02.pop()["measurement"] if raw_data_fluo_02 else None
-            raw_data_three = raw_data_fluo_03.pop()["measurement"] if raw_data_fluo_03 else None
-            raw_data_four = raw_data_fluo_04.pop()["measurement"] if raw_data_fluo_04 else None
-            raw_data_five = raw_data_fluo_05.pop()["measurement"] if raw_data_fluo_05 else None
-            raw_data_six = raw_data_fluo_06.pop()["measurement"] if raw_data_fluo_06 else None
-            raw_data_seven = raw_data_fluo_07.pop()["measurement"] if raw_data_fluo_07 else None
-            raw_data_eight = raw_data_fluo_08.pop()["measurement"] if raw_data_fluo_08 else None
-            raw_data_nine = raw_data_fluo_09.pop()["measurement"] if raw_data_fluo_09 else None
-            raw_data_ten = raw_data_fluo_10.pop()["measurement"] if raw_data_fluo_10 else None
-            avg_data = avg_data_fluo.pop()["measurement"] if avg_data_fluo else None
-            raw_white_one = raw_white_fluo_01.pop()["measurement"] if raw_white_fluo_01 else None
-            raw_white_two = raw_white_fluo_02.pop()["measurement"] if raw_white_fluo_02 else None
-            raw_white_three = raw_white_fluo_03.pop()["measurement"] if raw_white_fluo_03 else None
-            raw_white_four = raw_white_fluo_04.pop()["measurement"] if raw_white_fluo_04 else None
-            raw_white_five = raw_white_fluo_05.pop()["measurement"] if raw_white_fluo_05 else None
-            raw_white_six = raw_white_fluo_06.pop()["measurement"] if raw_white_fluo_06 else None
-            raw_white_seven = raw_white_fluo_07.pop()["measurement"] if raw_white_fluo_07 else None
-            raw_white_eight = raw_white_fluo_08.pop()["measurement"] if raw_white_fluo_08 else None
-            raw_white_nine = raw_white_fluo_09.pop()["measurement"] if raw_white_fluo_09 else None
-            raw_white_ten = raw_white_fluo_10.pop()["measurement"] if raw_white_fluo_10 else None
-            avg_white = avg_white_fluo.pop()["measurement"] if avg_white_fluo else None
-            raw_dark_one = raw_dark_fluo_01.pop()["measurement"] if raw_dark_fluo_01 else None
-            raw_dark_two = raw_dark_fluo_02.pop()["measurement"] if raw_dark_fluo_02 else None
-            raw_dark_three = raw_dark_fluo_03.pop()["measurement"] if raw_dark_fluo_03 else None
-            raw_dark_four = raw_dark_fluo_04.pop()["measurement"] if raw_dark_fluo_04 else None
-            raw_dark_five = raw_dark_fluo_05.pop()["measurement"] if raw_dark_fluo_05 else None
-            raw_dark_six = raw_dark_fluo_06.pop()["measurement"] if raw_dark_fluo_06 else None
-            raw_dark_seven = raw_dark_fluo_07.pop()["measurement"] if raw_dark_fluo_07 else None
-            raw_dark_eight = raw_dark_fluo_08.pop()["measurement"] if raw_dark_fluo_08 else None
-            raw_dark_nine = raw_dark_fluo_09.pop()["measurement"] if raw_dark_fluo_09 else None
-            raw_dark_ten = raw_dark_fluo_10.pop()["measurement"] if raw_dark_fluo_10 else None
-            avg_dark = avg_dark_fluo.pop()["measurement"] if avg_dark_fluo else None
-            data_fluo = [
-                preprocessed_wave, preprocessed_measurement, raw_data_one, raw_data_two, raw_data_three,
-                raw_data_four, raw_data_five, raw_data_six, raw_data_seven, raw_data_eight, raw_data_nine,
-                raw_data_ten, avg_data, raw_white_one, raw_white_two, raw_white_three, raw_white_four,
-                raw_white_five, raw_white_six, raw_white_seven, raw_white_eight, raw_white_nine, raw_white_ten,
-                avg_white, raw_dark_one, raw_dark_two, raw_dark_three, raw_dark_four,
-                raw_dark_five, raw_dark_six, raw_dark_seven, raw_dark_eight, raw_dark_nine, raw_dark_ten, avg_dark
-            ]
-            ws_fluo.append(data_fluo)
-
-        if measurement.use_case == 'Food adulteration':
-            ws_sample_info.append(HEADER_FOOD_ADULTERATION)
-            ws_sample_info.append([
-                measurement.food_type, measurement.food_subtype, measurement.adulteration_id, measurement.other_species,
-                measurement.purity_smp, measurement.alcohol_label, measurement.authentic, measurement.low_value_filler,
-                measurement.nitrogen_enhancer, measurement.diluted_pct, measurement.hazard_one_name,
-                measurement.hazard_one_pct, measurement.hazard_two_name, measurement.hazard_two_pct
-            ])
-            name_part = measurement.adulteration_id
-        elif measurement.use_case == "Food spoilage":
-            ws_sample_info.append(HEADER_FOOD_SPOILAGE)
-            ws_sample_info.append([
-                measurement.food_type, measurement.temperature, measurement.temperature_exposure_hours,
-                measurement.microbiological_id, measurement.microbiological_unit, measurement.microbiological_value
-            ])
-            name_part = measurement.microbiological_id
-        elif measurement.use_case == 'Mycotoxins detection':
-            ws_sample_info.append(HEADER_MYCOTOXINS_DETECTION)
-            ws_sample_info.append([
-                measurement.food_type, measurement.mycotoxins, measurement.granularity, measurement.aflatoxin_name,
-                measurement.aflatoxin_unit, measurement.aflatoxin_value
-            ])
-            name_part = measurement.food_type
-        else:
-            name_part = "other"
-
-        time_stamp = str(measurement.date_created).replace(" ", '')
-
-        excel_name = "{}{}/{}-{}-{}.xlsx".format(
-            full_folder_path,
-            folder_name,
-            time_stamp,
-            name_part,
-            measurement_sample_id
-        )
-        wb.save("{}".format(excel_name))
-        wb.close()
-
-    shutil.make_archive(
-        base_name="{}/{}".format(
-            full_folder_path,
-            folder_name.replace(".", "")
-        ),
-        format="zip",
-        root_dir="{}{}".format(
-            full_folder_path, folder_name
-        ),
+def mongo_collection_name(use_case: str, food_type: str) -> str:
+    """Mongo DB collection of measurements with use case and food type,
+    e.g. "Food spoilage" and "Minced pork" -> "foodspoilage_mincedpork".
+    """
+    return "_".join([use_case, food_type]).replace(" ", "").lower()
+
+
+class ZipStream:
+    """Write-only file object that collects bytes written by `zipfile.ZipFile`
+    so they can be sent to client while archive is still being written.
+    ZipFile can not seek in it, so sizes and CRC of every file are written
+    after its data (data descriptor) and archive never has to be rewound.
+
+    Attributes:
+        tee (obj): Optional file that gets copy of every written byte
+    """
+    def __init__(self, tee: BinaryIO = None):
+        self.tee = tee
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data: bytes) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        if self.tee:
+            self.tee.write(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        pass
+
+    def pop(self) -> bytes:
+        """Bytes written since last call."""
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(files: Iterable[Tuple[str, bytes]], tee: BinaryIO = None) -> Iterator[bytes]:
+    """Zip archive that is yielded file by file as soon as file is ready.
+    Excel files are already compressed, so they are stored without compression.
+
+    Parameters:
+        files (iterable): Pairs of file name and content
+        tee (obj): Optional file that gets copy of archive
+
+    Returns:
+        chunks (iterator): Bytes of zip archive
+    """
+    stream = ZipStream(tee)
+    with zipfile.ZipFile(stream, mode="w", compression=zipfile.ZIP_STORED) as archive:
+        for name, content in files:
+            info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+            info.external_attr = 0o644 << 16
+            archive.writestr(info, content)
+            yield stream.pop()
+    yield stream.pop()
+
+
+def export_path() -> str:
+    """Unique path of zip archive in MEDIA_ROOT, so concurrent
+    exports of same user never share files.
+    """
+    folder = os.path.join(settings.MEDIA_ROOT, "excel")
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, "{}.zip".format(uuid.uuid4().hex))
+
+
+def archive_name(email: str) -> str:
+    """Name of zip archive that user downloads."""
+    return "{}.zip".format(email.split("@")[0].replace(".", ""))
+
+
+def iter_workbooks(measurements: List[str],
+                   progress: Callable[[int, int], None] = None) -> Iterator[Tuple[str, bytes]]:
+    """Excel file for every measurement, in order of measurements in DB.
+    Measurements are split in chunks of EXPORT_CHUNK_SIZE that are generated
+    one after another in current process, web workers must not fork. Celery tasks
+    generate chunks in parallel tasks first (see `dashboard.tasks.export_in_chunks`),
+    so here they are only read from workbook cache.
+
+    Parameters:
+        measurements (list): Measurement IDs
+        progress (callable): Called with number of finished and all chunks
+
+    Returns:
+        workbooks (iterator): Pairs of file name and content of excel file
+    """
+    chunks = export_chunks(measurements)
+    progress = progress or (lambda done, total: None)
+
+    try:
+        for done, chunk in enumerate(chunks, 1):
+            workbooks = build_chunk(chunk)
+            progress(done, len(chunks))
+            yield from workbooks
+    finally:
+        workbook_cache.evict_if_needed()
+
+
+def export_chunks(measurements: List[str]) -> List[List[int]]:
+    """IDs of measurements in order of measurements in DB, split in chunks of EXPORT_CHUNK_SIZE."""
+    sample_ids = list(Measurement.objects.filter(sample_id__in=measurements).values_list("sample_id", flat=True))
+    chunk_size = max(settings.EXPORT_CHUNK_SIZE, 1)
+    return [sample_ids[i:i + chunk_size] for i in range(0, len(sample_ids), chunk_size)]
+
+
+def build_chunk(sample_ids: List[int]) -> List[Tuple[str, bytes]]:
+    """Excel files for chunk of measurements, runs in request or in chunk task.
+    Files are taken from workbook cache, only missing ones are generated
+    and only for them spectra are loaded.
+
+    Parameter:
+        sample_ids (list): Measurement IDs in order
+
+    Returns:
+        workbooks (list): Pairs of file name and content of excel file
+    """
+    measurements = {
+        measurement.sample_id: measurement
+        for measurement in Measurement.objects.filter(sample_id__in=sample_ids).defer("vis", "nir", "fluo")
+    }
+    keys = {sample_id: workbook_cache.key(measurement) for sample_id, measurement in measurements.items()}
+    contents = {sample_id: workbook_cache.get(key) for sample_id, key in keys.items()}
+
+    misses = [sample_id for sample_id, content in contents.items() if content is None]
+    if misses:
+        for measurement in white_references_prefetched(misses):
+            _, content = build_workbook(measurement, measurement.white_reference)
+            workbook_cache.put(keys[measurement.sample_id], content)
+            contents[measurement.sample_id] = content
+
+    return [
+        (workbook_name(measurements[sample_id]), contents[sample_id])
+        for sample_id in sample_ids if contents.get(sample_id) is not None
+    ]
+
+
+def white_references_prefetched(measurements: List[str]) -> QuerySet:
+    """Measurements with white references that are fetched with one IN query,
+    only spectrum of white reference is loaded.
+
+    Parameter:
+        measurements (list): Measurement IDs
+
+    Returns:
+        queryset (obj): Measurements
+    """
+    return Measurement.objects.filter(
+        sample_id__in=measurements
+    ).prefetch_related(
+        Prefetch("white_reference", queryset=Measurement.objects.only("sample_id", "vis"))
     )
-    return [full_folder_path, folder_name]
+
+
+def write_zip(path: str, measurements: List[str], progress: Callable[[int, int], None] = None) -> str:
+    """Generate excel files and write them to zip archive on disk.
+
+    Returns:
+        path (str): Path of zip archive
+    """
+    with open(path, "wb") as file:
+        for _ in stream_zip(iter_workbooks(measurements, progress), tee=file):
+            pass
+    return path
+
+
+def column_spec(header: List[str]) -> List[Tuple[str, str, Optional[int]]]:
+    """Where values of every sheet column are taken from.
+    "rawData3" is third replicate of rawData block, "rawDarkforWhite3" is third
+    replicate of rawDark block of white reference measurement.
+
+    Parameter:
+        header (list): Column names of sheet
+
+    Returns:
+        spec (list): (source, block, replicate index or None) for every column
+    """
+    spec = []
+    for name in header:
+        match = REPLICATE_COLUMN.match(name)
+        block, index = (match.group("block"), int(match.group("index")) - 1) if match else (name, None)
+        source = "measurement"
+        if block == "rawDarkforWhite":
+            block, source = "rawDark", "white_reference"
+        spec.append((source, COLUMN_BLOCKS.get(block, block), index))
+    return spec
+
+
+def _block_values(spectrum: Optional[Spectrum], block: str) -> Optional[list]:
+    """Values of spectrum block as list of floats, list of lists for replicated blocks."""
+    if spectrum is None or block not in spectrum:
+        return None
+    values = spectrum.array(block)
+    if values is not None:
+        return as_float_list(values)
+    points = spectrum[block]
+    if not isinstance(points, list) or not points:
+        return None
+    if all(isinstance(replicate, list) for replicate in points):
+        return [[point.get("measurement") for point in replicate] for replicate in points]
+    return [point.get("measurement") for point in points if isinstance(point, dict)]
+
+
+def _wave_values(spectrum: Spectrum) -> Optional[list]:
+    """Wavelengths of preprocessed block."""
+    wave = spectrum.wave("preprocessed")
+    if wave is not None:
+        return as_float_list(wave)
+    points = spectrum.get("preprocessed")
+    return [point.get("wave") for point in points] if isinstance(points, list) else None
+
+
+def sheet_rows(spectrum: Optional[Spectrum], white_reference: Optional[Spectrum],
+               spec: List[Tuple[str, str, Optional[int]]]) -> list:
+    """Rows of sensor sheet, one for every preprocessed wavelength.
+    Every column is taken from block as a whole and sheet is transposed once,
+    rows go from last to first wavelength. Spectrum is not changed.
+
+    Parameters:
+        spectrum (obj): Spectrum of measurement
+        white_reference (obj): Spectrum of white reference measurement
+        spec (list): Columns of sheet, see `column_spec`
+
+    Returns:
+        rows (list): Rows of sheet, None where value does not exist
+    """
+    if spectrum is None:
+        return []
+    if isinstance(spectrum, dict):
+        spectrum = Spectrum.from_legacy(spectrum)
+    if isinstance(white_reference, dict):
+        white_reference = Spectrum.from_legacy(white_reference)
+    wave = _wave_values(spectrum)
+    if not wave:
+        return []
+
+    sources = {"measurement": spectrum, "white_reference": white_reference}
+    blocks = {"wave": wave}
+    columns = np.full((len(spec), len(wave)), None, dtype=object)
+    for column, (source, block, index) in enumerate(spec):
+        key = (source, block)
+        if key not in blocks:
+            blocks[key] = blocks["wave"] if block == "wave" else _block_values(sources[source], block)
+        values = blocks[key]
+        if values and index is not None:
+            values = values[index] if index < len(values) and isinstance(values[index], list) else None
+        elif values and isinstance(values[0], list):
+            values = None
+        if values:
+            values = values[::-1][:len(wave)]
+            columns[column, :len(values)] = values
+    return columns.T.tolist()
+
+
+def sample_info(measurement: Measurement) -> Tuple[list, str]:
+    """Rows of Sample Info sheet and part of excel file name for use case of measurement."""
+    if measurement.use_case == 'Food adulteration':
+        return [HEADER_FOOD_ADULTERATION, [
+            measurement.food_type, measurement.food_subtype, measurement.adulteration_id, measurement.other_species,
+            measurement.purity_smp, measurement.alcohol_label, measurement.authentic, measurement.low_value_filler,
+            measurement.nitrogen_enhancer, measurement.diluted_pct, measurement.hazard_one_name,
+            measurement.hazard_one_pct, measurement.hazard_two_name, measurement.hazard_two_pct
+        ]], measurement.adulteration_id
+    elif measurement.use_case == "Food spoilage":
+        return [HEADER_FOOD_SPOILAGE, [
+            measurement.food_type, measurement.temperature, measurement.temperature_exposure_hours,
+            measurement.microbiological_id, measurement.microbiological_unit, measurement.microbiological_value
+        ]], measurement.microbiological_id
+    elif measurement.use_case == 'Mycotoxins detection':
+        return [HEADER_MYCOTOXINS_DETECTION, [
+            measurement.food_type, measurement.mycotoxins, measurement.granularity, measurement.aflatoxin_name,
+            measurement.aflatoxin_unit, measurement.aflatoxin_value
+        ]], measurement.food_type
+    return [], "other"
+
+
+def workbook_name(measurement: Measurement) -> str:
+    """Name of excel file of measurement in zip archive."""
+    time_stamp = str(measurement.date_created).replace(" ", '')
+    return "{}-{}-{}.xlsx".format(time_stamp, sample_info(measurement)[1], measurement.sample_id)
+
+
+def build_workbook(measurement: Measurement, white_reference: Optional[Measurement]) -> Tuple[str, bytes]:
+    """Generate excel file for measurement in write-only mode.
+
+    Parameters:
+        measurement (obj): Measurement
+        white_reference (obj): Last white reference measurement before measurement
+
+    Returns:
+        name (str): Name of excel file
+        content (bytes): Excel file
+    """
+    wb = openpyxl.Workbook(write_only=True)
+    ws_sample_info = wb.create_sheet("Sample Info")
+    for row in sample_info(measurement)[0]:
+        ws_sample_info.append(row)
+    white_reference_vis = white_reference.vis if white_reference else None
+    for title, sensor, header in SHEETS:
+        ws = wb.create_sheet(title)
+        ws.append(header)
+        for row in sheet_rows(getattr(measurement, sensor), white_reference_vis, column_spec(header)):
+            ws.append(row)
+
+    content = BytesIO()
+    wb.save(content)
+    return workbook_name(measurement), content.getvalue()
@@ -1,20 +1,29 @@
 import os
-import mimetypes
-from wsgiref.util import FileWrapper
-from typing import Union
+import re
+from typing import Iterator, List, Optional, Tuple, Union
 
 from django.http import StreamingHttpResponse, HttpRequest
 from django.conf import settings
+from django.db import transaction
+from django.db.models import QuerySet
+from django.shortcuts import get_object_or_404
 from rest_framework import generics, status, views
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
 from phasma_food_v2.measurements.models import Measurement
 from phasma_food_v2.measurements.serializers import MeasurementSerializer
 from phasma_food_v2.samples.mongo_db import MongoDB
 
-from .serializers import MeasurementDownloadSerializer, MeasurementMongoSerializer, ListMeasurementSerializer
-from .tasks import create_excel_to_zip, save_to_mongo
-from .utils import excel_zip
+from .dataset import DATASET_FORMATS, dataset_sample_ids, stream_dataset
+from .models import ExportJob
+from .serializers import (
+    ExportJobSerializer, MeasurementDownloadSerializer, MeasurementDatasetSerializer, MeasurementMongoSerializer,
+    ListMeasurementSerializer
+)
+from .tasks import create_excel_to_zip, run_export_job, save_to_mongo
+from .utils import archive_name, export_path, iter_workbooks, stream_zip
+from .workbook_cache import workbook_cache
 
 
 class FilterMeasurements(views.APIView):
@@ -43,7 +52,7 @@ class ListMeasurements(generics.ListAPIView):
       - useCase
       - foodType
     """
-    queryset = Measurement.objects.all()
+    queryset = Measurement.objects.defer("vis", "nir", "fluo")
     serializer_class = ListMeasurementSerializer
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ["use_case", "food_type"]
@@ -57,9 +66,60 @@ class RUDMeasurement(generics.RetrieveUpdateDestroyAPIView):
     lookup_field = "sample_id"
 
 
+class EmailedZipStream:
+    """Zip archive chunks, copy of archive is written to disk for email.
+    Email is queued when response is closed, also when client disconnects
+    before first chunk. If download is interrupted, email task generates archive again.
+
+    Attributes:
+        email (str): User email
+        measurements (list): Measurement IDs
+        path (str): Path of archive when it is completely written
+    """
+    def __init__(self, email: str, measurements: List[str]):
+        self.email = email
+        self.measurements = measurements
+        self.path = None
+        self.failed = False
+        self.closed = False
+        self.chunks = self.generate()
+
+    def __iter__(self) -> Iterator[bytes]:
+        return self.chunks
+
+    def generate(self) -> Iterator[bytes]:
+        path = export_path()
+        try:
+            with open(path, "wb") as file:
+                yield from stream_zip(iter_workbooks(self.measurements), tee=file)
+        except GeneratorExit:
+            os.remove(path)
+            raise
+        except Exception:
+            self.failed = True
+            os.remove(path)
+            raise
+        self.path = path
+
+    def close(self) -> None:
+        """Called by server when response is finished or client is disconnected."""
+        if self.closed:
+            return
+        self.closed = True
+        self.chunks.close()
+        if self.failed:
+            return
+        if self.path:
+            create_excel_to_zip.delay(email=self.email, measurements=self.measurements, path=self.path)
+        else:
+            create_excel_to_zip.delay(email=self.email, measurements=self.measurements)
+
+
 class MeasurementDownload(generics.GenericAPIView):
     """Generate excel file/s, zip and send them
     via email and download thru browser.
+    Zip archive is streamed while excel files are generated and
+    same archive is attached to email when download is finished.
     """
     serializer_class = MeasurementDownloadSerializer
 
@@ -67,32 +127,144 @@ class MeasurementDownload(generics.GenericAPIView):
         serializer = self.get_serializer(data=request.data)
         if serializer.is_valid():
             measurements = serializer.validated_data.get("measurements")
-            email = request.user
-            full_folder_path, folder_name = excel_zip(
-                email=email.email,
-                measurements=measurements
-            )
-            zip_file = "{}/{}.zip".format(
-                full_folder_path,
-                folder_name.replace(".", "")
-            )
-            chunk_size = 8192
+            email = request.user.email
+            # Response closes stream, so email is queued even if archive is never streamed
             response = StreamingHttpResponse(
-                FileWrapper(open(zip_file, 'rb'), chunk_size),
-                content_type=mimetypes.guess_type(zip_file)[0]
+                EmailedZipStream(email, measurements),
+                content_type="application/zip"
             )
-            response['Content-Length'] = os.path.getsize(zip_file)
-            response['Content-Disposition'] = "attachment; filename={}.zip".format(folder_name.replace(".", ""))
-            create_excel_to_zip.delay(
-                email=email.email,
-                measurements=measurements
+            response['Content-Disposition'] = "attachment; filename={}".format(archive_name(email))
+            return response
+
+        elif serializer.errors:
+            return Response({"error": serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class ExportJobs(generics.ListCreateAPIView):
+    """Excel exports of user that are generated in background.
+    POST creates export job, its status and progress are polled
+    until zip archive can be downloaded.
+    """
+    serializer_class = ExportJobSerializer
+
+    def get_queryset(self) -> QuerySet:
+        return ExportJob.objects.filter(owner=self.request.user)
+
+    def create(self, request: HttpRequest, *args: tuple, **kwargs: dict) -> Response:
+        serializer = MeasurementDownloadSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response({"error": serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        job = ExportJob.objects.create(owner=request.user, measurements=serializer.validated_data["measurements"])
+        transaction.on_commit(lambda: run_export_job.delay(str(job.pk)))
+        return Response(self.get_serializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+
+class ExportJobDetail(generics.RetrieveDestroyAPIView):
+    """Status, percent done and estimated time of export job."""
+    serializer_class = ExportJobSerializer
+
+    def get_queryset(self) -> QuerySet:
+        return ExportJob.objects.filter(owner=self.request.user)
+
+    def perform_destroy(self, instance: ExportJob) -> None:
+        instance.remove_file()
+        instance.delete()
+
+
+class ExportJobDownload(views.APIView):
+    """Zip archive of finished export job. Single byte range (Range header)
+    is supported, so interrupted download can be continued.
+    """
+    chunk_size = 64 * 1024
+
+    def get(self, request: HttpRequest, pk: str) -> Union[StreamingHttpResponse, Response]:
+        job = get_object_or_404(ExportJob, pk=pk, owner=request.user)
+        if job.status != ExportJob.DONE or not os.path.exists(job.path):
+            return Response({"error": "Export is not ready or it is expired."}, status=status.HTTP_404_NOT_FOUND)
+
+        size = os.path.getsize(job.path)
+        byte_range = self.parse_range(request.META.get("HTTP_RANGE"), size)
+        if byte_range is False:
+            response = Response(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+            response["Content-Range"] = "bytes */{}".format(size)
+            return response
+        start, end = byte_range or (0, size - 1)
+
+        response = StreamingHttpResponse(
+            self.read(job.path, start, end - start + 1),
+            status=status.HTTP_206_PARTIAL_CONTENT if byte_range else status.HTTP_200_OK,
+            content_type="application/zip"
+        )
+        if byte_range:
+            response["Content-Range"] = "bytes {}-{}/{}".format(start, end, size)
+        response["Content-Length"] = end - start + 1
+        response["Accept-Ranges"] = "bytes"
+        response["ETag"] = '"{}"'.format(job.pk)
+        response["Content-Disposition"] = "attachment; filename={}".format(archive_name(request.user.email))
+        return response
+
+    @staticmethod
+    def parse_range(header: Optional[str], size: int) -> Union[None, bool, Tuple[int, int]]:
+        """First and last byte of "bytes=start-end" range.
+
+        Returns:
+            range (tuple): (start, end), None if there is no range and False if range is not satisfiable
+        """
+        match = re.match(r"^bytes=(\d*)-(\d*)$", (header or "").strip())
+        if not match or not any(match.groups()):
+            return None
+        first, last = match.groups()
+        if first:
+            start, end = int(first), min(int(last), size - 1) if last else size - 1
+        else:
+            start, end = max(size - int(last), 0), size - 1
+        if start > end or start >= size:
+            return False
+        return start, end
+
+    def read(self, path: str, start: int, length: int) -> Iterator[bytes]:
+        with open(path, "rb") as file:
+            file.seek(start)
+            while length > 0:
+                data = file.read(min(self.chunk_size, length))
+                if not data:
+                    break
+                length -= len(data)
+                yield data
+
+
+class MeasurementDataset(generics.GenericAPIView):
+    """Export filtered measurements as one columnar file for machine learning:
+    wavelength axis and float32 (samples x waves) matrix for every sensor block
+    and typed metadata columns. File is streamed while it is written.
+    """
+    serializer_class = MeasurementDatasetSerializer
+
+    def post(self, request: HttpRequest) -> Union[StreamingHttpResponse, Response]:
+        serializer = self.get_serializer(data=request.data)
+        if serializer.is_valid():
+            data = serializer.validated_data
+            sample_ids = dataset_sample_ids(data.get("measurements"), data.get("use_case"), data.get("food_type"))
+            response = StreamingHttpResponse(
+                stream_dataset(sample_ids),
+                content_type=DATASET_FORMATS[data["format"]]
             )
+            response['Content-Disposition'] = "attachment; filename=phasmafood-dataset.{}".format(data["format"])
             return response
 
         elif serializer.errors:
             return Response({"error": serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
 
 
+class ExportCacheStats(views.APIView):
+    """Hit rate and size of cache of generated excel files."""
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request: HttpRequest) -> Response:
+        return Response({"export_cache": workbook_cache.stats()}, status=status.HTTP_200_OK)
+
+
 class MeasurementMongo(generics.GenericAPIView):
     """Save measurement from Postgres to Mongo DB bu Measurement ID."""
     serializer_class = MeasurementMongoSerializer
@@ -136,5 +308,10 @@ class MeasurementMongo(generics.GenericAPIView):
 list_measurements = ListMeasurements.as_view()
 rud_measurement = RUDMeasurement.as_view()
 download_measurement = MeasurementDownload.as_view()
+export_jobs = ExportJobs.as_view()
+export_job_detail = ExportJobDetail.as_view()
+download_export_job = ExportJobDownload.as_view()
+dataset_measurement = MeasurementDataset.as_view()
 save_to_mongo_measurement = MeasurementMongo.as_view()
 filter_measurements = FilterMeasurements.as_view()
+export_cache_stats = ExportCacheStats.as_view()
@@ -0,0 +1,196 @@
+import os
+import hashlib
+import logging
+import tempfile
+from typing import Optional
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# Increase when content of generated excel files changes, all cached files become invalid
+EXPORT_FORMAT_VERSION = 1
+STATS_KEY = "export-cache:{}"
+SIZE_KEY = STATS_KEY.format("size")
+EVICT_LOCK_KEY = STATS_KEY.format("evict-lock")
+# Seconds after which lock of process that died while evicting expires
+EVICT_LOCK_TIMEOUT = 10 * 60
+
+
+class WorkbookCache:
+    """Generated excel files on disk, one file per measurement version.
+
+    File name is hash of sample ID, date when measurement was updated,
+    white reference ID and export format version, so changed measurement
+    never hits old file. Files are read from cache without loading measurement
+    spectra. Least recently used files are removed when cache is bigger
+    than EXPORT_CACHE_MAX_SIZE bytes. Size of cache is tracked in Django cache
+    when files are written, so cache folder is walked only when it is over limit.
+
+    Attributes:
+        root (str): Cache folder, EXPORT_CACHE_DIR by default
+        max_size (int): Maximum size of cache in bytes
+    """
+    def __init__(self, root: str = None, max_size: int = None):
+        self._root = root
+        self._max_size = max_size
+
+    @property
+    def root(self) -> str:
+        return self._root or settings.EXPORT_CACHE_DIR
+
+    @property
+    def max_size(self) -> int:
+        return self._max_size if self._max_size is not None else settings.EXPORT_CACHE_MAX_SIZE
+
+    @staticmethod
+    def key(measurement) -> str:
+        """Cache key of measurement.
+
+        Parameter:
+            measurement (obj): Measurement, spectra do not have to be loaded
+
+        Returns:
+            key (str): Hex digest
+        """
+        parts = (measurement.sample_id, measurement.date_updated.isoformat(),
+                 measurement.white_reference_id, EXPORT_FORMAT_VERSION)
+        return hashlib.sha256(":".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], "{}.xlsx".format(key))
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Content of cached file or None. Modification time of file
+        is updated on hit, it is used as last access time for eviction.
+        """
+        path = self.path(key)
+        try:
+            with open(path, "rb") as file:
+                content = file.read()
+            os.utime(path)
+        except FileNotFoundError:
+            self._count("misses")
+            return None
+        self._count("hits")
+        return content
+
+    def put(self, key: str, content: bytes) -> None:
+        """Save file atomically, readers never see partial file."""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(descriptor, "wb") as file:
+            file.write(content)
+        try:
+            replaced = os.stat(path).st_size
+        except FileNotFoundError:
+            replaced = 0
+        os.replace(temporary, path)
+        self._count("size", len(content) - replaced)
+
+    def files(self) -> list:
+        """(modification time, size, path) of every cached file."""
+        files = []
+        for folder, _, names in os.walk(self.root):
+            for name in names:
+                if not name.endswith(".xlsx"):
+                    continue
+                path = os.path.join(folder, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    def evict_if_needed(self) -> int:
+        """Evict files only when tracked size is over max size or unknown.
+
+        Returns:
+            removed (int): Number of removed files
+        """
+        size = cache.get(SIZE_KEY)
+        if size is not None and size <= self.max_size:
+            return 0
+        return self.evict()
+
+    def evict(self) -> int:
+        """Remove least recently used files until cache fits in max size
+        and correct tracked size of cache. Only one process evicts at a time,
+        others return immediately.
+
+        Returns:
+            removed (int): Number of removed files
+        """
+        if not cache.add(EVICT_LOCK_KEY, os.getpid(), timeout=EVICT_LOCK_TIMEOUT):
+            return 0
+        try:
+            tracked = cache.get(SIZE_KEY)
+            files = sorted(self.files())
+            size = sum(file_size for _, file_size, _ in files)
+            removed = 0
+            for _, file_size, path in files:
+                if size <= self.max_size:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                size -= file_size
+                removed += 1
+            # Size is corrected by difference, files that are written meanwhile stay counted
+            if tracked is None or not self._count("size", size - tracked, create=False):
+                cache.set(SIZE_KEY, size, timeout=None)
+        finally:
+            cache.delete(EVICT_LOCK_KEY)
+        if removed:
+            self._count("evictions", removed)
+            logger.info("Removed %s excel files from export cache", removed)
+        return removed
+
+    def stats(self) -> dict:
+        """Hit/miss counters that are shared by all processes and size of cache."""
+        counters = cache.get_many([STATS_KEY.format(name) for name in ("hits", "misses", "evictions")])
+        hits = counters.get(STATS_KEY.format("hits"), 0)
+        misses = counters.get(STATS_KEY.format("misses"), 0)
+        files = self.files()
+        return {
+            "hits": hits,
+            "misses": misses,
+            "evictions": counters.get(STATS_KEY.format("evictions"), 0),
+            "hit_rate": hits / (hits + misses) if hits + misses else None,
+            "files": len(files),
+            "size": sum(file_size for _, file_size, _ in files),
+            "max_size": self.max_size,
+        }
+
+    @staticmethod
+    def _count(name: str, value: int = 1, create: bool = True) -> bool:
+        """Change shared counter by value.
+
+        Parameters:
+            name (str): Name of counter
+            value (int): Change, can be negative
+            create (bool): Counter that does not exist is created with value
+
+        Returns:
+            changed (bool): False if counter does not exist and is not created
+        """
+        key = STATS_KEY.format(name)
+        if create and value >= 0 and cache.add(key, value, timeout=None):
+            return True
+        try:
+            if value >= 0:
+                cache.incr(key, value)
+            else:
+                cache.decr(key, -value)
+        except ValueError:
+            if not create or value < 0:
+                return False
+            cache.set(key, value, timeout=None)
+        return True
+
+
+workbook_cache = WorkbookCache()
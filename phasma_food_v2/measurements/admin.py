@@ -25,18 +25,21 @@ class MeasurementAdmin(admin.ModelAdmin):
                                     "hazard_two_name", "hazard_two_pct", "diluted_pct", "package", "adulterated"
                                     )}),
         ("Configuration", {"fields": ("configuration",)}),
-        ("Date created", {"fields": ("date_created", "date_updated", "white_reference_time")}),
+        ("Ingestion", {"fields": ("idempotency_key", "content_hash")}),
+        ("Date created", {"fields": ("date_created", "date_updated", "white_reference", "white_reference_time")}),
     )
-    readonly_fields = ("date_created", "date_updated")
+    raw_id_fields = ("white_reference",)
+    readonly_fields = ("date_created", "date_updated", "idempotency_key", "content_hash")
     ordering = ("-date_created",)
 
 
 @admin.register(Result)
 class ResultAdmin(admin.ModelAdmin):
-    list_display = ("measurement", "data", "date_created")
+    list_display = ("measurement", "data", "status", "date_created")
+    list_filter = ("status",)
     fieldsets = (
-        ("Result", {"fields": ("measurement", "data")}),
-        ("Date created", {"fields": ("date_created",)})
+        ("Result", {"fields": ("measurement", "data", "status")}),
+        ("Date created", {"fields": ("date_created", "date_started")})
     )
-    readonly_fields = ("date_created",)
+    readonly_fields = ("date_created", "date_started")
     ordering = ("-date_created",)
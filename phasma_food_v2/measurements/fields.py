@@ -2,9 +2,14 @@ import base64
 import six
 import uuid
 import imghdr
+from typing import Any, Optional, Union
+
+from django.db import models
 from django.core.files.base import ContentFile
 from rest_framework import serializers
 
+from .spectrum import Spectrum
+
 
 class Base64ImageField(serializers.ImageField):
     """Image field that enable image to be sent over REST API
@@ -48,3 +53,51 @@ class Base64ImageField(serializers.ImageField):
         extension = imghdr.what(file_name, decoded_file)
         extension = "jpg" if extension == "jpeg" else extension
         return extension
+
+
+class SpectrumJSONField(serializers.JSONField):
+    """JSON field for spectrometer data that is saved as packed spectrum."""
+
+    def to_representation(self, value: Union[dict, Spectrum]) -> Optional[dict]:
+        """Return legacy JSON structure of spectrum.
+
+        Parameters:
+            value (obj): Spectrum or dict if measurement is not reloaded from DB
+
+        Returns:
+            value (dict): Sensor data with lists of {"wave": ..., "measurement": ...}
+        """
+        if isinstance(value, Spectrum):
+            return value.to_legacy()
+        return super().to_representation(value)
+
+
+class SpectrumField(models.BinaryField):
+    """Model field that saves spectrometer data as packed float32 arrays
+    (see `Spectrum`) instead of JSON. It accepts legacy dict or
+    `Spectrum` and always returns `Spectrum` when loaded from DB.
+    """
+
+    def from_db_value(self, value: Any, expression: Any, connection: Any) -> Optional[Spectrum]:
+        if value is None:
+            return value
+        return Spectrum.from_bytes(value)
+
+    def to_python(self, value: Any) -> Optional[Spectrum]:
+        if value is None or isinstance(value, Spectrum):
+            return value
+        if value == "":
+            # Serialized empty spectrum (see `value_to_string`)
+            return None
+        if isinstance(value, dict):
+            return Spectrum.from_legacy(value)
+        return Spectrum.from_bytes(super().to_python(value))
+
+    def get_prep_value(self, value: Any) -> Optional[bytes]:
+        if value is None or isinstance(value, (bytes, memoryview)):
+            return value
+        return Spectrum.from_legacy(value).to_bytes()
+
+    def value_to_string(self, obj: models.Model) -> str:
+        value = self.get_prep_value(self.value_from_object(obj))
+        return base64.b64encode(value).decode("ascii") if value is not None else ""
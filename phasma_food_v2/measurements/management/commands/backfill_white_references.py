@@ -0,0 +1,54 @@
+from bisect import bisect_left
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from phasma_food_v2.measurements.models import Measurement
+
+
+class Command(BaseCommand):
+    help = "Link every measurement with last white reference measurement made before it."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true",
+                            help="Resolve white reference again for measurements that already have it.")
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        references = list(
+            Measurement.objects.filter(
+                use_case=Measurement.WHITE_REFERENCE
+            ).order_by(
+                "date_created"
+            ).values_list(
+                "date_created", "sample_id"
+            )
+        )
+        dates = [date_created for date_created, _ in references]
+
+        queryset = Measurement.objects.order_by("pk").only("sample_id", "date_created", "white_reference")
+        if not options["all"]:
+            queryset = queryset.filter(white_reference__isnull=True)
+
+        updated, last_pk = 0, None
+        while True:
+            chunk = queryset.filter(pk__gt=last_pk) if last_pk is not None else queryset
+            chunk = list(chunk[:options["batch_size"]])
+            if not chunk:
+                break
+            changed, now = [], timezone.now()
+            for measurement in chunk:
+                index = bisect_left(dates, measurement.date_created) - 1
+                white_reference_id = references[index][1] if index >= 0 else None
+                if measurement.white_reference_id != white_reference_id:
+                    measurement.white_reference_id = white_reference_id
+                    # bulk_update does not set auto_now fields, sync to Mongo and export cache use date_updated
+                    measurement.date_updated = now
+                    changed.append(measurement)
+            Measurement.objects.bulk_update(changed, ["white_reference", "date_updated"])
+            updated += len(changed)
+            last_pk = chunk[-1].pk
+
+        self.stdout.write(self.style.SUCCESS(
+            "Linked {} measurements with {} white references.".format(updated, len(references))
+        ))
@@ -0,0 +1,65 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from phasma_food_v2.measurements.models import Measurement
+from phasma_food_v2.measurements.registry import registry
+from phasma_food_v2.measurements.tasks import FUSION_SENSORS
+from phasma_food_v2.measurements.utils import extract_features
+
+
+class Command(BaseCommand):
+    help = "Compare FUSION predictions one measurement at a time with one batched predict call."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=256, help="Number of measurements in batch.")
+        parser.add_argument("--use-case", default=None)
+        parser.add_argument("--food-type", default=None)
+        parser.add_argument("--from-db", action="store_true",
+                            help="Use latest measurements instead of random feature vectors.")
+
+    def handle(self, *args, **options):
+        model = registry.get(options["use_case"], options["food_type"], "FUSION")
+        if model is None:
+            raise CommandError("FUSION model is not configured.")
+
+        matrix = self.from_db(options) if options["from_db"] else self.random(model, options["rows"])
+        if not len(matrix):
+            raise CommandError("There are no measurements with values for all sensors.")
+
+        started = time.perf_counter()
+        for row in matrix:
+            model.predict(row.reshape(1, -1))
+        per_row = time.perf_counter() - started
+
+        started = time.perf_counter()
+        model.predict(matrix)
+        batched = time.perf_counter() - started
+
+        self.stdout.write("Rows: {}, features: {}".format(*matrix.shape))
+        self.stdout.write("Per row: {:.4f} s ({:.2f} ms per measurement)".format(per_row, per_row / len(matrix) * 1000))
+        self.stdout.write("Batched: {:.4f} s ({:.2f} ms per measurement)".format(batched, batched / len(matrix) * 1000))
+        self.stdout.write(self.style.SUCCESS("Speedup: {:.1f}x".format(per_row / batched if batched else float("inf"))))
+
+    @staticmethod
+    def from_db(options: dict) -> np.ndarray:
+        queryset = Measurement.objects.only("vis", "fluo", "nir").order_by("-date_created")
+        if options["use_case"]:
+            queryset = queryset.filter(use_case=options["use_case"])
+        if options["food_type"]:
+            queryset = queryset.filter(food_type=options["food_type"])
+
+        rows = []
+        for measurement in queryset[:options["rows"]]:
+            features = extract_features({"vis": measurement.vis, "fluo": measurement.fluo, "nir": measurement.nir})
+            if all(sensor in features for sensor in FUSION_SENSORS):
+                rows.append(np.concatenate([features[sensor] for sensor in FUSION_SENSORS]))
+        return np.vstack(rows) if rows else np.empty((0, 0))
+
+    @staticmethod
+    def random(model, rows: int) -> np.ndarray:
+        n_features = getattr(model, "n_features_in_", None) or getattr(model, "n_features_", None)
+        if not n_features:
+            raise CommandError("Number of model features is unknown, use --from-db.")
+        return np.random.rand(rows, n_features)
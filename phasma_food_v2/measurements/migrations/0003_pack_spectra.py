@@ -0,0 +1,96 @@
+from django.db import migrations
+
+import phasma_food_v2.measurements.fields
+
+CHUNK_SIZE = 200
+SENSORS = ("vis", "nir", "fluo")
+
+
+def _chunks(Measurement, fields):
+    """Measurements ordered by primary key in chunks so the whole
+    table is never loaded in memory.
+    """
+    last_pk = None
+    while True:
+        queryset = Measurement.objects.order_by("pk").only("pk", *fields)
+        if last_pk is not None:
+            queryset = queryset.filter(pk__gt=last_pk)
+        chunk = list(queryset[:CHUNK_SIZE])
+        if not chunk:
+            return
+        yield chunk
+        last_pk = chunk[-1].pk
+
+
+def pack_spectra(apps, schema_editor):
+    Measurement = apps.get_model("measurements", "Measurement")
+    packed = ["{}_packed".format(sensor) for sensor in SENSORS]
+    for chunk in _chunks(Measurement, SENSORS):
+        for measurement in chunk:
+            for sensor in SENSORS:
+                setattr(measurement, "{}_packed".format(sensor), getattr(measurement, sensor))
+        Measurement.objects.bulk_update(chunk, packed)
+
+
+def unpack_spectra(apps, schema_editor):
+    Measurement = apps.get_model("measurements", "Measurement")
+    packed = ["{}_packed".format(sensor) for sensor in SENSORS]
+    for chunk in _chunks(Measurement, packed):
+        for measurement in chunk:
+            for sensor in SENSORS:
+                spectrum = getattr(measurement, "{}_packed".format(sensor))
+                setattr(measurement, sensor, spectrum.to_legacy() if spectrum is not None else None)
+        Measurement.objects.bulk_update(chunk, SENSORS)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('measurements', '0002_remove_measurement_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='measurement',
+            name='vis_packed',
+            field=phasma_food_v2.measurements.fields.SpectrumField(blank=True, help_text='Visible spectrometer data.', null=True),
+        ),
+        migrations.AddField(
+            model_name='measurement',
+            name='nir_packed',
+            field=phasma_food_v2.measurements.fields.SpectrumField(blank=True, help_text='Near-infrared spectrometer data.', null=True),
+        ),
+        migrations.AddField(
+            model_name='measurement',
+            name='fluo_packed',
+            field=phasma_food_v2.measurements.fields.SpectrumField(blank=True, help_text='Fluorescence spectrometer data.', null=True),
+        ),
+        migrations.RunPython(pack_spectra, unpack_spectra),
+        migrations.RemoveField(
+            model_name='measurement',
+            name='vis',
+        ),
+        migrations.RemoveField(
+            model_name='measurement',
+            name='nir',
+        ),
+        migrations.RemoveField(
+            model_name='measurement',
+            name='fluo',
+        ),
+        migrations.RenameField(
+            model_name='measurement',
+            old_name='vis_packed',
+            new_name='vis',
+        ),
+        migrations.RenameField(
+            model_name='measurement',
+            old_name='nir_packed',
+            new_name='nir',
+        ),
+        migrations.RenameField(
+            model_name='measurement',
+            old_name='fluo_packed',
+            new_name='fluo',
+        ),
+    ]
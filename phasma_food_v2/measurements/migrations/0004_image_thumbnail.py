@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('measurements', '0003_pack_spectra'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='thumbnail',
+            field=models.ImageField(blank=True, null=True, upload_to='images/food/thumbnails'),
+        ),
+    ]
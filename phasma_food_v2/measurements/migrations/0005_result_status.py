@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('measurements', '0004_image_thumbnail'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='result',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done')], db_index=True, default='done', help_text='Pending results are analyzed in next inference batch.', max_length=15),
+        ),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('measurements', '0005_result_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='measurement',
+            name='idempotency_key',
+            field=models.CharField(blank=True, help_text='Idempotency-Key header of request that created measurement.', max_length=255, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='measurement',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, help_text='SHA-256 of spectrometer data as it is sent.', max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,21 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('measurements', '0006_measurement_idempotency'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='measurement',
+            name='white_reference',
+            field=models.ForeignKey(blank=True, help_text='Last white reference measurement made before measurement.', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='referenced_measurements', to='measurements.Measurement'),
+        ),
+        migrations.AddIndex(
+            model_name='measurement',
+            index=models.Index(fields=['use_case', 'date_created'], name='measurement_usecase_date_idx'),
+        ),
+    ]
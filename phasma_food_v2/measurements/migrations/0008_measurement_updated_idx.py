@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('measurements', '0007_measurement_white_reference'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='measurement',
+            index=models.Index(fields=['date_updated', 'sample_id'], name='measurement_updated_idx'),
+        ),
+    ]
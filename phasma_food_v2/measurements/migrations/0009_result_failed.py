@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('measurements', '0008_measurement_updated_idx'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='result',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], db_index=True, default='done', help_text='Pending results are analyzed in next inference batch.', max_length=15),
+        ),
+        migrations.AddField(
+            model_name='result',
+            name='date_started',
+            field=models.DateTimeField(blank=True, help_text='Date when inference batch claimed result.', null=True),
+        ),
+    ]
@@ -8,6 +8,7 @@ class Image(models.Model):
                                     null=True
                                     )
     camera = models.ImageField(upload_to='images/food', null=True, blank=True)
+    thumbnail = models.ImageField(upload_to='images/food/thumbnails', null=True, blank=True)
     name = models.CharField(max_length=254, default="phasma_default_image_name")
 
     def __str__(self) -> str:
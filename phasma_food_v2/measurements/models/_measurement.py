@@ -1,11 +1,18 @@
+from datetime import datetime
+from typing import Optional
+
 from django.db import models
 from django.conf import settings
 from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 from django.contrib.postgres.fields import JSONField
 
+from ..fields import SpectrumField
+
 
 class Measurement(models.Model):
+    WHITE_REFERENCE = "White Reference"
+
     sample_id = models.IntegerField(primary_key=True,
                                     help_text=_("Measurement ID")
                                     )
@@ -177,23 +184,42 @@ class Measurement(models.Model):
                               blank=True,
                               help_text=_("Configuration of phasma device.")
                               )
-    vis = JSONField(null=True,
-                    blank=True,
-                    help_text=_("Visible spectrometer data.")
-                    )
-    nir = JSONField(null=True,
-                    blank=True,
-                    help_text=_("Near-infrared spectrometer data.")
-                    )
-    fluo = JSONField(null=True,
-                     blank=True,
-                     help_text=_("Fluorescence spectrometer data.")
-                     )
+    vis = SpectrumField(null=True,
+                        blank=True,
+                        help_text=_("Visible spectrometer data.")
+                        )
+    nir = SpectrumField(null=True,
+                        blank=True,
+                        help_text=_("Near-infrared spectrometer data.")
+                        )
+    fluo = SpectrumField(null=True,
+                         blank=True,
+                         help_text=_("Fluorescence spectrometer data.")
+                         )
+    white_reference = models.ForeignKey("self",
+                                        null=True,
+                                        blank=True,
+                                        on_delete=models.SET_NULL,
+                                        help_text=_("Last white reference measurement made before measurement."),
+                                        related_name="referenced_measurements"
+                                        )
     white_reference_time = models.CharField(max_length=127,
                                             null=True,
                                             blank=True,
                                             help_text=_("Time of white reference measurement.")
                                             )
+    idempotency_key = models.CharField(max_length=255,
+                                       null=True,
+                                       blank=True,
+                                       unique=True,
+                                       help_text=_("Idempotency-Key header of request that created measurement.")
+                                       )
+    content_hash = models.CharField(max_length=64,
+                                    null=True,
+                                    blank=True,
+                                    db_index=True,
+                                    help_text=_("SHA-256 of spectrometer data as it is sent.")
+                                    )
     date_created = models.DateTimeField(_('date created'),
                                         default=timezone.now,
                                         help_text=_("Date when measurement was made.")
@@ -205,6 +231,29 @@ class Measurement(models.Model):
 
     class Meta:
         ordering = ('-date_created',)
+        indexes = [
+            models.Index(fields=["use_case", "date_created"], name="measurement_usecase_date_idx"),
+            models.Index(fields=["date_updated", "sample_id"], name="measurement_updated_idx"),
+        ]
 
     def __str__(self) -> str:
         return str(self.sample_id)
+
+    @classmethod
+    def find_white_reference_id(cls, date_created: datetime) -> Optional[int]:
+        """ID of last white reference measurement made before date.
+
+        Parameter:
+            date_created (datetime): Date of measurement
+
+        Returns:
+            sample_id (int): White reference ID or None if it does not exist
+        """
+        return cls.objects.filter(
+            use_case=cls.WHITE_REFERENCE,
+            date_created__lt=date_created
+        ).order_by(
+            "-date_created"
+        ).values_list(
+            "sample_id", flat=True
+        ).first()
@@ -7,6 +7,17 @@ from ._measurement import Measurement
 
 
 class Result(models.Model):
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = (
+        (PENDING, _("Pending")),
+        (RUNNING, _("Running")),
+        (DONE, _("Done")),
+        (FAILED, _("Failed")),
+    )
+
     measurement = models.OneToOneField(Measurement,
                                        on_delete=models.CASCADE,
                                        primary_key=True,
@@ -16,6 +27,16 @@ class Result(models.Model):
                      blank=True,
                      help_text=_("Result of trained measurement.")
                      )
+    status = models.CharField(max_length=15,
+                              choices=STATUS_CHOICES,
+                              default=DONE,
+                              db_index=True,
+                              help_text=_("Pending results are analyzed in next inference batch.")
+                              )
+    date_started = models.DateTimeField(null=True,
+                                        blank=True,
+                                        help_text=_("Date when inference batch claimed result.")
+                                        )
     date_created = models.DateTimeField(_('date created'),
                                         default=timezone.now,
                                         help_text=_("Date when result was created.")
@@ -0,0 +1,113 @@
+import os
+import pickle
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+WILDCARD = "*"
+
+
+def load_model(path: str) -> Any:
+    with open(path, 'rb') as file:
+        model = pickle.load(file)
+    return model
+
+
+class ModelRegistry:
+    """Trained models that are loaded once per process (Celery worker)
+    and kept in memory.
+
+    Models are configured in `RULE_ENGINE_MODELS` as "use case/food type/sensor"
+    keys with path to pickled model relative to MEDIA_ROOT, "*" matches any
+    use case or food type. Model is loaded again when its file is changed
+    (modification time or size), least recently used models are removed when
+    there are more than `RULE_ENGINE_MODELS_CACHE_SIZE` of them.
+
+    Attributes:
+        models (dict): Configured models, key -> path
+        max_size (int): Maximum number of models in memory
+    """
+    def __init__(self, models: Dict[str, str] = None, max_size: int = None):
+        self.models = models
+        self.max_size = max_size
+        self._cache = OrderedDict()
+        self._lock = threading.RLock()
+        self._stats = {"hits": 0, "misses": 0, "reloads": 0, "evictions": 0, "load_seconds": 0.0}
+
+    def _configured(self) -> Tuple[Dict[str, str], int]:
+        models = self.models if self.models is not None else settings.RULE_ENGINE_MODELS
+        max_size = self.max_size if self.max_size is not None else settings.RULE_ENGINE_MODELS_CACHE_SIZE
+        return models, max_size
+
+    def path(self, use_case: Optional[str], food_type: Optional[str], sensor: str) -> Optional[str]:
+        """Path of model for use case, food type and sensor.
+
+        Returns:
+            path (str): Full path of model or None if model is not configured
+        """
+        models, _ = self._configured()
+        for key in (
+            (use_case, food_type, sensor),
+            (use_case, WILDCARD, sensor),
+            (WILDCARD, food_type, sensor),
+            (WILDCARD, WILDCARD, sensor),
+        ):
+            path = models.get("/".join(str(part) for part in key))
+            if path:
+                return os.path.join(settings.MEDIA_ROOT, path)
+        return None
+
+    def get(self, use_case: Optional[str], food_type: Optional[str], sensor: str) -> Optional[Any]:
+        """Loaded model for use case, food type and sensor.
+
+        Returns:
+            model (obj): Trained model or None if model is not configured
+        """
+        path = self.path(use_case, food_type, sensor)
+        if not path:
+            return None
+
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached = self._cache.get(path)
+            if cached and cached[0] == signature:
+                self._cache.move_to_end(path)
+                self._stats["hits"] += 1
+                return cached[1]
+
+            self._stats["misses"] += 1
+            if cached:
+                self._stats["reloads"] += 1
+            started = time.monotonic()
+            model = load_model(path)
+            elapsed = time.monotonic() - started
+            self._stats["load_seconds"] += elapsed
+            logger.info("Loaded model %s in %.3f s", path, elapsed)
+
+            self._cache[path] = (signature, model)
+            self._cache.move_to_end(path)
+            _, max_size = self._configured()
+            while len(self._cache) > max_size:
+                evicted, _ = self._cache.popitem(last=False)
+                self._stats["evictions"] += 1
+                logger.info("Removed model %s from memory", evicted)
+            return model
+
+    def stats(self) -> dict:
+        """Hit/miss counters, total load time and models that are in memory."""
+        with self._lock:
+            return dict(self._stats, loaded=list(self._cache), pid=os.getpid())
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+
+registry = ModelRegistry()
@@ -1,14 +1,18 @@
-from typing import Union
+import imghdr
+from typing import List, Set, Tuple, Union
 
+from celery import group
 from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
+from django.utils import timezone
 from rest_framework import serializers
 from fcm_django.models import FCMDevice
 from phasma_food_v2.devices.models import PhasmaDevice
 
 from .models import Measurement, Result, Image
-from .utils import calculate_average
-from .fields import Base64ImageField
-from .tasks import measurement_rule_engine
+from .utils import calculate_average, calculate_average_batch, extract_features, spectra_hash
+from .fields import Base64ImageField, SpectrumJSONField
+from .tasks import measurement_rule_engine, generate_image_thumbnail
 
 User = get_user_model()
 
@@ -22,6 +26,54 @@ class ImageSerializer(serializers.ModelSerializer):
         fields = "__all__"
 
 
+class ImageUploadSerializer(serializers.ModelSerializer):
+    """Camera image sent as multipart file. File is streamed to storage,
+    only image header is checked here, thumbnail is generated in background.
+    """
+    camera = serializers.FileField(use_url=True)
+    name = serializers.CharField(max_length=254, required=True)
+
+    class Meta:
+        model = Image
+        fields = ["id", "measurement", "name", "camera", "thumbnail"]
+        read_only_fields = ["measurement", "thumbnail"]
+
+    def create(self, validated_data: dict) -> Image:
+        """Save Image object to DB and queue thumbnail generation.
+
+        Parameter:
+            validated_data (dict): Image data that is validated and ready
+
+        Returns:
+            instance (obj): Image object saved in DB
+        """
+        image = Image.objects.create(**validated_data)
+        queue_thumbnails([image])
+        return image
+
+    def validate_camera(self, attr: object) -> Union[serializers.ValidationError, object]:
+        """Checks if uploaded file is image by its header.
+
+        Parameter:
+            attr (obj): Uploaded file
+
+        Returns:
+            attr (obj): Uploaded file or raise error
+        """
+        header = attr.read(32)
+        attr.seek(0)
+        if not imghdr.what(None, header):
+            raise serializers.ValidationError("Upload a valid image.")
+        return attr
+
+
+def queue_thumbnails(images: List[Image]) -> None:
+    """Generate thumbnails for images after transaction is committed."""
+    image_ids = [image.pk for image in images if image.camera]
+    if image_ids:
+        transaction.on_commit(lambda: [generate_image_thumbnail.delay(image_id) for image_id in image_ids])
+
+
 class MeasurementSerializer(serializers.Serializer):
     """Measurement model where filed names are changed
     to follow Python and Java Script conventions.
@@ -59,9 +111,9 @@ class MeasurementSerializer(serializers.Serializer):
     dilutedPct = serializers.CharField(source="diluted_pct", allow_null=True)
     package = serializers.CharField(allow_null=True)
     adul = serializers.CharField(source="adulterated", allow_null=True)
-    VIS = serializers.JSONField(source="vis", allow_null=True)
-    NIR = serializers.JSONField(source="nir", allow_null=True)
-    FLUO = serializers.JSONField(source="fluo", allow_null=True)
+    VIS = SpectrumJSONField(source="vis", allow_null=True)
+    NIR = SpectrumJSONField(source="nir", allow_null=True)
+    FLUO = SpectrumJSONField(source="fluo", allow_null=True)
     camera = ImageSerializer(many=True, write_only=True, allow_null=True, required=False)
     whiteReferenceTime = serializers.CharField(source="white_reference_time", allow_null=True)
     dateTime = serializers.DateTimeField(source="date_created", read_only=True)
@@ -88,27 +140,163 @@ class MeasurementSerializer(serializers.Serializer):
         """
         use_case = validated_data.get("use_case")
         operation = self.context.get("operation")
+        validated_data["content_hash"] = self.content_hash(validated_data)
+        validated_data["white_reference_id"] = Measurement.find_white_reference_id(timezone.now())
         validated_data = calculate_average(validated_data)
         validated_data = self.attach_use_case_sample_id(validated_data)
         camera_data = validated_data.pop("camera") if "camera" in validated_data else None
         measurement_saved = Measurement.objects.create(**validated_data)
         if camera_data:
-            for camera in camera_data:
+            queue_thumbnails([
                 Image.objects.create(
                     measurement=measurement_saved,
                     camera=camera.get("camera"),
                     name=camera.get("name")
-                )
+                ) for camera in camera_data
+            ])
 
-        if use_case.lower() != "test":
-            if operation.lower() == "analyze":
-                validated_data["owner"] = str(validated_data.get("owner", ""))
-                validated_data["mobile"] = str(validated_data.get("mobile", ""))
-                validated_data["phasma_device"] = str(validated_data.get("phasma_device", ""))
-                measurement_rule_engine.delay(validated_data)
+        if self.should_analyze(use_case, operation):
+            self.queue_rule_engine([measurement_saved.sample_id], [self.rule_engine_features(validated_data)])
 
         return measurement_saved
 
+    @classmethod
+    def bulk_create(cls, validated_items: List[dict], operation: str) -> Tuple[List[Measurement], Set[int]]:
+        """Save many Measurement objects to DB with one insert for
+        measurements and one for images.
+        Measurements whose sample ID is already in DB are skipped, also when they
+        are saved by concurrent request after validation.
+
+        Parameters:
+            validated_items (list): Measurements data that is validated and ready
+            operation (str): Operation from URL, measurements are analyzed if it is "analyze"
+
+        Returns:
+            instances (list): Measurement objects saved in DB
+            conflicts (set): Sample IDs that were already in DB
+        """
+        conflicts = set(Measurement.objects.filter(
+            sample_id__in=[validated_data["sample_id"] for validated_data in validated_items]
+        ).values_list("sample_id", flat=True))
+        validated_items = [item for item in validated_items if item["sample_id"] not in conflicts]
+
+        # Measurements are made in batch order, so white reference in batch is used by measurements after it
+        white_reference_id = Measurement.find_white_reference_id(timezone.now())
+        for validated_data in validated_items:
+            validated_data["content_hash"] = cls.content_hash(validated_data)
+            validated_data["white_reference_id"] = white_reference_id
+            if validated_data.get("use_case") == Measurement.WHITE_REFERENCE:
+                white_reference_id = validated_data["sample_id"]
+        validated_items = calculate_average_batch(validated_items)
+        measurements, images, features = [], [], {}
+        for validated_data in validated_items:
+            validated_data = cls.attach_use_case_sample_id(validated_data)
+            camera_data = validated_data.pop("camera") if "camera" in validated_data else None
+            measurement = Measurement(**validated_data)
+            measurements.append(measurement)
+            for camera in camera_data or []:
+                images.append(Image(measurement=measurement, camera=camera.get("camera"), name=camera.get("name")))
+            if cls.should_analyze(validated_data.get("use_case"), operation):
+                features[measurement.sample_id] = cls.rule_engine_features(validated_data)
+
+        while measurements:
+            try:
+                with transaction.atomic():
+                    Measurement.objects.bulk_create(measurements)
+                break
+            except IntegrityError:
+                # Concurrent request saved some of the measurements after they were checked
+                saved = set(Measurement.objects.filter(
+                    sample_id__in=[measurement.sample_id for measurement in measurements]
+                ).values_list("sample_id", flat=True))
+                if not saved:
+                    raise
+                conflicts |= saved
+                measurements = [measurement for measurement in measurements if measurement.sample_id not in saved]
+
+        created = {measurement.sample_id for measurement in measurements}
+        images = [image for image in images if image.measurement.sample_id in created]
+        analyze = [sample_id for sample_id in features if sample_id in created]
+        Image.objects.bulk_create(images)
+        queue_thumbnails(images)
+        cls.queue_rule_engine(analyze, [features[sample_id] for sample_id in analyze])
+
+        return measurements, conflicts
+
+    @staticmethod
+    def content_hash(validated_data: dict) -> str:
+        """Hash of spectra before averages are added, same as hash of request data."""
+        return spectra_hash(validated_data.get("vis"), validated_data.get("nir"), validated_data.get("fluo"))
+
+    @staticmethod
+    def should_analyze(use_case: str, operation: str) -> bool:
+        """Measurement is sent to rule engine only if analysis is requested
+        and it is not test measurement.
+        """
+        return use_case.lower() != "test" and (operation or "").lower() == "analyze"
+
+    @staticmethod
+    def rule_engine_features(validated_data: dict) -> dict:
+        """Preprocessed values of measurement that are sent to rule engine task
+        instead of whole measurement, everything else is loaded from DB.
+
+        Parameter:
+            validated_data (dict): Measurement data that is saved
+
+        Returns:
+            features (dict): Sensor name -> list of preprocessed values
+        """
+        return {sensor: values.tolist() for sensor, values in extract_features(validated_data).items()}
+
+    @staticmethod
+    def queue_rule_engine(sample_ids: List[int], features: List[dict]) -> None:
+        """Send measurements to rule engine after transaction is committed,
+        so task can load them from DB.
+
+        Parameters:
+            sample_ids (list): Measurement IDs
+            features (list): Preprocessed values for every measurement
+        """
+        if not sample_ids:
+            return
+        tasks = [measurement_rule_engine.s(sample_id, data) for sample_id, data in zip(sample_ids, features)]
+        transaction.on_commit(lambda: group(tasks).apply_async())
+
+    @staticmethod
+    def resolve_related(items: List[dict]) -> dict:
+        """Fetch users, mobiles, phasma devices and existing measurements
+        for many measurements at once, one query for each of them.
+        Result is used as serializer context so validation does not query DB.
+
+        Parameter:
+            items (list): Measurements as they are sent in request
+
+        Returns:
+            context (dict): Related objects by IDs used in request
+        """
+        items = [item for item in items if isinstance(item, dict)]
+        sample_ids = []
+        for item in items:
+            try:
+                sample_ids.append(int(item.get("sampleID")))
+            except (TypeError, ValueError):
+                continue
+
+        mobiles = {}
+        for mobile in FCMDevice.objects.filter(
+            device_id__in={str(item.get("mobileID")) for item in items}
+        ).order_by("pk"):
+            mobiles.setdefault(mobile.device_id, mobile)
+
+        return {
+            "users": User.objects.in_bulk({str(item.get("userID")) for item in items}, field_name="email"),
+            "mobiles": mobiles,
+            "phasma_devices": PhasmaDevice.objects.in_bulk({str(item.get("deviceID")) for item in items}),
+            "existing_samples": set(
+                Measurement.objects.filter(sample_id__in=sample_ids).values_list("sample_id", flat=True)
+            ),
+        }
+
     def update(self, instance: Measurement, validated_data: dict) -> Measurement:
         """Update Measurement object
 
@@ -164,11 +352,12 @@ class MeasurementSerializer(serializers.Serializer):
         camera_data = validated_data.pop("camera") if "camera" in validated_data else None
         Image.objects.filter(measurement=instance).delete()
         if camera_data:
-            for camera in camera_data:
+            queue_thumbnails([
                 Image.objects.create(measurement=instance,
                                      camera=camera.get("camera"),
                                      name=camera.get("name")
-                                     )
+                                     ) for camera in camera_data
+            ])
         return instance
 
     def to_representation(self, instance: Measurement) -> dict:
@@ -187,8 +376,10 @@ class MeasurementSerializer(serializers.Serializer):
         representation['dateTime'] = instance.date_created.strftime("%d %b %Y %H:%M")
         representation['dateUpdated'] = instance.date_updated.strftime("%d %b %Y %H:%M")
         request = self.context.get('request')
-        representation['camera'] = [{"name": m.name, "camera": request.build_absolute_uri(m.camera.url)} for m in
-                                    Image.objects.filter(measurement_id=representation["sampleID"]).all()]
+        representation['camera'] = [{"name": m.name,
+                                     "camera": request.build_absolute_uri(m.camera.url),
+                                     "thumbnail": request.build_absolute_uri(m.thumbnail.url) if m.thumbnail else None}
+                                    for m in Image.objects.filter(measurement_id=representation["sampleID"]).all()]
         return representation
 
     def validate_sampleID(self, attr: int) -> Union[serializers.ValidationError, int]:
@@ -202,7 +393,12 @@ class MeasurementSerializer(serializers.Serializer):
         """
         request = self.context["request"]
         if request.method.lower() == "post":
-            if Measurement.objects.filter(sample_id=attr).exists():
+            existing_samples = self.context.get("existing_samples")
+            if existing_samples is not None:
+                exists = attr in existing_samples
+            else:
+                exists = Measurement.objects.filter(sample_id=attr).exists()
+            if exists:
                 raise serializers.ValidationError("Sample with ID [{}] already exists.".format(attr))
         return attr
 
@@ -215,8 +411,11 @@ class MeasurementSerializer(serializers.Serializer):
         Returns:
             attr (str): User instance or raise error
         """
-        user_db = User.objects.filter(email=attr)
-        user_db = user_db.first()
+        users = self.context.get("users")
+        if users is not None:
+            user_db = users.get(attr)
+        else:
+            user_db = User.objects.filter(email=attr).first()
         if not user_db:
             raise serializers.ValidationError("User with email [{}] does not exist.".format(attr))
 
@@ -238,11 +437,15 @@ class MeasurementSerializer(serializers.Serializer):
         Returns:
             attr (str): Mobile instance or raise error
         """
-        mobile = FCMDevice.objects.filter(device_id=attr)
-        if not mobile.exists():
+        mobiles = self.context.get("mobiles")
+        if mobiles is not None:
+            mobile = mobiles.get(attr)
+        else:
+            mobile = FCMDevice.objects.filter(device_id=attr).first()
+        if not mobile:
             raise serializers.ValidationError("Mobile with #ID [{}] does not exist.".format(attr))
 
-        return mobile.first()
+        return mobile
 
     def validate_deviceID(self, attr: str) -> Union[serializers.ValidationError, PhasmaDevice]:
         """Checks if phasma device with ID exists.
@@ -253,11 +456,15 @@ class MeasurementSerializer(serializers.Serializer):
         Returns:
             attr (str): Phasma device instance or raise error
         """
-        phasma_device = PhasmaDevice.objects.filter(mac=attr)
-        if not phasma_device.exists():
+        phasma_devices = self.context.get("phasma_devices")
+        if phasma_devices is not None:
+            phasma_device = phasma_devices.get(attr)
+        else:
+            phasma_device = PhasmaDevice.objects.filter(mac=attr).first()
+        if not phasma_device:
             raise serializers.ValidationError("Phasma device with MAC address [{}] does not exist.".format(attr))
 
-        return phasma_device.first()
+        return phasma_device
 
 
     @staticmethod
@@ -0,0 +1,215 @@
+import json
+import struct
+from collections.abc import Mapping
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+_MAGIC = b"PFS1"
+_HEADER = struct.Struct("<4sI")
+_DTYPE = np.dtype("<f4")
+
+
+def as_float_list(values: np.ndarray) -> list:
+    """Convert float32 array to list of Python floats using
+    shortest decimal representation (0.3 instead of 0.30000001192092896).
+
+    Parameter:
+        values (array): Float32 array of any shape
+
+    Returns:
+        values (list): Nested list of floats, NaN is returned as None
+    """
+    decimal = np.asarray(values, dtype=_DTYPE).astype(str).astype(np.float64)
+    if np.isnan(decimal).any():
+        decimal = np.where(np.isnan(decimal), None, decimal)
+    return decimal.tolist()
+
+
+def _points(values: List[dict]) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """Split list of {"wave": ..., "measurement": ...} points into arrays.
+
+    Returns:
+        (wave, measurement) arrays or None if points are not in legacy format
+    """
+    try:
+        if not all(isinstance(point, dict) and len(point) == 2 for point in values):
+            return None
+        wave = np.array([point["wave"] for point in values], dtype=_DTYPE)
+        measurement = np.array(
+            [np.nan if point["measurement"] is None else point["measurement"] for point in values],
+            dtype=_DTYPE
+        )
+    except (KeyError, TypeError, ValueError):
+        return None
+    return wave, measurement
+
+
+class Spectrum(Mapping):
+    """Packed spectrometer data for single sensor (VIS, NIR or FLUO).
+
+    Every block (preprocessed, rawData, avgWhite...) is kept as float32 array
+    that shares wavelength axis with other blocks where it is possible.
+    Reading by key returns legacy list of {"wave": ..., "measurement": ...}
+    points (list of lists for replicated blocks) so existing code and REST API
+    keep working, while `wave` and `array` give direct access to arrays.
+
+    Attributes:
+        blocks (dict): Block name -> (wave, values, replicated)
+        extra (dict): Values that are not spectra and are kept as they are
+        order (list): Keys in original order
+    """
+    def __init__(self, blocks: Dict[str, Tuple[np.ndarray, np.ndarray, bool]] = None,
+                 extra: dict = None, order: List[str] = None):
+        self.blocks = blocks or {}
+        self.extra = extra or {}
+        self.order = order or list(self.blocks) + list(self.extra)
+
+    @classmethod
+    def from_legacy(cls, data: Union[dict, "Spectrum"]) -> "Spectrum":
+        """Build spectrum from legacy JSON structure.
+
+        Parameter:
+            data (dict): Sensor data as it is sent by mobile application
+
+        Returns:
+            spectrum (obj): Packed spectrum
+        """
+        if isinstance(data, Spectrum):
+            return data
+        blocks, extra = {}, {}
+        for key, value in data.items():
+            block = None
+            if isinstance(value, list) and value:
+                if all(isinstance(replicate, list) and replicate for replicate in value):
+                    block = cls._replicated_block(value)
+                else:
+                    points = _points(value)
+                    if points:
+                        block = (points[0], points[1], False)
+            if block:
+                blocks[key] = block
+            else:
+                extra[key] = value
+        return cls(blocks, extra, list(data))
+
+    @staticmethod
+    def _replicated_block(replicates: List[List[dict]]) -> Optional[Tuple[np.ndarray, np.ndarray, bool]]:
+        """Stack replicates that share wavelength axis into 2-D array."""
+        wave, rows = None, []
+        for replicate in replicates:
+            points = _points(replicate)
+            if not points:
+                return None
+            if wave is None:
+                wave = points[0]
+            elif not np.array_equal(wave, points[0]):
+                return None
+            rows.append(points[1])
+        return wave, np.vstack(rows), True
+
+    @classmethod
+    def from_bytes(cls, blob: Union[bytes, memoryview]) -> "Spectrum":
+        """Unpack spectrum that is saved in DB.
+
+        Parameter:
+            blob (bytes): Packed spectrum
+
+        Returns:
+            spectrum (obj): Spectrum with arrays that are views into blob
+        """
+        blob = bytes(blob)
+        magic, header_size = _HEADER.unpack_from(blob)
+        if magic != _MAGIC:
+            raise ValueError("Unknown spectrum format.")
+        offset = _HEADER.size
+        header = json.loads(blob[offset:offset + header_size].decode("utf-8"))
+        offset += header_size
+
+        axes = []
+        for size in header["axes"]:
+            axes.append(np.frombuffer(blob, dtype=_DTYPE, count=size, offset=offset))
+            offset += size * _DTYPE.itemsize
+
+        blocks = {}
+        for key, axis, replicates in header["blocks"]:
+            wave = axes[axis]
+            count = wave.size * (replicates or 1)
+            values = np.frombuffer(blob, dtype=_DTYPE, count=count, offset=offset)
+            if replicates:
+                values = values.reshape(replicates, wave.size)
+            blocks[key] = (wave, values, bool(replicates))
+            offset += count * _DTYPE.itemsize
+
+        return cls(blocks, header["extra"], header["order"])
+
+    def to_bytes(self) -> bytes:
+        """Pack spectrum to bytes. Equal wavelength axes are saved once.
+
+        Returns:
+            blob (bytes): Packed spectrum
+        """
+        axes, blocks = [], []
+        for key, (wave, values, replicated) in self.blocks.items():
+            for index, axis in enumerate(axes):
+                if np.array_equal(axis, wave):
+                    break
+            else:
+                index = len(axes)
+                axes.append(wave)
+            blocks.append([key, index, values.shape[0] if replicated else 0])
+
+        header = json.dumps({
+            "axes": [axis.size for axis in axes],
+            "blocks": blocks,
+            "extra": self.extra,
+            "order": self.order,
+        }, separators=(",", ":")).encode("utf-8")
+
+        payload = [np.ascontiguousarray(axis, dtype=_DTYPE).tobytes() for axis in axes]
+        payload += [np.ascontiguousarray(values, dtype=_DTYPE).tobytes() for _, values, _ in self.blocks.values()]
+        return _HEADER.pack(_MAGIC, len(header)) + header + b"".join(payload)
+
+    def to_legacy(self) -> dict:
+        """Legacy JSON structure that is used by REST API.
+
+        Returns:
+            data (dict): Sensor data with lists of {"wave": ..., "measurement": ...}
+        """
+        return {key: self[key] for key in self.order}
+
+    def wave(self, key: str) -> Optional[np.ndarray]:
+        """Wavelength axis of block or None if block does not exist."""
+        block = self.blocks.get(key)
+        return block[0] if block else None
+
+    def array(self, key: str) -> Optional[np.ndarray]:
+        """Values of block, 2-D (replicates x waves) for replicated blocks
+        and 1-D for others. None if block does not exist.
+        """
+        block = self.blocks.get(key)
+        return block[1] if block else None
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self.blocks:
+            wave, values, replicated = self.blocks[key]
+            waves = as_float_list(wave)
+            if replicated:
+                return [
+                    [{"wave": w, "measurement": m} for w, m in zip(waves, row)]
+                    for row in as_float_list(values)
+                ]
+            return [{"wave": w, "measurement": m} for w, m in zip(waves, as_float_list(values))]
+        return self.extra[key]
+
+    def __contains__(self, key: object) -> bool:
+        return key in self.blocks or key in self.extra
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.order)
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    def __repr__(self) -> str:
+        return "<Spectrum: {}>".format(", ".join(self.order))
@@ -1,52 +1,309 @@
-import pickle
+import os
+import logging
+from io import BytesIO
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Dict, List
+
 import numpy as np
+from PIL import Image as PILImage
 from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
 from celery import shared_task
 
-from .models import Measurement, Result
-from .utils import _sensors
+from .models import Measurement, Result, Image
+from .utils import FEATURE_DTYPE, _sensors, extract_features
+from .registry import registry
+
+
+FUSION_SENSORS = ("VIS", "FLUO", "NIR")
+FEATURES_CACHE_KEY = "rule-engine:features:{}"
+BATCH_LOCK_KEY = "rule-engine:batch"
+
+logger = logging.getLogger(__name__)
+_executor = None
+# Model calls that did not finish in time and still run in replaced thread pools
+_abandoned = 0
+
+
+@shared_task
+def measurement_rule_engine(sample_id: int, features: Dict[str, List[float]] = None) -> None:
+    """Queue measurement for analysis. Pending measurements are analyzed together by
+    `run_inference_batch` that is started at most once per RULE_ENGINE_BATCH_WINDOW seconds.
+
+    Parameters:
+        sample_id (int): Measurement ID, measurement is loaded from DB
+        features (dict): Preprocessed values per sensor if they are already extracted,
+        otherwise they are read from measurement spectra
+    """
+    if features is not None:
+        cache.set(FEATURES_CACHE_KEY.format(sample_id), features, settings.RULE_ENGINE_FEATURES_TIMEOUT)
+    Result.objects.update_or_create(measurement_id=sample_id, defaults={"status": Result.PENDING, "data": None})
+
+    window = settings.RULE_ENGINE_BATCH_WINDOW
+    if window <= 0:
+        run_inference_batch()
+    elif cache.add(BATCH_LOCK_KEY, sample_id, timeout=window):
+        run_inference_batch.apply_async(countdown=window)
 
 
 @shared_task
-def measurement_rule_engine(validated_data: dict) -> None:
-    results_final = get_results(validated_data)
-    measurement = Measurement.objects.select_related(
-        "mobile"
-    ).get(
-        sample_id=validated_data.get("sample_id")
+def run_inference_batch() -> None:
+    """Analyze up to RULE_ENGINE_BATCH_SIZE pending measurements with one
+    predict call per model, save results and notify mobiles.
+
+    Claimed results are marked as failed when batch fails, results that
+    stay running because worker is killed are queued again by `requeue_stale_results`.
+    """
+    # Measurements that are queued after this start next batch instead of waiting for lock to expire
+    cache.delete(BATCH_LOCK_KEY)
+    batch_size = settings.RULE_ENGINE_BATCH_SIZE
+    sample_ids = claim_batch(batch_size)
+    if not sample_ids:
+        return
+    if len(sample_ids) == batch_size:
+        run_inference_batch.delay()
+    try:
+        finish_batch(sample_ids)
+    except Exception:
+        logger.exception("Inference batch of %s measurements failed.", len(sample_ids))
+        Result.objects.filter(
+            measurement_id__in=sample_ids,
+            status=Result.RUNNING
+        ).update(status=Result.FAILED)
+
+
+def claim_batch(batch_size: int) -> List[int]:
+    """Mark oldest pending results as running, results that are locked
+    by other batch are skipped.
+
+    Returns:
+        sample_ids (list): IDs of claimed measurements
+    """
+    with transaction.atomic():
+        sample_ids = list(
+            Result.objects.select_for_update(
+                skip_locked=True
+            ).filter(
+                status=Result.PENDING
+            ).order_by(
+                "date_created"
+            ).values_list(
+                "measurement_id", flat=True
+            )[:batch_size]
+        )
+        Result.objects.filter(measurement_id__in=sample_ids).update(status=Result.RUNNING, date_started=timezone.now())
+    return sample_ids
+
+
+def finish_batch(sample_ids: List[int]) -> None:
+    """Predict claimed measurements and save results, measurements
+    without preprocessed values are marked as failed.
+    """
+    measurements = list(
+        Measurement.objects.select_related("mobile", "owner").defer("vis", "nir", "fluo").filter(
+            sample_id__in=sample_ids
+        )
     )
+    features = load_features(sample_ids)
+    groups = {}
+    for measurement in measurements:
+        if measurement.sample_id in features:
+            groups.setdefault((measurement.use_case, measurement.food_type), []).append(measurement)
+
+    results = {}
+    for (use_case, food_type), group in groups.items():
+        predictions = predict_batch([features[measurement.sample_id] for measurement in group], use_case, food_type)
+        results.update(zip([measurement.sample_id for measurement in group], predictions))
+
+    Result.objects.bulk_update(
+        [Result(measurement_id=sample_id, data=list(result.values()), status=Result.DONE)
+         for sample_id, result in results.items()],
+        ["data", "status"]
+    )
+    logger.info("Model registry after batch of %s measurements: %s", len(sample_ids), registry.stats())
+    failed = [sample_id for sample_id in sample_ids if sample_id not in results]
+    if failed:
+        logger.warning("Measurements %s have no preprocessed values.", failed)
+        Result.objects.filter(measurement_id__in=failed).update(status=Result.FAILED)
+
+    for measurement in measurements:
+        if measurement.sample_id not in results:
+            continue
+        try:
+            notify_mobile(measurement, results[measurement.sample_id])
+        except Exception:
+            logger.exception("Notification for measurement %s is not sent.", measurement.sample_id)
+
+
+@shared_task
+def requeue_stale_results() -> int:
+    """Queue again results that are running longer than RULE_ENGINE_RUNNING_TIMEOUT
+    seconds, their batch was lost with worker that ran it. Batch is also started
+    when results are pending longer than RULE_ENGINE_BATCH_WINDOW and
+    RULE_ENGINE_PENDING_GRACE seconds, batch that was scheduled for them was lost.
+
+    Returns:
+        count (int): Number of queued results
+    """
+    now = timezone.now()
+    started_before = now - timedelta(seconds=settings.RULE_ENGINE_RUNNING_TIMEOUT)
+    count = Result.objects.filter(
+        Q(date_started__lt=started_before) | Q(date_started__isnull=True),
+        status=Result.RUNNING
+    ).update(status=Result.PENDING, date_started=None)
+    if count:
+        logger.warning("Queued %s stale results again.", count)
+    created_before = now - timedelta(seconds=settings.RULE_ENGINE_BATCH_WINDOW + settings.RULE_ENGINE_PENDING_GRACE)
+    if count or Result.objects.filter(status=Result.PENDING, date_created__lt=created_before).exists():
+        run_inference_batch.delay()
+    return count
+
+
+def load_features(sample_ids: List[int]) -> Dict[int, Dict[str, np.ndarray]]:
+    """Preprocessed values of measurements from cache or,
+    if they are not there, from measurement spectra.
+    """
+    keys = {FEATURES_CACHE_KEY.format(sample_id): sample_id for sample_id in sample_ids}
+    features = {
+        keys[key]: {sensor: np.asarray(values, dtype=FEATURE_DTYPE) for sensor, values in cached.items()}
+        for key, cached in cache.get_many(list(keys)).items()
+    }
+    missing = [sample_id for sample_id in sample_ids if sample_id not in features]
+    for measurement in Measurement.objects.filter(sample_id__in=missing).only("sample_id", "vis", "fluo", "nir"):
+        try:
+            features[measurement.sample_id] = extract_features(
+                {"vis": measurement.vis, "fluo": measurement.fluo, "nir": measurement.nir}
+            )
+        except Exception:
+            logger.exception("Preprocessed values of measurement %s can not be extracted.", measurement.sample_id)
+    cache.delete_many(list(keys))
+    return features
+
+
+def notify_mobile(measurement: Measurement, result: dict) -> None:
+    """Send results of analysis to mobile that measurement is sent from."""
     fcm_mobile = measurement.mobile
+    if not fcm_mobile:
+        return
     context = {"sampleID": measurement.sample_id,
-               "VIS": results_final["VIS"],
-               "NIR": results_final["NIR"],
-               "FLUO": results_final["FLUO"],
-               "FUSION": results_final["FUSION"]
+               "VIS": result["VIS"],
+               "NIR": result["NIR"],
+               "FLUO": result["FLUO"],
+               "FUSION": result["FUSION"]
                }
 
     fcm_mobile.send_message(title="PhasmaFood notification for {}".format(measurement.owner.email),
                             body=context
                             )
 
-    results = [result for result in results_final.values()]
 
-    Result.objects.create(measurement=measurement, data=results)
+def get_executor() -> ThreadPoolExecutor:
+    """Thread pool shared by all inference calls in this process."""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.RULE_ENGINE_WORKERS, thread_name_prefix="rule-engine")
+    return _executor
+
+
+def abandon_executor(futures: list) -> None:
+    """Replace thread pool whose threads are blocked by models that timed out.
+    Running model can not be stopped, its thread is left to finish and next
+    calls use new pool.
+    """
+    global _executor, _abandoned
+    for future in futures:
+        future.cancel()
+    running = sum(1 for future in futures if not future.cancelled())
+    _abandoned += running
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
+    logger.warning("Thread pool with %s running models is replaced, %s models are abandoned in this process.",
+                   running, _abandoned)
+
 
+def _predict(use_case: str, food_type: str, sensor: str, matrix: np.ndarray) -> list:
+    return registry.get(use_case, food_type, sensor).predict(matrix).tolist()
 
-def get_results(validated_data: dict) -> dict:
-    result = {}
-    for s in _sensors:
-        result[s] = "N/A"
 
-    loaded = load_model("{}{}".format(settings.MEDIA_ROOT, "/trained_models/smp_fusion_bagging.pkl"))
-    vis = np.asarray([float(d['measurement']) for d in validated_data['vis']['preprocessed']]).reshape(1, -1)
-    fluo = np.asarray([float(d['measurement']) for d in validated_data['fluo']['preprocessed']]).reshape(1, -1)
-    nir = np.asarray([float(d['measurement']) for d in validated_data['nir']['preprocessed']]).reshape(1, -1)
-    fusion = np.concatenate([vis, fluo, nir], axis=1)
-    result['FUSION'] = loaded.predict(fusion)[0]
-    return result
+def predict_batch(rows: List[Dict[str, np.ndarray]], use_case: str = None, food_type: str = None) -> List[dict]:
+    """Predictions for many measurements of same use case and food type,
+    feature vectors are stacked into one matrix for each model.
+
+    Sensor models and FUSION model run concurrently in shared thread pool,
+    model that does not finish in RULE_ENGINE_MODEL_TIMEOUT seconds is skipped
+    and pool is replaced, so hanging model does not block next batches.
+
+    Parameters:
+        rows (list): Preprocessed values per sensor for every measurement
+        use_case (str): Use case of measurements
+        food_type (str): Food type of measurements
+
+    Returns:
+        results (list): Sensor -> prediction for every measurement, "N/A" if
+        there is no model or values
+    """
+    results = [{s: "N/A" for s in _sensors} for _ in rows]
+    inputs = {}
+    for index, features in enumerate(rows):
+        vectors = [(sensor, features[sensor]) for sensor in FUSION_SENSORS if sensor in features]
+        if len(vectors) == len(FUSION_SENSORS):
+            vectors.append(("FUSION", np.concatenate([vector for _, vector in vectors])))
+        for sensor, vector in vectors:
+            indexes, matrix = inputs.setdefault((sensor, vector.size), ([], []))
+            indexes.append(index)
+            matrix.append(vector)
+
+    futures = {}
+    for (sensor, _), (indexes, matrix) in inputs.items():
+        if registry.path(use_case, food_type, sensor):
+            future = get_executor().submit(_predict, use_case, food_type, sensor, np.vstack(matrix))
+            futures[future] = (sensor, indexes)
+    if not futures:
+        return results
+
+    done, not_done = wait(futures, timeout=settings.RULE_ENGINE_MODEL_TIMEOUT)
+    for future in not_done:
+        logger.warning("%s model for %s/%s timed out.", futures[future][0], use_case, food_type)
+    if not_done:
+        abandon_executor(list(not_done))
+    for future in done:
+        sensor, indexes = futures[future]
+        try:
+            predictions = future.result()
+        except Exception:
+            logger.exception("%s model for %s/%s failed.", sensor, use_case, food_type)
+            continue
+        for index, prediction in zip(indexes, predictions):
+            results[index][sensor] = prediction
+    return results
+
+
+def get_results(features: Dict[str, np.ndarray], use_case: str = None, food_type: str = None) -> dict:
+    """Predictions for single measurement, see `predict_batch`."""
+    return predict_batch([features], use_case, food_type)[0]
+
+
+@shared_task
+def generate_image_thumbnail(image_id: int) -> None:
+    """Create thumbnail of camera image. Images are only saved
+    during upload, decoding and resizing is done here.
+    """
+    image = Image.objects.filter(pk=image_id).first()
+    if not image or not image.camera:
+        return
 
+    with image.camera.open("rb") as camera:
+        picture = PILImage.open(camera)
+        picture.thumbnail(settings.IMAGE_THUMBNAIL_SIZE)
+        buffer = BytesIO()
+        picture.convert("RGB").save(buffer, format="JPEG")
 
-def load_model(path: str) -> pickle:
-    with open(path, 'rb') as file:
-        model = pickle.load(file)
-    return model
+    file_name = "{}.jpg".format(os.path.splitext(os.path.basename(image.camera.name))[0])
+    image.thumbnail.save(file_name, ContentFile(buffer.getvalue()), save=False)
+    Image.objects.filter(pk=image.pk).update(thumbnail=image.thumbnail.name)
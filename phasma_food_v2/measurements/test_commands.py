@@ -0,0 +1,23 @@
+from datetime import timedelta
+
+import pytest
+from django.core.management import call_command
+from django.utils import timezone
+
+from phasma_food_v2.measurements.models import Measurement
+
+pytestmark = pytest.mark.django_db
+
+
+class TestBackfillWhiteReferences:
+    def test_linked_measurements_are_updated(self):
+        Measurement.objects.create(sample_id=1, use_case="UC", food_type="FT")
+        reference = Measurement.objects.create(sample_id=10, use_case=Measurement.WHITE_REFERENCE, food_type="FT")
+        Measurement.objects.filter(pk=reference.pk).update(date_created=timezone.now() - timedelta(days=1))
+        before = timezone.now()
+
+        call_command("backfill_white_references")
+
+        measurement = Measurement.objects.get(sample_id=1)
+        assert measurement.white_reference_id == reference.sample_id
+        assert measurement.date_updated >= before
@@ -0,0 +1,55 @@
+import base64
+from io import BytesIO
+
+import pytest
+from django.core import serializers
+from PIL import Image as PILImage
+
+from phasma_food_v2.measurements.fields import Base64ImageField
+from phasma_food_v2.measurements.models import Measurement
+from phasma_food_v2.measurements.serializers import ImageSerializer
+from phasma_food_v2.measurements.spectrum import Spectrum
+
+
+def _round_trip(measurement: Measurement) -> Measurement:
+    data = serializers.serialize("json", [measurement])
+    return next(serializers.deserialize("json", data)).object
+
+
+class TestSpectrumField:
+    def test_empty_spectrum_is_serialized_as_string(self):
+        measurement = Measurement(sample_id=1, vis=None)
+
+        assert Measurement._meta.get_field("vis").value_to_string(measurement) == ""
+        assert _round_trip(measurement).vis is None
+
+    def test_spectrum_round_trip(self):
+        data = {"preprocessed": [{"wave": 400 + i, "measurement": i / 10} for i in range(5)]}
+        measurement = Measurement(sample_id=1, nir=Spectrum.from_legacy(data))
+
+        nir = _round_trip(measurement).nir
+
+        assert isinstance(nir, Spectrum)
+        assert nir.to_legacy() == data
+
+
+def _image(image_format: str) -> bytes:
+    buffer = BytesIO()
+    PILImage.new("RGB", (4, 4)).save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+class TestBase64ImageField:
+    @pytest.mark.parametrize("image_format, extension", [("PNG", "png"), ("JPEG", "jpg"), ("GIF", "gif")])
+    def test_extension_from_image_header(self, image_format, extension):
+        data = "data:image/png;base64," + base64.b64encode(_image(image_format)).decode()
+
+        camera = Base64ImageField().to_internal_value(data)
+
+        assert camera.name.endswith("." + extension)
+
+    def test_data_that_is_not_image(self):
+        serializer = ImageSerializer(data={"camera": base64.b64encode(b"not an image").decode(), "name": "food"})
+
+        assert not serializer.is_valid()
+        assert "camera" in serializer.errors
@@ -0,0 +1,78 @@
+import os
+import pickle
+
+import pytest
+
+from phasma_food_v2.measurements.registry import ModelRegistry
+
+
+@pytest.fixture
+def media(settings, tmpdir) -> str:
+    settings.MEDIA_ROOT = str(tmpdir)
+    return str(tmpdir)
+
+
+def _save(media: str, name: str, model: object, mtime: int = None) -> None:
+    path = os.path.join(media, name)
+    with open(path, "wb") as file:
+        pickle.dump(model, file)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+class TestModelRegistry:
+    def test_most_specific_model_is_used(self, media):
+        registry = ModelRegistry(models={
+            "UC/FT/VIS": "uc_ft.pkl",
+            "UC/*/VIS": "uc.pkl",
+            "*/FT/VIS": "ft.pkl",
+            "*/*/VIS": "any.pkl",
+        }, max_size=10)
+
+        assert registry.path("UC", "FT", "VIS") == os.path.join(media, "uc_ft.pkl")
+        assert registry.path("UC", "Other", "VIS") == os.path.join(media, "uc.pkl")
+        assert registry.path("Other", "FT", "VIS") == os.path.join(media, "ft.pkl")
+        assert registry.path("Other", "Other", "VIS") == os.path.join(media, "any.pkl")
+        assert registry.path(None, None, "VIS") == os.path.join(media, "any.pkl")
+        assert registry.path("UC", "FT", "NIR") is None
+        assert registry.get("UC", "FT", "NIR") is None
+
+    def test_model_is_loaded_once(self, media):
+        _save(media, "model.pkl", {"version": 1})
+        registry = ModelRegistry(models={"*/*/VIS": "model.pkl"}, max_size=10)
+
+        assert registry.get("UC", "FT", "VIS") == {"version": 1}
+        assert registry.get("UC", "Other", "VIS") == {"version": 1}
+        assert registry.stats()["hits"] == 1
+        assert registry.stats()["misses"] == 1
+
+    @pytest.mark.parametrize("model, mtime", [
+        ({"version": 2}, 1000),
+        ({"version": 3, "size": "changed"}, 2000),
+    ])
+    def test_changed_file_is_loaded_again(self, media, model, mtime):
+        _save(media, "model.pkl", {"version": 1}, mtime=2000)
+        registry = ModelRegistry(models={"*/*/VIS": "model.pkl"}, max_size=10)
+        registry.get("UC", "FT", "VIS")
+
+        # Same size with other modification time, or other size with same modification time
+        _save(media, "model.pkl", model, mtime=mtime)
+
+        assert registry.get("UC", "FT", "VIS") == model
+        assert registry.stats()["reloads"] == 1
+
+    def test_least_recently_used_model_is_evicted(self, media):
+        for sensor in ("VIS", "NIR", "FLUO"):
+            _save(media, "{}.pkl".format(sensor), sensor)
+        registry = ModelRegistry(models={"*/*/{}".format(sensor): "{}.pkl".format(sensor)
+                                         for sensor in ("VIS", "NIR", "FLUO")}, max_size=2)
+
+        registry.get("UC", "FT", "VIS")
+        registry.get("UC", "FT", "NIR")
+        registry.get("UC", "FT", "VIS")
+        registry.get("UC", "FT", "FLUO")
+
+        stats = registry.stats()
+        assert stats["loaded"] == [os.path.join(media, "VIS.pkl"), os.path.join(media, "FLUO.pkl")]
+        assert stats["evictions"] == 1
+        assert stats["pid"] == os.getpid()
@@ -0,0 +1,229 @@
+import json
+import threading
+from datetime import timedelta
+from io import BytesIO
+
+import numpy as np
+import pytest
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.utils import timezone
+from PIL import Image as PILImage
+
+from phasma_food_v2.measurements import tasks
+from phasma_food_v2.measurements.models import Image, Measurement, Result
+from phasma_food_v2.measurements.serializers import MeasurementSerializer
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def pending(settings) -> list:
+    settings.RULE_ENGINE_BATCH_SIZE = 10
+    measurements = [Measurement.objects.create(sample_id=sample_id, use_case="UC", food_type="FT")
+                    for sample_id in (1, 2)]
+    for measurement in measurements:
+        Result.objects.create(measurement=measurement, status=Result.PENDING)
+    return measurements
+
+
+def _features(sample_ids: list) -> dict:
+    return {sample_id: {"VIS": np.ones(3)} for sample_id in sample_ids}
+
+
+def _predict(rows: list, use_case: str, food_type: str) -> list:
+    return [{"VIS": 1} for _ in rows]
+
+
+def _statuses() -> dict:
+    return dict(Result.objects.values_list("measurement_id", "status"))
+
+
+class TestRunInferenceBatch:
+    def test_claimed_results_are_done(self, pending, monkeypatch):
+        monkeypatch.setattr(tasks, "load_features", _features)
+        monkeypatch.setattr(tasks, "predict_batch", _predict)
+
+        tasks.run_inference_batch()
+
+        assert _statuses() == {1: Result.DONE, 2: Result.DONE}
+        assert Result.objects.get(pk=1).data == [1]
+
+    def test_claimed_results_are_not_claimed_again(self, pending):
+        assert sorted(tasks.claim_batch(10)) == [1, 2]
+        assert tasks.claim_batch(10) == []
+        assert _statuses() == {1: Result.RUNNING, 2: Result.RUNNING}
+        assert not Result.objects.filter(date_started__isnull=True).exists()
+
+    def test_failed_batch_marks_results_failed(self, pending, monkeypatch):
+        def fail(rows, use_case, food_type):
+            raise RuntimeError("model is broken")
+
+        monkeypatch.setattr(tasks, "load_features", _features)
+        monkeypatch.setattr(tasks, "predict_batch", fail)
+
+        tasks.run_inference_batch()
+
+        assert _statuses() == {1: Result.FAILED, 2: Result.FAILED}
+
+    def test_missing_features_fail_only_their_measurement(self, pending, monkeypatch):
+        monkeypatch.setattr(tasks, "load_features", lambda sample_ids: _features([1]))
+        monkeypatch.setattr(tasks, "predict_batch", _predict)
+
+        tasks.run_inference_batch()
+
+        assert _statuses() == {1: Result.DONE, 2: Result.FAILED}
+
+
+class TestMeasurementRuleEngine:
+    def test_measurement_queued_during_batch_starts_next_batch(self, settings, monkeypatch):
+        settings.RULE_ENGINE_BATCH_WINDOW = 60
+        cache.clear()
+        for sample_id in (1, 2):
+            Measurement.objects.create(sample_id=sample_id, use_case="UC", food_type="FT")
+        scheduled = []
+        monkeypatch.setattr(tasks.run_inference_batch, "apply_async", lambda countdown: scheduled.append(countdown))
+        monkeypatch.setattr(tasks, "load_features", _features)
+        monkeypatch.setattr(tasks, "predict_batch", _predict)
+        claim_batch = tasks.claim_batch
+
+        def claim_and_queue(batch_size):
+            sample_ids = claim_batch(batch_size)
+            # Measurement arrives after running batch claimed its results
+            tasks.measurement_rule_engine(2)
+            return sample_ids
+
+        tasks.measurement_rule_engine(1)
+        monkeypatch.setattr(tasks, "claim_batch", claim_and_queue)
+        tasks.run_inference_batch()
+
+        assert scheduled == [60, 60]
+        assert _statuses() == {1: Result.DONE, 2: Result.PENDING}
+
+        monkeypatch.setattr(tasks, "claim_batch", claim_batch)
+        tasks.run_inference_batch()
+        assert _statuses() == {1: Result.DONE, 2: Result.DONE}
+
+
+class TestRequeueStaleResults:
+    def test_stale_running_results_are_pending_again(self, settings, pending, monkeypatch):
+        settings.RULE_ENGINE_RUNNING_TIMEOUT = 60
+        started = []
+        monkeypatch.setattr(tasks.run_inference_batch, "delay", lambda: started.append(True))
+        Result.objects.filter(pk=1).update(status=Result.RUNNING, date_started=timezone.now() - timedelta(hours=1))
+        Result.objects.filter(pk=2).update(status=Result.RUNNING, date_started=timezone.now())
+
+        assert tasks.requeue_stale_results() == 1
+        assert _statuses() == {1: Result.PENDING, 2: Result.RUNNING}
+        assert started == [True]
+
+    def test_batch_is_started_for_old_pending_results(self, settings, pending, monkeypatch):
+        settings.RULE_ENGINE_BATCH_WINDOW = 2
+        settings.RULE_ENGINE_PENDING_GRACE = 60
+        started = []
+        monkeypatch.setattr(tasks.run_inference_batch, "delay", lambda: started.append(True))
+
+        assert tasks.requeue_stale_results() == 0
+        assert started == []
+
+        Result.objects.filter(pk=1).update(date_created=timezone.now() - timedelta(seconds=63))
+        assert tasks.requeue_stale_results() == 0
+        assert started == [True]
+
+
+class FakeModel:
+    def __init__(self, release: threading.Event = None):
+        self.release = release
+
+    def predict(self, matrix: np.ndarray) -> np.ndarray:
+        if self.release is not None:
+            self.release.wait(10)
+        return np.arange(len(matrix))
+
+
+class FakeRegistry:
+    def __init__(self, models: dict):
+        self.models = models
+
+    def path(self, use_case: str, food_type: str, sensor: str) -> str:
+        return "{}.pkl".format(sensor) if (use_case, sensor) in self.models else None
+
+    def get(self, use_case: str, food_type: str, sensor: str) -> FakeModel:
+        return self.models[(use_case, sensor)]
+
+
+class TestPredictBatch:
+    def test_hanging_model_does_not_block_next_batch(self, settings, monkeypatch):
+        settings.RULE_ENGINE_WORKERS = 1
+        settings.RULE_ENGINE_MODEL_TIMEOUT = 0.2
+        release = threading.Event()
+        monkeypatch.setattr(tasks, "_executor", None)
+        monkeypatch.setattr(tasks, "_abandoned", 0)
+        monkeypatch.setattr(tasks, "registry", FakeRegistry({
+            ("Hanging", "VIS"): FakeModel(release), ("UC", "VIS"): FakeModel()
+        }))
+
+        try:
+            assert tasks.predict_batch([{"VIS": np.ones(3)}], "Hanging", "FT")[0]["VIS"] == "N/A"
+            assert tasks._abandoned == 1
+            assert tasks.predict_batch([{"VIS": np.ones(3)}, {"VIS": np.ones(3)}], "UC", "FT") == [
+                {"VIS": 0, "FLUO": "N/A", "NIR": "N/A", "FUSION": "N/A"},
+                {"VIS": 1, "FLUO": "N/A", "NIR": "N/A", "FUSION": "N/A"},
+            ]
+        finally:
+            release.set()
+
+
+class TestLoadFeatures:
+    def test_request_and_db_features_are_identical(self):
+        spectra = {
+            key: {"preprocessed": [{"wave": 400 + i, "measurement": offset + i / 3} for i in range(5)]}
+            for offset, key in enumerate(("vis", "nir", "fluo"))
+        }
+        for sample_id in (1, 2):
+            Measurement.objects.create(sample_id=sample_id, use_case="UC", food_type="FT", **spectra)
+        # Features of request data are sent to task as JSON
+        inline = json.loads(json.dumps(MeasurementSerializer.rule_engine_features(spectra)))
+        cache.set(tasks.FEATURES_CACHE_KEY.format(1), inline)
+
+        features = tasks.load_features([1, 2])
+
+        assert sorted(features[1]) == sorted(features[2]) == ["FLUO", "NIR", "VIS"]
+        for sensor in features[1]:
+            assert features[1][sensor].dtype == features[2][sensor].dtype == np.float32
+            assert np.array_equal(features[1][sensor], features[2][sensor])
+
+
+def _png(size: tuple) -> ContentFile:
+    buffer = BytesIO()
+    PILImage.new("RGBA", size, (255, 0, 0, 128)).save(buffer, format="PNG")
+    return ContentFile(buffer.getvalue(), name="food.png")
+
+
+class TestGenerateImageThumbnail:
+    @pytest.fixture(autouse=True)
+    def media(self, settings, tmpdir):
+        settings.MEDIA_ROOT = str(tmpdir)
+        settings.IMAGE_THUMBNAIL_SIZE = (64, 64)
+
+    def test_thumbnail_is_resized_jpeg(self):
+        image = Image.objects.create(camera=_png((300, 150)), name="food")
+
+        tasks.generate_image_thumbnail(image.pk)
+
+        image.refresh_from_db()
+        assert image.thumbnail.name == "images/food/thumbnails/food.jpg"
+        with image.thumbnail.open("rb") as thumbnail:
+            picture = PILImage.open(thumbnail)
+            assert picture.format == "JPEG"
+            assert picture.size == (64, 32)
+        assert image.camera.name == "images/food/food.png"
+
+    def test_image_without_camera_is_skipped(self):
+        image = Image.objects.create(name="food")
+
+        tasks.generate_image_thumbnail(image.pk)
+        tasks.generate_image_thumbnail(image.pk + 1)
+
+        image.refresh_from_db()
+        assert not image.thumbnail
@@ -0,0 +1,204 @@
+from io import BytesIO
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from fcm_django.models import FCMDevice
+from PIL import Image as PILImage
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from phasma_food_v2.devices.models import PhasmaDevice
+from phasma_food_v2.measurements.models import Measurement
+from phasma_food_v2.measurements.serializers import MeasurementSerializer
+from phasma_food_v2.measurements.utils import spectra_hash
+from phasma_food_v2.measurements.views import (
+    bulk_create_measurement, create_measurement, model_registry_stats, upload_image
+)
+
+pytestmark = pytest.mark.django_db
+
+NULL_FIELDS = [
+    "laboratory", "foodType", "foodSubtype", "granularity", "mycotoxins", "aflatoxinName", "aflatoxinUnit",
+    "aflatoxinValue", "temperature", "tempExposureHours", "microbioSampleId", "microbiologicalUnit",
+    "microbiologicalValue", "otherSpecies", "adulterationSampleId", "alcoholLabel", "authentic", "puritySMP",
+    "lowValueFiller", "nitrogenEnhancer", "hazardOneName", "hazardOnePct", "hazardTwoName", "hazardTwoPct",
+    "dilutedPct", "package", "adul", "VIS", "NIR", "FLUO", "whiteReferenceTime",
+]
+
+
+@pytest.fixture
+def user():
+    user = get_user_model().objects.create_user(email="user@example.com", password="password")
+    FCMDevice.objects.create(registration_id="registration", type="android", device_id="mobile", user=user)
+    PhasmaDevice.objects.create(mac="00:11:22:33:44:55", name="Phasma")
+    return user
+
+
+def _measurement(sample_id: int) -> dict:
+    data = dict.fromkeys(NULL_FIELDS)
+    data.update({"sampleID": sample_id, "userID": "user@example.com", "mobileID": "mobile",
+                 "deviceID": "00:11:22:33:44:55", "useCase": "Test"})
+    return data
+
+
+def _bulk_create(user, items: list):
+    request = APIRequestFactory().post("/fake-url/", items, format="json")
+    force_authenticate(request, user=user)
+    return bulk_create_measurement(request)
+
+
+def _statuses(response) -> list:
+    return [(item["sampleID"], item["status"]) for item in response.data["results"]]
+
+
+class TestCreateMeasurement:
+    @staticmethod
+    def create(user, data: dict, key: str = None):
+        headers = {"HTTP_IDEMPOTENCY_KEY": key} if key else {}
+        request = APIRequestFactory().post("/fake-url/", data, format="json", **headers)
+        force_authenticate(request, user=user)
+        return create_measurement(request)
+
+    @staticmethod
+    def save_concurrently(monkeypatch, **fields) -> None:
+        """Concurrent request saves measurement after this one is validated."""
+        validate_sample_id = MeasurementSerializer.validate_sampleID
+
+        def validate_and_save(serializer, attr):
+            attr = validate_sample_id(serializer, attr)
+            Measurement.objects.create(sample_id=1, use_case="Test", **fields)
+            return attr
+
+        monkeypatch.setattr(MeasurementSerializer, "validate_sampleID", validate_and_save)
+
+    def test_retried_request_returns_saved_measurement(self, user):
+        first = self.create(user, _measurement(1), key="key")
+        retried = self.create(user, _measurement(1), key="key")
+
+        assert first.status_code == 201
+        assert retried.status_code == 200
+        assert retried.data["sampleID"] == 1
+        assert self.create(user, _measurement(1)).status_code == 200
+        assert Measurement.objects.count() == 1
+
+    def test_key_used_for_other_data(self, user):
+        self.create(user, _measurement(1), key="key")
+        other = _measurement(2)
+        other["VIS"] = {"preprocessed": [{"wave": 400, "measurement": 1}]}
+
+        response = self.create(user, other, key="key")
+
+        assert response.status_code == 422
+        assert not Measurement.objects.filter(sample_id=2).exists()
+
+    def test_key_used_by_other_user(self, user):
+        self.create(user, _measurement(1), key="key")
+        other_user = get_user_model().objects.create_user(email="other@example.com", password="password")
+
+        assert self.create(other_user, _measurement(1), key="key").status_code == 409
+
+    def test_concurrent_retry_returns_saved_measurement(self, user, monkeypatch):
+        self.save_concurrently(monkeypatch, owner=user, idempotency_key="key",
+                               content_hash=spectra_hash(None, None, None))
+
+        response = self.create(user, _measurement(1), key="key")
+
+        assert response.status_code == 200
+        assert response.data["sampleID"] == 1
+        assert Measurement.objects.count() == 1
+
+    def test_concurrent_measurement_with_same_sample_id(self, user, monkeypatch):
+        self.save_concurrently(monkeypatch)
+
+        response = self.create(user, _measurement(1), key="key")
+
+        assert response.status_code == 400
+        assert response.data["sampleID"] == ["Sample with ID [1] already exists."]
+
+
+class TestBulkCreateMeasurement:
+    def test_all_measurements_are_created(self, user):
+        response = _bulk_create(user, [_measurement(1), _measurement(2)])
+
+        assert response.status_code == 201
+        assert _statuses(response) == [(1, "created"), (2, "created")]
+        assert sorted(Measurement.objects.values_list("sample_id", flat=True)) == [1, 2]
+
+    def test_invalid_and_existing_measurements(self, user):
+        Measurement.objects.create(sample_id=3, use_case="Test")
+        invalid = _measurement(4)
+        invalid["mobileID"] = "unknown"
+
+        response = _bulk_create(user, [_measurement(1), _measurement(1), _measurement(3), invalid])
+
+        assert response.status_code == 207
+        assert _statuses(response) == [(1, "created"), (1, "invalid"), (3, "invalid"), (4, "invalid")]
+        assert "mobileID" in response.data["results"][3]["errors"]
+        assert sorted(Measurement.objects.values_list("sample_id", flat=True)) == [1, 3]
+
+    def test_measurement_saved_by_concurrent_request_is_conflict(self, user, monkeypatch):
+        find_white_reference_id = Measurement.find_white_reference_id
+
+        def save_concurrently(date_created):
+            # Concurrent request saves measurement after it is validated
+            Measurement.objects.create(sample_id=2, use_case="Test")
+            return find_white_reference_id(date_created)
+
+        monkeypatch.setattr(Measurement, "find_white_reference_id", save_concurrently)
+
+        response = _bulk_create(user, [_measurement(1), _measurement(2)])
+
+        assert response.status_code == 207
+        assert _statuses(response) == [(1, "created"), (2, "conflict")]
+        assert response.data["results"][1]["errors"] == {"sampleID": ["Sample with ID [2] already exists."]}
+
+    def test_conflicts_are_skipped_by_bulk_create(self, user):
+        Measurement.objects.create(sample_id=2, use_case="Test")
+        items = [{"sample_id": sample_id, "owner": user, "use_case": "Test"} for sample_id in (1, 2)]
+
+        measurements, conflicts = MeasurementSerializer.bulk_create(items, "")
+
+        assert [measurement.sample_id for measurement in measurements] == [1]
+        assert conflicts == {2}
+
+
+class TestUploadImage:
+    @pytest.fixture
+    def measurement(self, user, settings, tmpdir) -> Measurement:
+        settings.MEDIA_ROOT = str(tmpdir)
+        return Measurement.objects.create(sample_id=1, owner=user, use_case="Test")
+
+    @staticmethod
+    def upload(measurement: Measurement, content: bytes):
+        camera = SimpleUploadedFile("food.png", content)
+        request = APIRequestFactory().post("/fake-url/", {"camera": camera, "name": "food"}, format="multipart")
+        force_authenticate(request, user=measurement.owner)
+        return upload_image(request, sample_id=str(measurement.sample_id))
+
+    def test_image_is_saved(self, measurement):
+        buffer = BytesIO()
+        PILImage.new("RGB", (4, 4)).save(buffer, format="PNG")
+
+        response = self.upload(measurement, buffer.getvalue())
+
+        assert response.status_code == 201
+        assert measurement.images.get().camera.read() == buffer.getvalue()
+
+    def test_file_without_image_header_is_rejected(self, measurement):
+        response = self.upload(measurement, b"not an image, only text")
+
+        assert response.status_code == 400
+        assert response.data["camera"] == ["Upload a valid image."]
+
+
+class TestModelRegistryStats:
+    def test_admin_only(self, user):
+        request = APIRequestFactory().get("/fake-url/")
+        force_authenticate(request, user=user)
+
+        assert model_registry_stats(request).status_code == 403
+
+        user.is_staff = True
+        response = model_registry_stats(request)
+        assert response.status_code == 200
+        assert set(response.data["model_registry"]) >= {"hits", "misses", "reloads", "evictions", "loaded"}
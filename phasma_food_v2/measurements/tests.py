@@ -1,3 +1,80 @@
-from django.test import TestCase
+import numpy as np
+import pytest
 
-# Create your tests here.
+from phasma_food_v2.measurements.spectrum import Spectrum
+from phasma_food_v2.measurements.utils import (
+    calculate_average, calculate_average_batch, spectra_hash, stack_replicates
+)
+
+
+def _points(offset: float) -> list:
+    return [{"wave": 400 + i, "measurement": offset + i / 10} for i in range(5)]
+
+
+class TestSpectrum:
+    def test_pack_round_trip(self):
+        data = {
+            "rawData": [_points(0), _points(1)],
+            "preprocessed": _points(2),
+            "rawWhite": [],
+            "label": "white",
+        }
+
+        spectrum = Spectrum.from_bytes(Spectrum.from_legacy(data).to_bytes())
+
+        assert spectrum.to_legacy() == data
+        assert spectrum.array("rawData").shape == (2, 5)
+        assert list(spectrum) == ["rawData", "preprocessed", "rawWhite", "label"]
+
+    def test_shared_wave_axis_is_saved_once(self):
+        data = {"preprocessed": _points(0), "avgData": _points(1)}
+
+        spectrum = Spectrum.from_bytes(Spectrum.from_legacy(data).to_bytes())
+
+        assert spectrum.wave("preprocessed") is spectrum.wave("avgData")
+
+    def test_replicates_with_different_waves_are_kept_as_json(self):
+        shifted = [{"wave": point["wave"] + 1, "measurement": point["measurement"]} for point in _points(0)]
+        data = {"rawData": [_points(0), shifted]}
+
+        spectrum = Spectrum.from_legacy(data)
+
+        assert "rawData" in spectrum.extra
+        assert Spectrum.from_bytes(spectrum.to_bytes())["rawData"] == data["rawData"]
+
+
+class TestCalculateAverage:
+    def test_median_of_replicates(self):
+        data = {"vis": {"rawData": [_points(0), _points(1), _points(5)]}, "fluo": {"rawDark": [_points(2)]}}
+
+        calculate_average(data)
+
+        assert data["vis"]["avgData"] == _points(1)
+        assert data["fluo"]["avgDark"] == _points(2)
+
+    def test_replicates_on_different_waves(self):
+        wave, stack = stack_replicates([
+            [{"wave": 2, "measurement": "1"}, {"wave": 1, "measurement": 2}],
+            [{"wave": 3, "measurement": 4}]
+        ])
+
+        assert wave.tolist() == [1, 2, 3]
+        np.testing.assert_array_equal(stack, [[2, 1, np.nan], [np.nan, np.nan, 4]])
+
+    def test_batch_matches_single(self):
+        batch = [{"vis": {"rawWhite": [_points(i), _points(i + 2)]}} for i in range(3)]
+
+        calculate_average_batch(batch)
+
+        for i, data in enumerate(batch):
+            expected = [point["measurement"] for point in _points(i + 1)]
+            assert [point["measurement"] for point in data["vis"]["avgWhite"]] == pytest.approx(expected)
+
+
+class TestSpectraHash:
+    def test_key_order_does_not_change_hash(self):
+        vis = {"preprocessed": _points(0), "label": "sample"}
+        reordered = {"label": "sample", "preprocessed": _points(0)}
+
+        assert spectra_hash(vis=vis) == spectra_hash(vis=reordered)
+        assert spectra_hash(vis=vis) != spectra_hash(nir=vis)
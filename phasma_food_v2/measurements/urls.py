@@ -1,10 +1,21 @@
 from django.urls import path
 
-from .views import create_measurement, rud_measurement, rud_result, list_result
+from .views import (
+    create_measurement,
+    bulk_create_measurement,
+    rud_measurement,
+    upload_image,
+    rud_result,
+    list_result,
+    model_registry_stats
+)
 
 urlpatterns = [
     path('measurement/create/', create_measurement, name="create_measurement"),
+    path('measurement/bulk-create/', bulk_create_measurement, name="bulk_create_measurement"),
     path('measurement/<str:sample_id>/', rud_measurement, name="rud_measurement"),
+    path('measurement/<str:sample_id>/images/', upload_image, name="upload_image"),
     path('results/', list_result, name="list_results"),
     path('result/<str:measurement_id>/', rud_result, name="rud_result"),
+    path('models/', model_registry_stats, name="model_registry_stats"),
 ]
@@ -1,4 +1,11 @@
-import pandas as pd
+import json
+import hashlib
+import warnings
+from typing import Dict, Iterable, List, Mapping, Sequence, Tuple
+
+import numpy as np
+
+from .spectrum import Spectrum
 
 
 _foods = {
@@ -23,6 +30,89 @@ _foods = {
 _sensors = ["VIS", "FLUO", "NIR", "FUSION"]
 
 
+_feature_sensors = {"VIS": "vis", "FLUO": "fluo", "NIR": "nir"}
+# Spectra are saved as float32, features of request data are rounded the same way
+FEATURE_DTYPE = np.float32
+_averaged_sensors = "vis", "fluo"
+_replicated_keys = "rawData", "rawWhite", "rawDark"
+
+
+def spectra_hash(vis: Mapping = None, nir: Mapping = None, fluo: Mapping = None) -> str:
+    """SHA-256 of spectrometer data as it is sent by mobile application,
+    keys are sorted so same spectra always have same hash.
+
+    Returns:
+        hash (str): Hex digest
+    """
+    payload = json.dumps({"VIS": vis, "NIR": nir, "FLUO": fluo}, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _to_float(values: Sequence) -> np.ndarray:
+    """Convert values to float array, values that are not
+    numbers become NaN.
+    """
+    try:
+        return np.array(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        converted = []
+        for value in values:
+            try:
+                converted.append(float(value))
+            except (TypeError, ValueError):
+                converted.append(np.nan)
+        return np.array(converted, dtype=np.float64)
+
+
+def stack_replicates(replicates: List[List[dict]]) -> Tuple[np.ndarray, np.ndarray]:
+    """Stack replicates on shared wave axis.
+
+    Parameter:
+        replicates (list): Replicates, each is list of {"wave": ..., "measurement": ...}
+
+    Returns:
+        wave (array): Sorted unique waves of all replicates
+        stack (array): 2-D array (replicates x waves), NaN where replicate
+        does not have value for wave
+    """
+    waves = [_to_float([point["wave"] for point in replicate]) for replicate in replicates]
+    values = [_to_float([point["measurement"] for point in replicate]) for replicate in replicates]
+
+    first = waves[0]
+    if all(wave.shape == first.shape and np.array_equal(wave, first) for wave in waves):
+        order = np.argsort(first, kind="stable")
+        return first[order], np.vstack(values)[:, order]
+
+    wave = np.unique(np.concatenate(waves))
+    stack = np.full((len(replicates), wave.size), np.nan)
+    for row, (replicate_wave, replicate_values) in enumerate(zip(waves, values)):
+        stack[row, np.searchsorted(wave, replicate_wave)] = replicate_values
+    return wave, stack
+
+
+def replicate_statistics(stack: np.ndarray,
+                         statistics: Iterable[str] = ("median", "mean", "std")) -> Dict[str, np.ndarray]:
+    """Median, mean and standard deviation over replicates, NaN values are ignored.
+
+    Parameters:
+        stack (array): Replicates x waves, or measurements x replicates x waves
+        statistics (list): Which statistics to calculate
+
+    Returns:
+        result (dict): Statistic name -> array of waves (measurements x waves for 3-D stack)
+    """
+    functions = {"median": np.nanmedian, "mean": np.nanmean, "std": np.nanstd}
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        return {name: functions[name](stack, axis=-2) for name in statistics}
+
+
+def _to_points(wave: np.ndarray, values: np.ndarray) -> List[dict]:
+    """Arrays to list of {"wave": ..., "measurement": ...}."""
+    values = np.where(np.isnan(values), None, values) if np.isnan(values).any() else values
+    return [{"wave": w, "measurement": m} for w, m in zip(wave.tolist(), values.tolist())]
+
+
 def calculate_average(data: dict) -> dict:
     """Calculate average values for raw values.
 
@@ -34,26 +124,66 @@ def calculate_average(data: dict) -> dict:
         data (dict): Measurement with additional
         data (average values)
     """
-    valids = "vis", "fluo"
-    keys = "rawData", "rawWhite", "rawDark"
-    for valid in valids:
-        for key in keys:
-            if data.get(valid):
-                if key in data.get(valid):
-                    process = data[valid][key]
-                    if process:
-                        df_data = pd.DataFrame()
-                        avg = []
-                        for i in range(len(process)):
-                            df = pd.DataFrame(process[i])
-                            df_data = pd.concat([df_data, df])
-
-                        df_data["measurement"] = pd.to_numeric(df_data["measurement"], errors="coerce")
-                        result_data = df_data.groupby(["wave"]).median().to_dict("dict")
-                        for k, v in result_data["measurement"].items():
-                            avg.append({"wave": k, "measurement": v})
-                        data[valid].update({key.replace("raw", "avg"): avg})
-            else:
+    return calculate_average_batch([data])[0]
+
+
+def calculate_average_batch(measurements: List[dict]) -> List[dict]:
+    """Calculate average values for raw values of many measurements at once.
+    Blocks that have same shape and wave axis are averaged in one call,
+    which is what backfills of historical measurements need.
+
+    Parameter:
+        measurements (list): Measurements that are used to
+        calculate average values
+
+    Returns:
+        measurements (list): Measurements with additional
+        data (average values)
+    """
+    groups = {}
+    for data in measurements:
+        for valid in _averaged_sensors:
+            sensor = data.get(valid)
+            if not sensor:
                 continue
+            for key in _replicated_keys:
+                process = sensor.get(key)
+                if process:
+                    wave, stack = stack_replicates(process)
+                    group_key = (stack.shape, wave.tobytes())
+                    groups.setdefault(group_key, (wave, [], []))
+                    groups[group_key][1].append(stack)
+                    groups[group_key][2].append((sensor, key.replace("raw", "avg")))
+
+    for wave, stacks, targets in groups.values():
+        medians = replicate_statistics(np.stack(stacks), statistics=("median",))["median"]
+        for (sensor, avg_key), median in zip(targets, medians):
+            sensor.update({avg_key: _to_points(wave, median)})
+
+    return measurements
+
 
-    return data
+def extract_features(data: Mapping) -> Dict[str, np.ndarray]:
+    """Preprocessed values of every sensor that are used as input for
+    trained models.
+
+    Parameter:
+        data (dict): Validated measurement data or Measurement object
+        fields ("vis", "fluo", "nir" keys), sensor data can be dict or Spectrum
+
+    Returns:
+        features (dict): Sensor name (VIS, FLUO, NIR) -> 1-D FEATURE_DTYPE array,
+        sensors without preprocessed values are skipped
+    """
+    features = {}
+    for sensor, key in _feature_sensors.items():
+        spectrum = data.get(key)
+        if not spectrum or "preprocessed" not in spectrum:
+            continue
+        if isinstance(spectrum, Spectrum) and spectrum.array("preprocessed") is not None:
+            features[sensor] = spectrum.array("preprocessed").astype(FEATURE_DTYPE)
+        else:
+            features[sensor] = _to_float([point["measurement"] for point in spectrum["preprocessed"]]).astype(
+                FEATURE_DTYPE
+            )
+    return features
@@ -1,14 +1,107 @@
+from typing import Optional
+
+from django.db import IntegrityError, transaction
+from django.http import HttpRequest
+from django.shortcuts import get_object_or_404
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
 from rest_framework.generics import CreateAPIView, RetrieveUpdateDestroyAPIView, ListAPIView
+from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
 
 from .models import Measurement, Result
-from .serializers import MeasurementSerializer, ResultSerializer
+from .registry import registry
+from .serializers import MeasurementSerializer, ResultSerializer, ImageUploadSerializer
+from .utils import spectra_hash
 
 
 class CreateMeasurement(CreateAPIView):
-    """Save measurement to DB."""
+    """Save measurement to DB.
+    Retried request (same Idempotency-Key header or same sample ID and spectra)
+    returns measurement and result that are already saved instead of error,
+    also when retry is saved concurrently. Key that is reused for other spectra is rejected.
+    """
     queryset = Measurement.objects.all()
     serializer_class = MeasurementSerializer
 
+    def create(self, request: HttpRequest, *args: tuple, **kwargs: dict) -> Response:
+        key = request.META.get("HTTP_IDEMPOTENCY_KEY") or None
+        replay = self.get_replay(request, key)
+        if replay is not None:
+            return self.replay_response(request, replay)
+
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            with transaction.atomic():
+                serializer.save(idempotency_key=key)
+        except IntegrityError:
+            # Concurrent retry of same request saved measurement after it was checked
+            replay = self.get_replay(request, key)
+            if replay is not None:
+                return self.replay_response(request, replay)
+            if not Measurement.objects.filter(sample_id=serializer.validated_data["sample_id"]).exists():
+                raise
+            raise ValidationError({"sampleID": ["Sample with ID [{}] already exists.".format(
+                serializer.validated_data["sample_id"])]})
+        headers = self.get_success_headers(serializer.data)
+        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+
+    def replay_response(self, request: HttpRequest, replay: Measurement) -> Response:
+        """Response for retried request, error if idempotency key is used
+        by other user or for other spectra.
+
+        Parameters:
+            request (obj): Request with measurement data
+            replay (obj): Measurement that is already saved
+
+        Returns:
+            response (obj): Saved measurement or error
+        """
+        if replay.owner_id != request.user.pk:
+            return Response({"error": "Idempotency key is already used."}, status=status.HTTP_409_CONFLICT)
+        if replay.content_hash != self.request_hash(request):
+            return Response({"error": "Idempotency key is already used for other measurement data."},
+                            status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        return Response(self.get_serializer(replay).data, status=status.HTTP_200_OK)
+
+    @staticmethod
+    def request_hash(request: HttpRequest) -> Optional[str]:
+        """Hash of spectra in request, same as `content_hash` of measurement saved from it."""
+        if not isinstance(request.data, dict):
+            return None
+        return spectra_hash(request.data.get("VIS"), request.data.get("NIR"), request.data.get("FLUO"))
+
+    @staticmethod
+    def get_replay(request: HttpRequest, key: Optional[str]) -> Optional[Measurement]:
+        """Measurement that is already created by same request.
+
+        Parameters:
+            request (obj): Request with measurement data
+            key (str): Idempotency key from request header
+
+        Returns:
+            measurement (obj): Saved measurement or None if request is not retried
+        """
+        queryset = Measurement.objects.select_related("result")
+        if key:
+            measurement = queryset.filter(idempotency_key=key).first()
+            if measurement:
+                return measurement
+        if not isinstance(request.data, dict):
+            return None
+        try:
+            sample_id = int(request.data.get("sampleID"))
+        except (TypeError, ValueError):
+            return None
+        return queryset.filter(
+            sample_id=sample_id,
+            owner=request.user,
+            content_hash=CreateMeasurement.request_hash(request)
+        ).first()
+
     def get_serializer_context(self) -> dict:
         """Add URL parameter in order to know if measurement
         will be analyzed.
@@ -26,6 +119,56 @@ class CreateMeasurement(CreateAPIView):
         return context
 
 
+class BulkCreateMeasurement(CreateMeasurement):
+    """Save list of measurements to DB.
+    Users, mobiles and phasma devices for all measurements are fetched at once,
+    valid measurements are saved with one insert and status is returned for each of them.
+    """
+
+    def create(self, request: HttpRequest, *args: tuple, **kwargs: dict) -> Response:
+        items = request.data
+        if not isinstance(items, list):
+            return Response({"error": "List of measurements is expected."}, status=status.HTTP_400_BAD_REQUEST)
+
+        context = self.get_serializer_context()
+        context.update(self.serializer_class.resolve_related(items))
+        statuses, validated_items, sample_ids = [], [], set()
+        for item in items:
+            serializer = self.serializer_class(data=item, context=context)
+            if not serializer.is_valid():
+                statuses.append({"sampleID": item.get("sampleID") if isinstance(item, dict) else None,
+                                 "status": "invalid",
+                                 "errors": serializer.errors})
+                continue
+            sample_id = serializer.validated_data["sample_id"]
+            if sample_id in sample_ids:
+                statuses.append({"sampleID": sample_id,
+                                 "status": "invalid",
+                                 "errors": {"sampleID": ["Sample with ID [{}] is sent more than once.".format(
+                                     sample_id)]}})
+                continue
+            sample_ids.add(sample_id)
+            validated_items.append(serializer.validated_data)
+            # Status is known only after insert
+            statuses.append({"sampleID": sample_id, "status": None})
+
+        measurements, conflicts = self.serializer_class.bulk_create(validated_items, context.get("operation"))
+
+        for item_status in statuses:
+            if item_status["status"] is not None:
+                continue
+            if item_status["sampleID"] in conflicts:
+                item_status["status"] = "conflict"
+                item_status["errors"] = {"sampleID": ["Sample with ID [{}] already exists.".format(
+                    item_status["sampleID"])]}
+            else:
+                item_status["status"] = "created"
+
+        all_created = len(measurements) == len(items)
+        return Response({"results": statuses},
+                        status=status.HTTP_201_CREATED if all_created else status.HTTP_207_MULTI_STATUS)
+
+
 class RUDMeasurement(RetrieveUpdateDestroyAPIView):
     """Read/Update/Delete measurement."""
     queryset = Measurement.objects.all()
@@ -33,6 +176,18 @@ class RUDMeasurement(RetrieveUpdateDestroyAPIView):
     serializer_class = MeasurementSerializer
 
 
+class UploadImage(CreateAPIView):
+    """Upload camera image for measurement as multipart file.
+    Large files are streamed to temporary file and then to storage in chunks.
+    """
+    serializer_class = ImageUploadSerializer
+    parser_classes = (MultiPartParser,)
+
+    def perform_create(self, serializer: ImageUploadSerializer) -> None:
+        measurement = get_object_or_404(Measurement, sample_id=self.kwargs["sample_id"], owner=self.request.user)
+        serializer.save(measurement=measurement)
+
+
 class ListResult(ListAPIView):
     """List all results that are in DB."""
     queryset = Result.objects.all()
@@ -46,8 +201,18 @@ class RUDResult(RetrieveUpdateDestroyAPIView):
     lookup_field = "measurement_id"
 
 
+class ModelRegistryStats(APIView):
+    """Hit/miss counters and loaded models of model registry in process that serves request."""
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request: HttpRequest) -> Response:
+        return Response({"model_registry": registry.stats()}, status=status.HTTP_200_OK)
+
+
 create_measurement = CreateMeasurement.as_view()
+bulk_create_measurement = BulkCreateMeasurement.as_view()
 rud_measurement = RUDMeasurement.as_view()
+upload_image = UploadImage.as_view()
 list_result = ListResult.as_view()
 rud_result = RUDResult.as_view()
-
+model_registry_stats = ModelRegistryStats.as_view()
@@ -0,0 +1,7 @@
+from django.apps import AppConfig
+from django.utils.translation import gettext_lazy as _
+
+
+class SamplesConfig(AppConfig):
+    name = 'phasma_food_v2.samples'
+    verbose_name = _("Samples")
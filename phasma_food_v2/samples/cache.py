@@ -0,0 +1,143 @@
+import time
+import hashlib
+from typing import Any, Callable, List
+
+from bson import json_util
+from django.conf import settings
+from django.core.cache import cache
+
+VERSION_KEY = "mongo-query:version:{}.{}"
+QUERY_KEY = "mongo-query:{}.{}:{}:{}"
+STATS_KEY = "mongo-query:stats:{}.{}:{}"
+
+
+class QueryCache:
+    """Results of Mongo queries in Django cache (Redis in production).
+
+    Key of result is hash of canonical JSON of query method and its
+    parameters, together with version of collection. Version is increased
+    on every write to collection, so results that were cached before write
+    are never read again and expire by themselves. Results of collection are
+    cached for MONGO_QUERY_CACHE_TIMEOUTS[collection] seconds,
+    MONGO_QUERY_CACHE_TIMEOUT by default, 0 disables cache for collection.
+    Hit/miss counters are kept only when MONGO_QUERY_CACHE_STATS is set.
+    """
+    @staticmethod
+    def timeout(collection: str) -> int:
+        return settings.MONGO_QUERY_CACHE_TIMEOUTS.get(collection, settings.MONGO_QUERY_CACHE_TIMEOUT)
+
+    def enabled(self, collection: str) -> bool:
+        return settings.MONGO_QUERY_CACHE_ENABLED and self.timeout(collection) > 0
+
+    @staticmethod
+    def version(db: str, collection: str) -> int:
+        key = VERSION_KEY.format(db, collection)
+        version = cache.get(key)
+        if version is None:
+            # New version is never lower than version that was lost from cache
+            cache.add(key, int(time.time() * 1000), timeout=None)
+            version = cache.get(key)
+        return version
+
+    def bump(self, db: str, collection: str) -> None:
+        """Invalidate all cached results of collection."""
+        key = VERSION_KEY.format(db, collection)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, int(time.time() * 1000), timeout=None)
+
+    def key(self, db: str, collection: str, method: str, **params) -> str:
+        """Cache key of query.
+
+        Parameters:
+            db (str): Mongo DB that is queried
+            collection (str): Mongo DB collection that is queried
+            method (str): Query method
+            params (dict): Query, projection and pagination of query
+
+        Returns:
+            key (str): Cache key with current version of collection
+        """
+        payload = json_util.dumps([method, params], sort_keys=True, separators=(",", ":"))
+        digest = hashlib.sha256(payload.encode("utf-8")).hexdigest()
+        return QUERY_KEY.format(db, collection, self.version(db, collection), digest)
+
+    def get_or_set(self, db: str, collection: str, method: str, compute: Callable[[], Any],
+                   timeout: int = None, **params) -> Any:
+        """Cached result of query or result of compute() that is cached.
+
+        Parameters:
+            db (str): Mongo DB that is queried
+            collection (str): Mongo DB collection that is queried
+            method (str): Query method
+            compute (func): Runs query
+            timeout (int): Seconds to keep result, timeout of collection by default
+            params (dict): Query, projection and pagination of query
+
+        Returns:
+            result (obj): Result of query
+        """
+        if not self.enabled(collection):
+            return compute()
+        return self.cached(db, collection, method, compute,
+                           timeout=timeout if timeout is not None else self.timeout(collection), **params)
+
+    def cached(self, db: str, collection: str, method: str, compute: Callable[[], Any], timeout: int,
+               **params) -> Any:
+        """Same as get_or_set, but result is cached even when query cache
+        of collection is disabled, e.g. counts that have their own timeout.
+
+        Parameters:
+            db (str): Mongo DB that is queried
+            collection (str): Mongo DB collection that is queried
+            method (str): Query method
+            compute (func): Runs query
+            timeout (int): Seconds to keep result, 0 disables cache
+            params (dict): Query, projection and pagination of query
+
+        Returns:
+            result (obj): Result of query
+        """
+        if timeout <= 0:
+            return compute()
+        key = self.key(db, collection, method, **params)
+        result = cache.get(key)
+        if result is not None:
+            self._count(db, collection, "hits")
+            return result
+        self._count(db, collection, "misses")
+        result = compute()
+        cache.set(key, result, timeout=timeout)
+        return result
+
+    def stats(self, db: str, collections: List[str]) -> dict:
+        """Hit/miss counters and version of collections."""
+        keys = [STATS_KEY.format(db, collection, name) for collection in collections for name in ("hits", "misses")]
+        counters = cache.get_many(keys)
+        stats = {}
+        for collection in collections:
+            hits = counters.get(STATS_KEY.format(db, collection, "hits"), 0)
+            misses = counters.get(STATS_KEY.format(db, collection, "misses"), 0)
+            stats[collection] = {
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": hits / (hits + misses) if hits + misses else None,
+                "timeout": self.timeout(collection),
+                "version": cache.get(VERSION_KEY.format(db, collection)),
+            }
+        return stats
+
+    @staticmethod
+    def _count(db: str, collection: str, name: str) -> None:
+        if not settings.MONGO_QUERY_CACHE_STATS:
+            return
+        key = STATS_KEY.format(db, collection, name)
+        # Counter exists after first query, so it is one round trip
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, timeout=None)
+
+
+query_cache = QueryCache()
@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from phasma_food_v2.samples.mongo_db import MongoDB
+from phasma_food_v2.samples.mongo_indexes import ensure_indexes, explain_queries, is_collection_scan
+
+
+class Command(BaseCommand):
+    help = "Create missing indexes of Mongo reference collections and show plans of common queries."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--db", default=settings.MONGO_DEFAULT_DB)
+        parser.add_argument("--collection", action="append", dest="collections",
+                            help="Collection to index, every collection of DB by default. Can be repeated.")
+        parser.add_argument("--dry-run", action="store_true", help="Only report missing indexes.")
+        parser.add_argument("--explain", action="store_true", help="Show query plans of common queries.")
+
+    def handle(self, *args, **options):
+        mongo = MongoDB()
+        collections = options["collections"] or mongo.collection_list(options["db"])
+        for name in collections:
+            collection = mongo.client[options["db"]][name]
+            created, existing = ensure_indexes(collection, dry_run=options["dry_run"])
+            self.stdout.write("{}: {} {}, existing {}".format(
+                name, "missing" if options["dry_run"] else "created",
+                ", ".join(created) or "-", ", ".join(existing) or "-"
+            ))
+            if not options["explain"]:
+                continue
+            for plan in explain_queries(collection):
+                line = "  {name}: {stages} index={index} examined={examined} returned={returned}".format(
+                    name=plan["name"], stages=" <- ".join(plan["stages"]), index=plan["index"],
+                    examined=plan["examined"], returned=plan["returned"]
+                )
+                self.stdout.write(self.style.WARNING(line) if is_collection_scan(plan) else line)
+        self.stdout.write(self.style.SUCCESS("Checked indexes of {} collections.".format(len(collections))))
@@ -1,19 +1,275 @@
-from typing import List, Union
-
-from pymongo import MongoClient
+import os
+import base64
+import threading
+from itertools import combinations
+from typing import Iterator, List, Optional, Tuple, Union
+
+from pymongo import ASCENDING, DESCENDING, MongoClient, ReplaceOne, monitoring
+from pymongo.cursor import Cursor
+from pymongo.errors import BulkWriteError
+from bson import json_util
 from bson.objectid import ObjectId
 from django.conf import settings
 
+from .cache import query_cache
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+# Top level fields of reference documents that can be projected, with their nested fields
+PROJECTION_FIELDS = frozenset((
+    "foodType", "sample", "rawDataRef", "replicate", "tempExposureHours", "mainCat", "customType1", "customType2",
+    "cat", "useCase", "date", "adul", "time", "laboratory", "temperature", "sampleId", "granularity", "mycotoxins",
+    "microbioSampleId", "microbiologicalUnit", "microbiologicalValue", "microbiologicalMeasurement",
+    "otherSpecies", "foodSubtype", "adulterationSampleId", "alcoholLabel", "authentic", "puritySMP",
+    "lowValueFiller", "nitrogenEnhancer", "hazardOneName", "hazardOnePct", "hazardTwoName", "hazardTwoPct",
+    "dilutedPct", "package", "dateTime", "configuration", "whiteReferenceTime", "aflatoxin",
+))
+PROJECTION_SENSORS = ("VIS", "NIR", "FLUO")
+# Arrays of sensor that can be projected and sliced
+PROJECTION_SENSOR_FIELDS = frozenset((
+    "wave", "data", "dark", "white", "rawData", "rawDark", "rawWhite", "avgData", "avgDark", "avgWhite",
+    "preprocessed", "darkReference", "whiteReference", "dark_for_white",
+))
+
+
+class CommandMetrics(monitoring.CommandListener):
+    """Counters of commands that are sent by shared client. Every command in flight
+    holds pooled connection, so it is lower bound of checked out connections
+    (pymongo 3.8 has no connection pool events).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counters = {
+                "started": 0, "succeeded": 0, "failed": 0,
+                "in_flight": 0, "max_in_flight": 0, "duration_ms": 0.0,
+            }
+
+    def started(self, event) -> None:
+        with self._lock:
+            self.counters["started"] += 1
+            self.counters["in_flight"] += 1
+            self.counters["max_in_flight"] = max(self.counters["max_in_flight"], self.counters["in_flight"])
+
+    def succeeded(self, event) -> None:
+        self._finish(event, "succeeded")
+
+    def failed(self, event) -> None:
+        self._finish(event, "failed")
+
+    def _finish(self, event, name: str) -> None:
+        with self._lock:
+            self.counters[name] += 1
+            self.counters["in_flight"] = max(self.counters["in_flight"] - 1, 0)
+            self.counters["duration_ms"] += event.duration_micros / 1000.0
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counters = dict(self.counters)
+        finished = counters["succeeded"] + counters["failed"]
+        counters["avg_duration_ms"] = round(counters["duration_ms"] / finished, 3) if finished else None
+        counters["duration_ms"] = round(counters["duration_ms"], 3)
+        return counters
+
+
+command_metrics = CommandMetrics()
+
+
+def get_client() -> MongoClient:
+    """Mongo client that is shared by all threads of process.
+
+    Client is created lazily on first use and again in child process after fork,
+    because sockets of parent pool can not be shared. Pool size and timeouts
+    are taken from MONGO_* settings.
+
+    Returns:
+        client (obj): Pooled Mongo client
+    """
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is None or _client_pid != pid:
+        with _client_lock:
+            if _client is None or _client_pid != pid:
+                _client = MongoClient(
+                    settings.MONGO_HOST,
+                    maxPoolSize=settings.MONGO_MAX_POOL_SIZE,
+                    minPoolSize=settings.MONGO_MIN_POOL_SIZE,
+                    maxIdleTimeMS=settings.MONGO_MAX_IDLE_TIME_MS,
+                    waitQueueTimeoutMS=settings.MONGO_WAIT_QUEUE_TIMEOUT_MS,
+                    connectTimeoutMS=settings.MONGO_CONNECT_TIMEOUT_MS,
+                    serverSelectionTimeoutMS=settings.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                    socketTimeoutMS=settings.MONGO_SOCKET_TIMEOUT_MS,
+                    event_listeners=[command_metrics],
+                    connect=False,
+                )
+                _client_pid = pid
+                command_metrics.reset()
+    return _client
+
+
+def reset_client(**kwargs) -> None:
+    """Drop shared client, next get_client() creates new one.
+    Connected to worker_process_init, so every Celery prefork child has own pool.
+    Client of parent process is not closed, its sockets still belong to parent.
+    """
+    global _client, _client_pid
+    with _client_lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client = None
+        _client_pid = None
+
+
+def pool_stats() -> dict:
+    """Pool options and command counters of shared client in this process."""
+    client = _client if _client_pid == os.getpid() else None
+    commands = command_metrics.snapshot()
+    max_pool_size = client.max_pool_size if client is not None else settings.MONGO_MAX_POOL_SIZE
+    return {
+        "pid": os.getpid(),
+        "connected": client is not None,
+        "max_pool_size": max_pool_size,
+        "min_pool_size": client.min_pool_size if client is not None else settings.MONGO_MIN_POOL_SIZE,
+        "in_flight": commands["in_flight"],
+        "commands": commands,
+    }
+
+
+def encode_cursor(values: dict) -> str:
+    """Opaque token of position after last document of page."""
+    return base64.urlsafe_b64encode(json_util.dumps(values).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(token: str) -> dict:
+    """Position from token made by encode_cursor.
+
+    Raises:
+        ValueError: Token is not valid
+    """
+    try:
+        values = json_util.loads(base64.urlsafe_b64decode(token.encode("ascii")).decode("utf-8"))
+    except Exception as error:
+        raise ValueError("Invalid cursor.") from error
+    if not isinstance(values, dict) or "id" not in values:
+        raise ValueError("Invalid cursor.")
+    return values
+
+
+def keyset_filter(sort: Optional[str], direction: int, position: dict) -> dict:
+    """Filter for documents after position in order of (sort, _id).
+    Sort field should have values of one type, Mongo compares only values
+    of same type with $gt/$lt.
+    """
+    operator = "$gt" if direction == ASCENDING else "$lt"
+    after_id = {"_id": {operator: position["id"]}}
+    if not sort:
+        return after_id
+    value = position.get("value")
+    if value is None:
+        if direction == ASCENDING:
+            # Missing values are first in ascending order
+            return {"$or": [{sort: {"$ne": None}}, dict({sort: None}, **after_id)]}
+        return dict({sort: None}, **after_id)
+    after_value = {sort: {operator: value}}
+    if direction == DESCENDING:
+        after_value = {"$or": [after_value, {sort: None}]}
+    return {"$or": [after_value, dict({sort: value}, **after_id)]}
+
+
+def _projection_path(path: str, sensor_array: bool = False) -> str:
+    """Validate field path against projection whitelist.
+
+    Raises:
+        ValueError: Field can not be projected
+    """
+    parts = path.split(".")
+    if parts[0] in PROJECTION_SENSORS:
+        valid = len(parts) == 2 and parts[1] in PROJECTION_SENSOR_FIELDS or len(parts) == 1 and not sensor_array
+    else:
+        valid = not sensor_array and parts[0] in PROJECTION_FIELDS and all(parts)
+    if not valid:
+        raise ValueError("Field \"{}\" can not be {}.".format(path, "sliced" if sensor_array else "projected"))
+    return path
+
+
+def build_projection(fields: List[str] = None, exclude: List[str] = None, slices: dict = None) -> Optional[dict]:
+    """Mongo projection from whitelisted field paths, so only
+    requested metadata and spectra are sent from Mongo.
+
+    Parameters:
+        fields (list): Field paths to include, e.g. "NIR.preprocessed"
+        exclude (list): Field paths to exclude, can not be used with fields
+        slices (dict): Sensor array path -> number of elements or [skip, number of elements]
+
+    Returns:
+        projection (dict): Mongo projection, None when every field is requested
+
+    Raises:
+        ValueError: Projection is not valid
+    """
+    if fields and exclude:
+        raise ValueError("Fields can not be included and excluded at once.")
+    projection = {}
+    for path in fields or ():
+        projection[_projection_path(path)] = 1
+    for path in exclude or ():
+        projection[_projection_path(path)] = 0
+    for path, value in (slices or {}).items():
+        valid = isinstance(value, int) and not isinstance(value, bool) or (
+            isinstance(value, list) and len(value) == 2 and all(
+                isinstance(item, int) and not isinstance(item, bool) for item in value
+            ) and value[1] > 0
+        )
+        if not valid:
+            raise ValueError("Slice of \"{}\" must be number of elements or [skip, number of elements].".format(path))
+        projection[_projection_path(path, sensor_array=True)] = {"$slice": value}
+
+    for path, following in combinations(projection, 2):
+        if paths_overlap(path, following):
+            raise ValueError("Fields \"{}\" and \"{}\" overlap.".format(path, following))
+    return projection or None
+
+
+def paths_overlap(path: str, other: str) -> bool:
+    """Same field or one field is nested in other, Mongo rejects such projection."""
+    return path == other or path.startswith(other + ".") or other.startswith(path + ".")
+
+
+def is_inclusion(projection: Optional[dict]) -> bool:
+    return bool(projection) and any(value == 1 for value in projection.values())
+
+
+def merge_projection(base: Optional[dict], projection: Optional[dict]) -> Optional[dict]:
+    """Requested projection added to base projection of query.
+    Exclusion projection can not be combined with base projection, it replaces it.
+    """
+    if projection is None:
+        return base
+    if base is None or any(value == 0 for value in projection.values()):
+        return projection
+    merged = {
+        path: value for path, value in base.items()
+        if not any(paths_overlap(path, requested) for requested in projection)
+    }
+    merged.update(projection)
+    return merged
+
 
 class MongoDB:
     """
     Mongo DB object that is used to connect to DB
 
     Attributes:
-        client (obj): Connected to DB
+        client (obj): Connected to DB, shared pooled client by default
     """
-    def __init__(self):
-        self.client = MongoClient(settings.MONGO_HOST)
+    def __init__(self, client: MongoClient = None):
+        self.client = client or get_client()
 
     @staticmethod
     def base_projection() -> dict:
@@ -53,7 +309,7 @@ class MongoDB:
             query (dict): Query dictionary with ObjectID updated
             to follow Mongo rules
         """
-        if isinstance(query["id"], list):
+        if isinstance(query.get("id"), list):
             ids_list = []
             for q in query["id"]:
                 ids_list.append(ObjectId(q))
@@ -62,7 +318,7 @@ class MongoDB:
             query_id = query.get("id", None)
             if query_id:
                 query["_id"] = ObjectId(query_id)
-        del query["id"]
+        query.pop("id", None)
 
         return query
 
@@ -100,35 +356,109 @@ class MongoDB:
             None
         """
         self.client[db][collection].insert_one(measurement)
+        query_cache.bump(db, collection)
+
+    def bulk_upsert(self, documents: List[dict], key: str = "sampleId", db: str = settings.MONGO_DEFAULT_DB,
+                    collection: str = settings.MONGO_DEFAULT_COLLECTION) -> dict:
+        """Insert or replace documents with one unordered bulk write,
+        document is matched by key so same document is never duplicated.
+
+        Parameters:
+            documents (list): Documents to push
+            key (str): Field that identifies document
+            db (str): Mongo DB that is queried
+            collection (str): Mongo DB collection that is queried
 
-    def find_row(self, query: dict = None, project: bool = False,
+        Returns:
+            summary (dict): Number of inserted, updated and failed documents
+        """
+        if not documents:
+            return {"inserted": 0, "updated": 0, "failed": 0}
+        operations = [ReplaceOne({key: document[key]}, document, upsert=True) for document in documents]
+        try:
+            result = self.client[db][collection].bulk_write(operations, ordered=False).bulk_api_result
+        except BulkWriteError as error:
+            result = error.details
+        finally:
+            query_cache.bump(db, collection)
+        return {
+            "inserted": result.get("nUpserted", 0) + result.get("nInserted", 0),
+            "updated": result.get("nMatched", 0),
+            "failed": len(result.get("writeErrors", [])),
+        }
+
+    def find_row(self, query: dict = None, project: bool = False, projection: dict = None,
                  db: str = settings.MONGO_DEFAULT_DB, collection: str = settings.MONGO_DEFAULT_COLLECTION) -> dict:
         """Query Mongo DB for single document with filters.
 
         Parameters:
             query (dict): Query for Mongo DB
             project (bool): Return all filed or exclude some of them
+            projection (dict): Requested fields and slices, from build_projection
             db (str): Mongo DB that is queried
             collection (str): Mongo DB collection that is queried
 
         Returns:
             data (dict): Single document form Mongo DB
         """
-        query = self.object_id_to_mongo(query)
-        data = self.client[db][collection].find_one(query, self.base_projection() if project else None)
-        data["id"] = str(data.pop("_id"))
-        return data
+        def find() -> dict:
+            mongo_query = self.object_id_to_mongo(dict(query))
+            data = self.client[db][collection].find_one(
+                mongo_query, merge_projection(self.base_projection() if project else None, projection)
+            )
+            data["id"] = str(data.pop("_id"))
+            return data
+
+        return query_cache.get_or_set(db, collection, "row", find, query=query, project=project, projection=projection)
+
+    @staticmethod
+    def rows_projection(project: bool, projection: dict = None) -> Optional[dict]:
+        if not project:
+            return projection
+        base = MongoDB.base_projection()
+        base.update({
+            "aflatoxin": 1,
+            "microbiologicalMeasurement": 1
+        })
+        return merge_projection(base, projection)
+
+    def count_rows(self, query: dict = None, db: str = settings.MONGO_DEFAULT_DB,
+                   collection: str = settings.MONGO_DEFAULT_COLLECTION) -> int:
+        """Number of documents for query, cached for MONGO_COUNT_CACHE_TIMEOUT seconds
+        or until collection is changed, also when query cache is disabled.
+        Count of whole collection is estimated from collection metadata.
+
+        Parameters:
+            query (dict): Query for Mongo DB, with ObjectIDs already converted
+            db (str): Mongo DB that is queried
+            collection (str): Mongo DB collection that is queried
+
+        Returns:
+            total (int): Number of documents
+        """
+        query = query or {}
+
+        def count() -> int:
+            if query:
+                return self.client[db][collection].count_documents(query)
+            return self.client[db][collection].estimated_document_count()
+
+        return query_cache.cached(db, collection, "count", count, timeout=settings.MONGO_COUNT_CACHE_TIMEOUT,
+                                  query=query)
 
     def find_rows(self, query: dict = None, project: bool = False, page_num: int = 1,
-                  page_size: int = 10, db: str = settings.MONGO_DEFAULT_DB,
+                  page_size: int = 10, projection: dict = None, db: str = settings.MONGO_DEFAULT_DB,
                   collection: str = settings.MONGO_DEFAULT_COLLECTION) -> List[int]:
         """Query Mongo DB for documents using filters and pagination.
+        Deep pages are slow because skipped documents are still scanned,
+        find_rows_after should be used for iterating over collection.
 
         Parameters:
             query (dict): Query for Mongo DB
             project (bool): Return all filed or exclude some of them
             page_num (int): Page that is required
             page_size (int): Results per page
+            projection (dict): Requested fields and slices, from build_projection
             db (str): Mongo DB that is queried
             collection (str): Mongo DB collection that is queried
 
@@ -139,30 +469,146 @@ class MongoDB:
             page_num (int): Current page number
             page_size (int): Results per page
         """
-        query = self.object_id_to_mongo(query) if query else {}
-        projection = None
+        def find() -> list:
+            mongo_query = self.object_id_to_mongo(dict(query)) if query else {}
 
-        if project:
-            projection = self.base_projection()
-            projection.update({
-                "aflatoxin": 1,
-                "microbiologicalMeasurement": 1
-            })
+            data = self.client[db][collection].find(mongo_query, self.rows_projection(project, projection))\
+                .skip((page_num - 1) * page_size)\
+                .limit(page_size)
 
-        data = self.client[db][collection].find(query, projection)\
-            .skip((page_num - 1) * page_size)\
-            .limit(page_size)
-        data_total = data.count()
-        data_query_total = data.count(with_limit_and_skip=True)
+            data_final = []
+            for x in data:
+                x['id'] = str(x.pop('_id'))
+                data_final.append(x)
 
-        data_final = []
-        for x in data:
-            x['id'] = str(x.pop('_id'))
-            data_final.append(x)
+            data_total = self.count_rows(mongo_query, db=db, collection=collection)
+            return [data_final, len(data_final), data_total, page_num, page_size]
+
+        return query_cache.get_or_set(db, collection, "rows", find, query=query, project=project,
+                                      projection=projection, page_num=page_num, page_size=page_size)
 
-        return [data_final, data_query_total, data_total, page_num, page_size]
+    def find_rows_after(self, query: dict = None, project: bool = False, cursor: str = None,
+                        page_size: int = 10, sort: str = None, count: bool = False, projection: dict = None,
+                        db: str = settings.MONGO_DEFAULT_DB, collection: str = settings.MONGO_DEFAULT_COLLECTION
+                        ) -> Tuple[list, Optional[str], Optional[int]]:
+        """Query Mongo DB for documents using filters and keyset pagination.
+        Documents are ordered by sort field and _id, next page starts after
+        last document of previous page, so every page costs the same.
 
-    def find_rows_machine_learning(self, query: dict = None, project: bool = False,
+        Parameters:
+            query (dict): Query for Mongo DB
+            project (bool): Return all filed or exclude some of them
+            cursor (str): Token of previous page, None for first page
+            page_size (int): Results per page
+            sort (str): Field to order by, "-" prefix for descending order, _id by default
+            count (bool): Return (cached) number of documents for query
+            projection (dict): Requested fields and slices, from build_projection
+            db (str): Mongo DB that is queried
+            collection (str): Mongo DB collection that is queried
+
+        Returns:
+            data_final (list): Documents form Mongo DB
+            next_cursor (str): Token of next page, None on last page
+            data_total (int): Number of documents for query, None if count is not requested
+
+        Raises:
+            ValueError: Cursor is not valid
+        """
+        def find() -> tuple:
+            mongo_query = self.object_id_to_mongo(dict(query)) if query else {}
+            data, sort_field = self.keyset_find(mongo_query, self.rows_projection(project, projection), cursor, sort,
+                                                db=db, collection=collection)
+            data = data.limit(page_size + 1)
+
+            data_final = []
+            next_cursor = None
+            for x in data:
+                if len(data_final) == page_size:
+                    next_cursor = encode_cursor({"id": last_id, "value": last_value})
+                    break
+                last_id = x["_id"]
+                last_value = self._field(x, sort_field) if sort_field else None
+                x['id'] = str(x.pop('_id'))
+                data_final.append(x)
+
+            data_total = self.count_rows(mongo_query, db=db, collection=collection) if count else None
+            return data_final, next_cursor, data_total
+
+        return query_cache.get_or_set(db, collection, "rows_after", find, query=query, project=project,
+                                      projection=projection, cursor=cursor, page_size=page_size, sort=sort,
+                                      count=count)
+
+    def iter_rows(self, query: dict = None, project: bool = False, cursor: str = None, sort: str = None,
+                  projection: dict = None, db: str = settings.MONGO_DEFAULT_DB,
+                  collection: str = settings.MONGO_DEFAULT_COLLECTION) -> Iterator[dict]:
+        """All documents for query in order of find_rows_after, starting after cursor.
+        Documents are fetched from Mongo in batches of MONGO_STREAM_BATCH_SIZE,
+        so only one batch is in memory at a time.
+
+        Parameters:
+            query (dict): Query for Mongo DB
+            project (bool): Return all filed or exclude some of them
+            cursor (str): Token of page that documents follow, None for first document
+            sort (str): Field to order by, "-" prefix for descending order, _id by default
+            projection (dict): Requested fields and slices, from build_projection
+            db (str): Mongo DB that is queried
+            collection (str): Mongo DB collection that is queried
+
+        Returns:
+            documents (iterator): Documents form Mongo DB
+
+        Raises:
+            ValueError: Cursor is not valid
+        """
+        query = self.object_id_to_mongo(query) if query else {}
+        data, _ = self.keyset_find(query, self.rows_projection(project, projection), cursor, sort,
+                                   db=db, collection=collection)
+        return self._documents(data.batch_size(settings.MONGO_STREAM_BATCH_SIZE))
+
+    @staticmethod
+    def _documents(data: Cursor) -> Iterator[dict]:
+        try:
+            for x in data:
+                x['id'] = str(x.pop('_id'))
+                yield x
+        finally:
+            data.close()
+
+    def keyset_find(self, query: dict, projection: Optional[dict], cursor: Optional[str], sort: Optional[str],
+                    db: str, collection: str) -> Tuple[Cursor, Optional[str]]:
+        """Mongo cursor over documents after cursor token in order of (sort, _id).
+
+        Returns:
+            data (obj): Mongo cursor
+            sort (str): Sort field without direction, None when documents are ordered by _id
+        """
+        direction = DESCENDING if sort and sort.startswith("-") else ASCENDING
+        sort = sort.lstrip("-") if sort else None
+        if sort == "_id":
+            sort = None
+        order = ([(sort, direction)] if sort else []) + [("_id", direction)]
+
+        selection = query
+        if cursor:
+            after = keyset_filter(sort, direction, decode_cursor(cursor))
+            selection = {"$and": [query, after]} if query else after
+
+        if sort and is_inclusion(projection) and not any(paths_overlap(sort, path) for path in projection):
+            # Sort value of last document is part of next cursor
+            projection = dict(projection, **{sort: 1})
+        return self.client[db][collection].find(selection, projection).sort(order), sort
+
+    @staticmethod
+    def _field(document: dict, path: str):
+        """Value of dotted field path in document, None if it is missing."""
+        value = document
+        for part in path.split("."):
+            if not isinstance(value, dict):
+                return None
+            value = value.get(part)
+        return value
+
+    def find_rows_machine_learning(self, query: dict = None, project: bool = False, projection: dict = None,
                                    db: str = settings.MONGO_DEFAULT_DB,
                                    collection: str = settings.MONGO_DEFAULT_COLLECTION) -> List[dict]:
         """Query Mongo DB for documents in Machine Learning DB.
@@ -170,6 +616,7 @@ class MongoDB:
         Parameters:
             query (dict): Query for Mongo DB
             project (bool): Return all filed or exclude some of them
+            projection (dict): Requested fields and slices, from build_projection
             db (str): Mongo DB that is queried
             collection (str): Mongo DB collection that is queried
 
@@ -177,7 +624,8 @@ class MongoDB:
             data_final (list): Documents form Mongo DB
         """
 
-        data = self.client[db][collection].find(query, self.base_projection() if project else None)
+        projection = merge_projection(self.base_projection() if project else None, projection)
+        data = self.client[db][collection].find(query, projection)
 
         data_final = []
         for x in data:
@@ -233,6 +681,29 @@ class MongoDB:
 
         return data
 
+    def count_by_use_case(self, db: str = settings.MONGO_DEFAULT_DB,
+                          collection: str = settings.MONGO_DEFAULT_COLLECTION) -> List[dict]:
+        """Number of documents for every (use case, food type) pair, in one pass over collection.
+
+        Parameters:
+            db (str): Mongo DB that is queried
+            collection (str): Mongo DB collection that is queried
+
+        Returns:
+            data (list): {"useCase", "foodType", "count"} for every pair, missing values are None
+        """
+        pipeline = [
+            {"$group": {"_id": {"useCase": "$useCase", "foodType": "$foodType"}, "count": {"$sum": 1}}}
+        ]
+        data = []
+        for group in self.client[db][collection].aggregate(pipeline, allowDiskUse=True):
+            data.append({
+                "useCase": group["_id"].get("useCase"),
+                "foodType": group["_id"].get("foodType"),
+                "count": group["count"]
+            })
+        return data
+
     def counter(self, item: dict = None,
                 db: str = settings.MONGO_DEFAULT_DB, collection: str = settings.MONGO_DEFAULT_COLLECTION) -> dict:
         """Count number of particular value in Mongo DB
@@ -0,0 +1,103 @@
+from typing import Iterator, List, Tuple
+
+from pymongo import ASCENDING, IndexModel
+from pymongo.collection import Collection
+from pymongo.errors import OperationFailure
+
+# Indexes of every reference collection, for filters of samples API, statistic and sync to Mongo
+MONGO_INDEXES = (
+    IndexModel([("useCase", ASCENDING), ("foodType", ASCENDING)], name="use_case_food_type", background=True),
+    IndexModel([("foodType", ASCENDING)], name="food_type", background=True),
+    # Measurements are upserted by sampleId, documents without it are not synced from platform
+    IndexModel([("sampleId", ASCENDING)], name="sample_id", unique=True,
+               partialFilterExpression={"sampleId": {"$exists": True}}, background=True),
+)
+# Common queries of platform: (name, fields of example document that query needs, query from example)
+MONGO_QUERIES = (
+    ("distinct food types of use case", ("useCase",), lambda doc: {"useCase": doc.get("useCase")}),
+    ("count of food type", ("foodType",), lambda doc: {"foodType": doc.get("foodType")}),
+    ("use case and food type", ("useCase", "foodType"),
+     lambda doc: {"useCase": doc.get("useCase"), "foodType": doc.get("foodType")}),
+    ("upsert by sample ID", ("sampleId",), lambda doc: {"sampleId": doc.get("sampleId")}),
+    ("document by ID", ("_id",), lambda doc: {"_id": doc.get("_id")}),
+)
+
+
+def ensure_indexes(collection: Collection, dry_run: bool = False) -> Tuple[List[str], List[str]]:
+    """Create indexes of MONGO_INDEXES that collection does not have.
+    Index is skipped when collection already has index on same keys and with same
+    uniqueness, under any name, so running it again does nothing. Index on same keys
+    that is not unique is replaced, old index is restored if unique index can not be
+    created (e.g. collection has duplicated sampleId).
+
+    Parameters:
+        collection (obj): Mongo collection
+        dry_run (bool): Only report missing indexes
+
+    Returns:
+        created (list): Names of created (missing) indexes
+        existing (list): Names of indexes that already exist
+    """
+    existing_indexes = {
+        tuple(map(tuple, index["key"])): (name, index.get("unique", False))
+        for name, index in collection.index_information().items()
+    }
+    missing, existing, replaced = [], [], []
+    for index in MONGO_INDEXES:
+        key = tuple(index.document["key"].items())
+        name, unique = existing_indexes.get(key, (None, False))
+        if name and unique == index.document.get("unique", False):
+            existing.append(index.document["name"])
+        elif name:
+            replaced.append((name, index))
+        else:
+            missing.append(index)
+    if not dry_run:
+        if missing:
+            collection.create_indexes(missing)
+        for name, index in replaced:
+            collection.drop_index(name)
+            try:
+                collection.create_indexes([index])
+            except OperationFailure:
+                collection.create_indexes([IndexModel(list(index.document["key"].items()), name=name,
+                                                      background=True)])
+                raise
+    missing += [index for _, index in replaced]
+    return [index.document["name"] for index in missing], existing
+
+
+def _stages(plan: dict) -> Iterator[dict]:
+    yield plan
+    for child in plan.get("inputStages", []) + ([plan["inputStage"]] if "inputStage" in plan else []):
+        yield from _stages(child)
+
+
+def explain_queries(collection: Collection) -> List[dict]:
+    """Query plans of common queries, values are taken from one document of collection.
+
+    Returns:
+        plans (list): Query name, query, plan stages, used index, examined documents and returned documents
+    """
+    example = collection.find_one({}, {"useCase": 1, "foodType": 1, "sampleId": 1}) or {}
+    plans = []
+    for name, fields, build in MONGO_QUERIES:
+        if any(field not in example for field in fields):
+            continue
+        query = build(example)
+        explain = collection.find(query).explain()
+        stages = list(_stages(explain["queryPlanner"]["winningPlan"]))
+        statistics = explain.get("executionStats", {})
+        plans.append({
+            "name": name,
+            "query": query,
+            "stages": [stage["stage"] for stage in stages],
+            "index": next((stage["indexName"] for stage in stages if "indexName" in stage), None),
+            "examined": statistics.get("totalDocsExamined"),
+            "returned": statistics.get("nReturned"),
+        })
+    return plans
+
+
+def is_collection_scan(plan: dict) -> bool:
+    return "COLLSCAN" in plan["stages"]
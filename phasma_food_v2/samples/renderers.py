@@ -0,0 +1,25 @@
+import json
+from typing import Iterable, Iterator
+
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class NDJSONRenderer(BaseRenderer):
+    """Newline delimited JSON, one document per line.
+    Views stream documents with render_lines, render is used for
+    single objects such as validation errors.
+    """
+    media_type = "application/x-ndjson"
+    format = "ndjson"
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None) -> bytes:
+        if data is None:
+            return b""
+        return b"".join(self.render_lines([data]))
+
+    @staticmethod
+    def render_lines(documents: Iterable[dict]) -> Iterator[bytes]:
+        for document in documents:
+            yield json.dumps(document, cls=JSONEncoder, ensure_ascii=False).encode("utf-8") + b"\n"
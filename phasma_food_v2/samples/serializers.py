@@ -1,7 +1,35 @@
 from rest_framework import serializers
 
+from .mongo_db import build_projection, decode_cursor
 
-class RowSerializer(serializers.Serializer):
+
+class ProjectionSerializer(serializers.Serializer):
+    """Fields of documents that are returned, validated against
+    PROJECTION_FIELDS and PROJECTION_SENSOR_FIELDS and replaced by
+    Mongo projection in validated data.
+
+    "fields" and "exclude" are lists of field paths, e.g. "NIR.preprocessed",
+    "slice" maps sensor array to number of elements or [skip, number of elements].
+    """
+    fields = serializers.ListField(child=serializers.CharField(max_length=254), required=False)
+    exclude = serializers.ListField(child=serializers.CharField(max_length=254), required=False)
+    slice = serializers.DictField(child=serializers.JSONField(), required=False)
+
+    def validate(self, attrs: dict) -> dict:
+        exclude = attrs.pop("exclude", None)
+        if exclude and attrs.get("project"):
+            raise serializers.ValidationError("Fields can not be excluded from base projection.")
+        try:
+            attrs["projection"] = build_projection(attrs.pop("fields", None), exclude, attrs.pop("slice", None))
+        except ValueError as error:
+            raise serializers.ValidationError(str(error))
+        sort = attrs.get("sort", "").lstrip("-")
+        if sort and any(sort == path or sort.startswith(path + ".") for path in exclude or ()):
+            raise serializers.ValidationError("Sort field can not be excluded.")
+        return attrs
+
+
+class RowSerializer(ProjectionSerializer):
     """Mongo DB query for single document."""
     query = serializers.JSONField()
     db = serializers.CharField(max_length=254, required=False)
@@ -9,9 +37,31 @@ class RowSerializer(serializers.Serializer):
     project = serializers.BooleanField()
 
 
-class RowsSerializer(serializers.Serializer):
-    """Mongo DB query for documents."""
+class RowsSerializer(ProjectionSerializer):
+    """Mongo DB query for documents.
+
+    Page number pagination is used by default. With "cursor" pagination
+    documents are ordered by sort field and _id and next page is requested
+    with cursor from previous response.
+    """
+    PAGE = "page"
+    CURSOR = "cursor"
+
     query = serializers.JSONField()
     db = serializers.CharField(max_length=254, required=False)
     collection = serializers.CharField(max_length=254)
     project = serializers.BooleanField()
+    pagination = serializers.ChoiceField(choices=(PAGE, CURSOR), default=PAGE)
+    page_num = serializers.IntegerField(min_value=1, default=1)
+    page_size = serializers.IntegerField(min_value=1, max_value=1000, default=10)
+    cursor = serializers.CharField(required=False, allow_blank=True)
+    sort = serializers.RegexField(r"^-?[A-Za-z_][\w.]*$", max_length=254, required=False)
+    count = serializers.BooleanField(default=False)
+
+    def validate_cursor(self, value: str) -> str:
+        if value:
+            try:
+                decode_cursor(value)
+            except ValueError as error:
+                raise serializers.ValidationError(str(error))
+        return value
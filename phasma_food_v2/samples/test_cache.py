@@ -0,0 +1,119 @@
+import pytest
+from django.core.cache import cache
+
+from phasma_food_v2.samples.cache import query_cache
+from phasma_food_v2.samples.mongo_db import MongoDB
+
+
+class Compute:
+    """Counts how many times query was run."""
+    def __init__(self, result=1):
+        self.result = result
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.result
+
+
+@pytest.fixture(autouse=True)
+def query_cache_settings(settings):
+    cache.clear()
+    settings.MONGO_QUERY_CACHE_ENABLED = True
+    settings.MONGO_QUERY_CACHE_TIMEOUT = 300
+    settings.MONGO_QUERY_CACHE_TIMEOUTS = {}
+    settings.MONGO_QUERY_CACHE_STATS = False
+    settings.MONGO_COUNT_CACHE_TIMEOUT = 60
+
+
+class TestQueryCache:
+    def test_result_is_cached(self):
+        compute = Compute([1, 2])
+
+        assert query_cache.get_or_set("db", "collection", "rows", compute, page_num=1) == [1, 2]
+        assert query_cache.get_or_set("db", "collection", "rows", compute, page_num=1) == [1, 2]
+        assert compute.calls == 1
+
+    def test_bump_invalidates_collection(self):
+        compute, other = Compute(), Compute()
+        query_cache.get_or_set("db", "collection", "rows", compute)
+        query_cache.get_or_set("db", "other", "rows", other)
+        version = query_cache.version("db", "collection")
+
+        query_cache.bump("db", "collection")
+
+        assert query_cache.version("db", "collection") == version + 1
+        query_cache.get_or_set("db", "collection", "rows", compute)
+        query_cache.get_or_set("db", "other", "rows", other)
+        assert compute.calls == 2
+        assert other.calls == 1
+
+    def test_bump_without_version(self):
+        query_cache.bump("db", "collection")
+
+        assert query_cache.version("db", "collection") is not None
+
+    def test_key_is_canonical(self):
+        key = query_cache.key("db", "collection", "rows", query={"a": 1, "b": {"c": 2, "d": 3}}, page_num=1)
+
+        assert key == query_cache.key("db", "collection", "rows", page_num=1, query={"b": {"d": 3, "c": 2}, "a": 1})
+        assert key != query_cache.key("db", "collection", "rows", query={"a": 1, "b": {"c": 2, "d": 3}}, page_num=2)
+        assert key != query_cache.key("db", "collection", "row", query={"a": 1, "b": {"c": 2, "d": 3}}, page_num=1)
+        assert key != query_cache.key("db", "other", "rows", query={"a": 1, "b": {"c": 2, "d": 3}}, page_num=1)
+
+    @pytest.mark.parametrize("enabled, timeouts", [(False, {}), (True, {"collection": 0})])
+    def test_disabled_cache_runs_every_query(self, settings, enabled, timeouts):
+        settings.MONGO_QUERY_CACHE_ENABLED = enabled
+        settings.MONGO_QUERY_CACHE_TIMEOUTS = timeouts
+        compute = Compute()
+
+        query_cache.get_or_set("db", "collection", "rows", compute)
+        query_cache.get_or_set("db", "collection", "rows", compute)
+
+        assert compute.calls == 2
+
+    def test_stats_are_counted_only_when_enabled(self, settings):
+        query_cache.get_or_set("db", "collection", "rows", Compute())
+        assert query_cache.stats("db", ["collection"])["collection"]["hits"] == 0
+
+        settings.MONGO_QUERY_CACHE_STATS = True
+        query_cache.get_or_set("db", "collection", "rows", Compute())
+        query_cache.get_or_set("db", "collection", "rows", Compute())
+        query_cache.get_or_set("db", "collection", "page", Compute())
+
+        stats = query_cache.stats("db", ["collection"])["collection"]
+        assert (stats["hits"], stats["misses"], stats["hit_rate"]) == (2, 1, 2 / 3)
+
+
+class FakeCollection:
+    def __init__(self):
+        self.counts = 0
+
+    def count_documents(self, query: dict) -> int:
+        self.counts += 1
+        return 3
+
+
+class TestCountRows:
+    @pytest.fixture
+    def collection(self) -> FakeCollection:
+        return FakeCollection()
+
+    @pytest.fixture
+    def mongo(self, collection) -> MongoDB:
+        return MongoDB(client={"db": {"collection": collection}})
+
+    def test_count_is_cached_when_query_cache_is_disabled(self, settings, mongo, collection):
+        settings.MONGO_QUERY_CACHE_ENABLED = False
+        settings.MONGO_QUERY_CACHE_TIMEOUTS = {"collection": 0}
+
+        assert mongo.count_rows({"useCase": "UC"}, db="db", collection="collection") == 3
+        assert mongo.count_rows({"useCase": "UC"}, db="db", collection="collection") == 3
+        assert collection.counts == 1
+
+    def test_count_cache_can_be_disabled(self, settings, mongo, collection):
+        settings.MONGO_COUNT_CACHE_TIMEOUT = 0
+
+        mongo.count_rows({"useCase": "UC"}, db="db", collection="collection")
+        mongo.count_rows({"useCase": "UC"}, db="db", collection="collection")
+        assert collection.counts == 2
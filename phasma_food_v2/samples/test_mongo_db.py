@@ -0,0 +1,405 @@
+import pytest
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import BulkWriteError
+
+from phasma_food_v2.samples import mongo_db
+from phasma_food_v2.samples.mongo_db import (
+    MongoDB, build_projection, decode_cursor, encode_cursor, keyset_filter, merge_projection
+)
+
+# Missing sort value is stored as None, Mongo orders it before every other value
+DOCUMENTS = [
+    {"_id": 1, "temperature": 5},
+    {"_id": 2, "temperature": None},
+    {"_id": 3, "temperature": 5},
+    {"_id": 4, "temperature": 2},
+    {"_id": 5},
+    {"_id": 6, "temperature": 9},
+    {"_id": 7, "temperature": None},
+]
+
+
+def _matches(document: dict, selection: dict) -> bool:
+    """Subset of Mongo query language that keyset filters use."""
+    for key, condition in selection.items():
+        if key == "$or":
+            matched = any(_matches(document, item) for item in condition)
+        elif key == "$and":
+            matched = all(_matches(document, item) for item in condition)
+        elif isinstance(condition, dict):
+            value = document.get(key)
+            matched = all(
+                value is not None and value > operand if operator == "$gt" else
+                value is not None and value < operand if operator == "$lt" else
+                value != operand
+                for operator, operand in condition.items()
+            )
+        else:
+            matched = document.get(key) == condition
+        if not matched:
+            return False
+    return True
+
+
+def _sort_key(document: dict, field: str) -> tuple:
+    value = document.get(field)
+    return value is not None, value or 0, document["_id"]
+
+
+class FakeCursor:
+    def __init__(self, documents: list):
+        self.documents = documents
+        self.batch = None
+        self.closed = False
+
+    def sort(self, order: list) -> "FakeCursor":
+        field, direction = order[0]
+        self.documents.sort(key=lambda document: _sort_key(document, field), reverse=direction == DESCENDING)
+        return self
+
+    def limit(self, limit: int) -> "FakeCursor":
+        self.documents = self.documents[:limit]
+        return self
+
+    def batch_size(self, batch_size: int) -> "FakeCursor":
+        self.batch = batch_size
+        return self
+
+    def close(self) -> None:
+        self.closed = True
+
+    def __iter__(self):
+        return iter(self.documents)
+
+
+class FakeBulkWriteResult:
+    def __init__(self, bulk_api_result: dict):
+        self.bulk_api_result = bulk_api_result
+
+
+class FakeCollection:
+    def __init__(self):
+        self.documents = {}
+        self.fail = set()
+        self.cursors = []
+
+    def find(self, selection: dict, projection: dict = None) -> FakeCursor:
+        cursor = FakeCursor([dict(document) for document in DOCUMENTS if _matches(document, selection)])
+        self.cursors.append(cursor)
+        return cursor
+
+    def aggregate(self, pipeline: list, allowDiskUse: bool = False) -> list:
+        """Only $group stage with $sum of ones, documents of `documents` are grouped."""
+        (stage,), = [item.values() for item in pipeline]
+        groups = {}
+        for document in self.documents.values():
+            key = tuple((name, document[field[1:]]) for name, field in stage["_id"].items() if field[1:] in document)
+            groups[key] = groups.get(key, 0) + 1
+        return [{"_id": dict(key), "count": count} for key, count in groups.items()]
+
+    def bulk_write(self, operations: list, ordered: bool = True) -> FakeBulkWriteResult:
+        """Replace or insert documents by filter, documents whose key is in `fail` are not written."""
+        result = {"nInserted": 0, "nUpserted": 0, "nMatched": 0, "writeErrors": []}
+        for index, operation in enumerate(operations):
+            (key, value), = operation._filter.items()
+            if value in self.fail:
+                result["writeErrors"].append({"index": index, "errmsg": "E11000 duplicate key error"})
+                continue
+            result["nMatched" if value in self.documents else "nUpserted"] += 1
+            self.documents[value] = operation._doc
+        if result["writeErrors"]:
+            raise BulkWriteError(result)
+        return FakeBulkWriteResult(result)
+
+
+@pytest.fixture
+def mongo(settings) -> MongoDB:
+    settings.MONGO_QUERY_CACHE_ENABLED = False
+    return MongoDB(client={"db": {"collection": FakeCollection()}})
+
+
+class TestCursor:
+    @pytest.mark.parametrize("values", [
+        {"id": 1, "value": None},
+        {"id": 2, "value": 5.5},
+        {"id": 3, "value": "Minced pork"},
+    ])
+    def test_round_trip(self, values):
+        assert decode_cursor(encode_cursor(values)) == values
+
+    @pytest.mark.parametrize("token", ["", "not a cursor", encode_cursor({"value": 1}), "W10="])
+    def test_invalid_cursor(self, token):
+        with pytest.raises(ValueError):
+            decode_cursor(token)
+
+
+class TestKeysetFilter:
+    def test_without_sort_field(self):
+        assert keyset_filter(None, ASCENDING, {"id": 3}) == {"_id": {"$gt": 3}}
+        assert keyset_filter(None, DESCENDING, {"id": 3}) == {"_id": {"$lt": 3}}
+
+    def test_ascending_after_value(self):
+        assert keyset_filter("temperature", ASCENDING, {"id": 3, "value": 5}) == {"$or": [
+            {"temperature": {"$gt": 5}},
+            {"temperature": 5, "_id": {"$gt": 3}},
+        ]}
+
+    def test_ascending_after_missing_value(self):
+        assert keyset_filter("temperature", ASCENDING, {"id": 3, "value": None}) == {"$or": [
+            {"temperature": {"$ne": None}},
+            {"temperature": None, "_id": {"$gt": 3}},
+        ]}
+
+    def test_descending_after_value(self):
+        assert keyset_filter("temperature", DESCENDING, {"id": 3, "value": 5}) == {"$or": [
+            {"$or": [{"temperature": {"$lt": 5}}, {"temperature": None}]},
+            {"temperature": 5, "_id": {"$lt": 3}},
+        ]}
+
+    def test_descending_after_missing_value(self):
+        assert keyset_filter("temperature", DESCENDING, {"id": 3, "value": None}) == {
+            "temperature": None, "_id": {"$lt": 3}
+        }
+
+    @pytest.mark.parametrize("direction", [ASCENDING, DESCENDING])
+    def test_every_position_continues_in_sort_order(self, direction):
+        ordered = sorted(DOCUMENTS, key=lambda document: _sort_key(document, "temperature"),
+                         reverse=direction == DESCENDING)
+        for index, document in enumerate(ordered):
+            position = {"id": document["_id"], "value": document.get("temperature")}
+            after = keyset_filter("temperature", direction, position)
+            following = [item["_id"] for item in ordered if _matches(item, after)]
+            assert following == [item["_id"] for item in ordered[index + 1:]]
+
+
+class TestFindRowsAfter:
+    @pytest.mark.parametrize("sort", [None, "temperature", "-temperature"])
+    def test_pages_return_every_document_once(self, mongo, sort):
+        pages, cursor = [], None
+        while True:
+            data, cursor, total = mongo.find_rows_after(cursor=cursor, page_size=2, sort=sort,
+                                                        db="db", collection="collection")
+            pages.append([int(document["id"]) for document in data])
+            if cursor is None:
+                break
+
+        field = sort.lstrip("-") if sort else "_id"
+        ordered = sorted(DOCUMENTS, key=lambda document: _sort_key(document, field),
+                         reverse=bool(sort) and sort.startswith("-"))
+        assert sum(pages, []) == [document["_id"] for document in ordered]
+        assert [len(page) for page in pages] == [2, 2, 2, 1]
+        assert total is None
+
+    def test_invalid_cursor(self, mongo):
+        with pytest.raises(ValueError):
+            mongo.find_rows_after(cursor="not a cursor", db="db", collection="collection")
+
+
+class TestIterRows:
+    @pytest.mark.parametrize("sort", [None, "temperature", "-temperature"])
+    def test_every_document_is_streamed_in_order_of_pages(self, mongo, sort):
+        pages, cursor = [], None
+        while True:
+            data, cursor, _ = mongo.find_rows_after(cursor=cursor, page_size=2, sort=sort,
+                                                    db="db", collection="collection")
+            pages.extend(document["id"] for document in data)
+            if cursor is None:
+                break
+
+        assert [document["id"] for document in mongo.iter_rows(sort=sort, db="db", collection="collection")] == pages
+
+    def test_streaming_continues_after_cursor(self, mongo):
+        data, cursor, _ = mongo.find_rows_after(page_size=3, sort="temperature", db="db", collection="collection")
+        first = [document["id"] for document in data]
+
+        following = [document["id"] for document in mongo.iter_rows(cursor=cursor, sort="temperature",
+                                                                     db="db", collection="collection")]
+        assert len(first) + len(following) == len(DOCUMENTS)
+        assert not set(first) & set(following)
+
+    def test_documents_are_fetched_in_batches(self, settings, mongo):
+        settings.MONGO_STREAM_BATCH_SIZE = 3
+        collection = mongo.client["db"]["collection"]
+
+        documents = mongo.iter_rows(query={"temperature": 5}, db="db", collection="collection")
+        assert [document["id"] for document in documents] == ["1", "3"]
+        assert collection.cursors[-1].batch == 3
+        assert collection.cursors[-1].closed
+
+    def test_cursor_is_closed_when_client_disconnects(self, mongo):
+        documents = mongo.iter_rows(db="db", collection="collection")
+        next(documents)
+        documents.close()
+
+        assert mongo.client["db"]["collection"].cursors[-1].closed
+
+    def test_invalid_cursor(self, mongo):
+        with pytest.raises(ValueError):
+            mongo.iter_rows(cursor="not a cursor", db="db", collection="collection")
+
+
+class TestCountByUseCase:
+    def test_documents_are_counted_by_use_case_and_food_type(self, mongo):
+        collection = mongo.client["db"]["collection"]
+        collection.documents = {
+            1: {"useCase": "UC", "foodType": "FT"},
+            2: {"useCase": "UC", "foodType": "FT"},
+            3: {"useCase": "UC", "foodType": "Other"},
+            4: {"useCase": "Other", "foodType": "FT"},
+            5: {"foodType": "FT"},
+            6: {"useCase": "UC"},
+        }
+
+        counts = mongo.count_by_use_case(db="db", collection="collection")
+
+        assert sorted(counts, key=lambda group: (str(group["useCase"]), str(group["foodType"]))) == [
+            {"useCase": None, "foodType": "FT", "count": 1},
+            {"useCase": "Other", "foodType": "FT", "count": 1},
+            {"useCase": "UC", "foodType": "FT", "count": 2},
+            {"useCase": "UC", "foodType": None, "count": 1},
+            {"useCase": "UC", "foodType": "Other", "count": 1},
+        ]
+
+    def test_empty_collection(self, mongo):
+        assert mongo.count_by_use_case(db="db", collection="collection") == []
+
+
+class TestBuildProjection:
+    def test_whitelisted_fields(self):
+        assert build_projection(fields=["foodType", "aflatoxin.value", "NIR", "VIS.preprocessed"]) == {
+            "foodType": 1, "aflatoxin.value": 1, "NIR": 1, "VIS.preprocessed": 1
+        }
+        assert build_projection(exclude=["FLUO"]) == {"FLUO": 0}
+        assert build_projection() is None
+
+    @pytest.mark.parametrize("path", ["password", "VIS.secret", "NIR.wave.0", "aflatoxin.", "$where"])
+    def test_field_not_in_whitelist(self, path):
+        with pytest.raises(ValueError):
+            build_projection(fields=[path])
+
+    def test_include_and_exclude(self):
+        with pytest.raises(ValueError):
+            build_projection(fields=["foodType"], exclude=["NIR"])
+
+    @pytest.mark.parametrize("fields, slices", [
+        (["NIR", "NIR.preprocessed"], None),
+        (["aflatoxin", "aflatoxin.value"], None),
+        (["NIR"], {"NIR.wave": 10}),
+    ])
+    def test_overlapping_fields(self, fields, slices):
+        with pytest.raises(ValueError):
+            build_projection(fields=fields, slices=slices)
+
+    def test_slices(self):
+        assert build_projection(fields=["foodType"], slices={"NIR.wave": 10, "VIS.rawData": [5, 20]}) == {
+            "foodType": 1, "NIR.wave": {"$slice": 10}, "VIS.rawData": {"$slice": [5, 20]}
+        }
+        assert build_projection(slices={"NIR.wave": -5}) == {"NIR.wave": {"$slice": -5}}
+
+    @pytest.mark.parametrize("path, value", [
+        ("NIR.wave", "10"),
+        ("NIR.wave", True),
+        ("NIR.wave", [5]),
+        ("NIR.wave", [5, 0]),
+        ("NIR.wave", [5, "10"]),
+        ("NIR", 10),
+        ("foodType", 10),
+    ])
+    def test_invalid_slice(self, path, value):
+        with pytest.raises(ValueError):
+            build_projection(slices={path: value})
+
+
+class TestMergeProjection:
+    def test_without_requested_projection(self):
+        assert merge_projection({"foodType": 1}, None) == {"foodType": 1}
+        assert merge_projection(None, None) is None
+
+    def test_inclusion_is_added_to_base(self):
+        base = {"foodType": 1, "aflatoxin": 1}
+        assert merge_projection(base, {"NIR.wave": {"$slice": 5}, "aflatoxin.value": 1}) == {
+            "foodType": 1, "NIR.wave": {"$slice": 5}, "aflatoxin.value": 1
+        }
+
+    def test_exclusion_replaces_base(self):
+        assert merge_projection({"foodType": 1}, {"NIR": 0}) == {"NIR": 0}
+
+    def test_rows_projection(self):
+        projection = MongoDB.rows_projection(True, build_projection(fields=["NIR.preprocessed", "aflatoxin.name"]))
+
+        assert projection["NIR.preprocessed"] == 1
+        assert projection["aflatoxin.name"] == 1
+        assert "aflatoxin" not in projection
+        assert projection["foodType"] == 1
+        assert MongoDB.rows_projection(True, build_projection(exclude=["VIS"])) == {"VIS": 0}
+        assert MongoDB.rows_projection(False, build_projection(exclude=["VIS"])) == {"VIS": 0}
+
+
+class TestBulkUpsert:
+    @pytest.fixture
+    def collection(self, mongo) -> FakeCollection:
+        return mongo.client["db"]["collection"]
+
+    @staticmethod
+    def documents(*sample_ids) -> list:
+        return [{"sampleId": sample_id, "foodType": "FT"} for sample_id in sample_ids]
+
+    def test_pushed_again_documents_are_replaced(self, mongo, collection):
+        assert mongo.bulk_upsert(self.documents(1, 2), db="db", collection="collection") == {
+            "inserted": 2, "updated": 0, "failed": 0
+        }
+        assert mongo.bulk_upsert(self.documents(2, 3), db="db", collection="collection") == {
+            "inserted": 1, "updated": 1, "failed": 0
+        }
+        assert sorted(collection.documents) == [1, 2, 3]
+
+    def test_failed_documents_are_counted(self, mongo, collection):
+        collection.fail = {2}
+
+        assert mongo.bulk_upsert(self.documents(1, 2, 3), db="db", collection="collection") == {
+            "inserted": 2, "updated": 0, "failed": 1
+        }
+        assert sorted(collection.documents) == [1, 3]
+
+    def test_without_documents(self, mongo, collection):
+        assert mongo.bulk_upsert([], db="db", collection="collection") == {"inserted": 0, "updated": 0, "failed": 0}
+
+
+class TestSharedClient:
+    @pytest.fixture(autouse=True)
+    def client(self, settings, monkeypatch):
+        settings.MONGO_HOST = "localhost"
+        monkeypatch.setattr(mongo_db, "_client", None)
+        monkeypatch.setattr(mongo_db, "_client_pid", None)
+
+    def test_client_is_shared_in_process(self):
+        client = mongo_db.get_client()
+
+        assert mongo_db.get_client() is client
+        assert mongo_db.pool_stats()["connected"] is True
+        assert mongo_db.pool_stats()["in_flight"] == 0
+
+    def test_child_process_creates_own_client(self, monkeypatch):
+        parent = mongo_db.get_client()
+        closed = []
+        monkeypatch.setattr(parent, "close", lambda: closed.append(True))
+        pid = mongo_db.os.getpid()
+        monkeypatch.setattr(mongo_db.os, "getpid", lambda: pid + 1)
+
+        # Stats of forked child do not report pool of parent
+        assert mongo_db.pool_stats()["connected"] is False
+        mongo_db.reset_client()
+        assert closed == []
+        child = mongo_db.get_client()
+        assert child is not parent
+        assert mongo_db.get_client() is child
+
+    def test_reset_client_closes_client_of_process(self, monkeypatch):
+        client = mongo_db.get_client()
+        closed = []
+        monkeypatch.setattr(client, "close", lambda: closed.append(True))
+
+        mongo_db.reset_client()
+
+        assert closed == [True]
+        assert mongo_db.get_client() is not client
@@ -0,0 +1,66 @@
+import pytest
+from pymongo.errors import OperationFailure
+
+from phasma_food_v2.samples.mongo_indexes import MONGO_INDEXES, ensure_indexes
+
+
+class FakeCollection:
+    def __init__(self, indexes: dict, fail: bool = False):
+        self.indexes = indexes
+        self.fail = fail
+
+    def index_information(self) -> dict:
+        return {name: dict(index) for name, index in self.indexes.items()}
+
+    def create_indexes(self, indexes: list) -> None:
+        for index in indexes:
+            if self.fail and index.document.get("unique"):
+                raise OperationFailure("E11000 duplicate key error")
+            self.indexes[index.document["name"]] = {
+                "key": list(index.document["key"].items()), "unique": index.document.get("unique", False)
+            }
+
+    def drop_index(self, name: str) -> None:
+        del self.indexes[name]
+
+
+def _indexes(unique: bool = True) -> dict:
+    indexes = {"_id_": {"key": [("_id", 1)]}}
+    for index in MONGO_INDEXES:
+        indexes[index.document["name"]] = {"key": list(index.document["key"].items())}
+    indexes["sample_id"]["unique"] = unique
+    return indexes
+
+
+class TestEnsureIndexes:
+    def test_sample_id_index_is_unique_for_documents_with_sample_id(self):
+        sample_id = next(index.document for index in MONGO_INDEXES if index.document["name"] == "sample_id")
+
+        assert sample_id["unique"] is True
+        assert sample_id["partialFilterExpression"] == {"sampleId": {"$exists": True}}
+
+    def test_existing_indexes_are_skipped(self):
+        collection = FakeCollection(_indexes())
+
+        assert ensure_indexes(collection) == ([], ["use_case_food_type", "food_type", "sample_id"])
+
+    def test_missing_indexes_are_created(self):
+        collection = FakeCollection({"_id_": {"key": [("_id", 1)]}})
+
+        assert ensure_indexes(collection, dry_run=True)[0] == ["use_case_food_type", "food_type", "sample_id"]
+        assert list(collection.indexes) == ["_id_"]
+        ensure_indexes(collection)
+        assert collection.indexes["sample_id"]["unique"] is True
+
+    def test_index_that_is_not_unique_is_replaced(self):
+        collection = FakeCollection(_indexes(unique=False))
+
+        assert ensure_indexes(collection) == (["sample_id"], ["use_case_food_type", "food_type"])
+        assert collection.indexes["sample_id"]["unique"] is True
+
+    def test_old_index_is_restored_when_unique_index_fails(self):
+        collection = FakeCollection(_indexes(unique=False), fail=True)
+
+        with pytest.raises(OperationFailure):
+            ensure_indexes(collection)
+        assert collection.indexes["sample_id"] == {"key": [("sampleId", 1)], "unique": False}
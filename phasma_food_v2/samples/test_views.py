@@ -0,0 +1,57 @@
+import json
+
+import pytest
+from django.contrib.auth import get_user_model
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from phasma_food_v2.samples import views
+
+pytestmark = pytest.mark.django_db
+
+
+class FakeMongoDB:
+    """Streams `documents`, arguments of iter_rows are kept in `calls`."""
+    documents = []
+    calls = []
+
+    def iter_rows(self, **kwargs):
+        self.calls.append(kwargs)
+        return iter(self.documents)
+
+
+@pytest.fixture
+def mongo(monkeypatch) -> FakeMongoDB:
+    FakeMongoDB.documents = [{"id": "1", "foodType": "Wheat"}, {"id": "2", "foodType": "Maize flour ±"}]
+    FakeMongoDB.calls = []
+    monkeypatch.setattr(views, "MongoDB", FakeMongoDB)
+    return FakeMongoDB
+
+
+def _rows(data: dict):
+    user = get_user_model().objects.create_user(email="user@example.com", password="password")
+    request = APIRequestFactory().post("/fake-url/", data, format="json", HTTP_ACCEPT="application/x-ndjson")
+    force_authenticate(request, user=user)
+    return views.rows(request)
+
+
+class TestRowsStream:
+    def test_one_document_per_line(self, mongo):
+        response = _rows({"query": {}, "collection": "collection", "project": False, "sort": "-temperature",
+                          "page_size": 5})
+
+        assert response.status_code == 200
+        assert response["Content-Type"] == "application/x-ndjson"
+        lines = b"".join(response.streaming_content).decode("utf-8").splitlines()
+        assert [json.loads(line) for line in lines] == mongo.documents
+        # Whole result is streamed, page arguments are not used
+        call, = mongo.calls
+        assert call["sort"] == "-temperature"
+        assert "page_size" not in call and "page_num" not in call
+
+    def test_invalid_cursor_is_rejected_before_streaming(self, mongo):
+        response = _rows({"query": {}, "collection": "collection", "project": False, "cursor": "not a cursor"})
+        response.render()
+
+        assert response.status_code == 400
+        assert "cursor" in json.loads(response.content)["error"]
+        assert mongo.calls == []
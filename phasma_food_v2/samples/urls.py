@@ -1,10 +1,12 @@
 from django.urls import path
 
-from .views import row, rows, databases, collections
+from .views import row, rows, databases, collections, pool, query_cache_stats
 
 urlpatterns = [
     path('databases/', databases, name="databases"),
     path('collections/<str:db>/', collections, name="collections"),
     path('row/', row, name="row"),
     path('rows/', rows, name="rows"),
+    path('pool/', pool, name="mongo_pool"),
+    path('cache/', query_cache_stats, name="mongo_query_cache"),
 ]
@@ -1,10 +1,17 @@
-from django.http import HttpRequest
+from typing import Union
+
+from django.conf import settings
+from django.http import HttpRequest, StreamingHttpResponse
 from rest_framework.views import APIView
 from rest_framework.generics import GenericAPIView
 from rest_framework.response import Response
 from rest_framework import status
+from rest_framework.permissions import IsAdminUser
+from rest_framework.settings import api_settings
 
-from .mongo_db import MongoDB
+from .cache import query_cache
+from .mongo_db import MongoDB, pool_stats
+from .renderers import NDJSONRenderer
 from .serializers import RowSerializer, RowsSerializer
 
 
@@ -37,13 +44,23 @@ class Row(GenericAPIView):
 
 
 class Rows(GenericAPIView):
-    """Multi documents from Mongo DB."""
+    """Multi documents from Mongo DB.
+    With "Accept: application/x-ndjson" all documents for query are streamed,
+    one document per line, starting after cursor when it is given.
+    """
     serializer_class = RowsSerializer
+    renderer_classes = tuple(api_settings.DEFAULT_RENDERER_CLASSES) + (NDJSONRenderer,)
 
-    def post(self, request: HttpRequest) -> Response:
+    def post(self, request: HttpRequest) -> Union[StreamingHttpResponse, Response]:
         serializer = self.get_serializer(data=request.data)
         if serializer.is_valid():
             request_data = serializer.validated_data
+            if request.accepted_renderer.format == NDJSONRenderer.format:
+                return self.stream(request_data)
+            if request_data.pop("pagination") == RowsSerializer.CURSOR:
+                return self.cursor_page(request_data)
+            for name in ("cursor", "sort", "count"):
+                request_data.pop(name, None)
 
             data, data_query_total, data_total, page_num, page_size = MongoDB().find_rows(**request_data)
             number_of_pages = (data_total // page_size) + 1 if data_total % page_size else data_total // page_size
@@ -52,7 +69,7 @@ class Rows(GenericAPIView):
                 "count": data_query_total,
                 "number_of_pages": number_of_pages,
                 "next": {"page_num": page_num + 1, "page_size": page_size} if page_num < number_of_pages else {},
-                "previous": {"page_num": page_num + 1, "page_size": page_size} if 1 <= page_num - 1 <= number_of_pages else {},
+                "previous": {"page_num": page_num - 1, "page_size": page_size} if 1 <= page_num - 1 <= number_of_pages else {},
                 "results": data
 
             }
@@ -62,8 +79,48 @@ class Rows(GenericAPIView):
         elif serializer.errors:
             return Response({"error": serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
 
+    @staticmethod
+    def stream(request_data: dict) -> StreamingHttpResponse:
+        for name in ("pagination", "page_num", "page_size", "count"):
+            request_data.pop(name, None)
+        documents = MongoDB().iter_rows(**request_data)
+        return StreamingHttpResponse(NDJSONRenderer.render_lines(documents), content_type=NDJSONRenderer.media_type)
+
+    @staticmethod
+    def cursor_page(request_data: dict) -> Response:
+        """Page of documents after cursor, total is returned only when count is requested."""
+        request_data.pop("page_num", None)
+        data, next_cursor, data_total = MongoDB().find_rows_after(**request_data)
+        context = {
+            "total": data_total,
+            "count": len(data),
+            "next": {"cursor": next_cursor, "page_size": request_data["page_size"]} if next_cursor else {},
+            "results": data
+        }
+        return Response({"message": context}, status=status.HTTP_200_OK)
+
+
+class PoolStats(APIView):
+    """Connection pool of shared Mongo client in process that serves request."""
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request: HttpRequest) -> Response:
+        return Response({"message": pool_stats()}, status=status.HTTP_200_OK)
+
+
+class QueryCacheStats(APIView):
+    """Hit/miss counters of cached query results per collection of DB."""
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request: HttpRequest) -> Response:
+        db = request.query_params.get("db", settings.MONGO_DEFAULT_DB)
+        stats = query_cache.stats(db, MongoDB().collection_list(db))
+        return Response({"message": stats}, status=status.HTTP_200_OK)
+
 
 databases = Databases.as_view()
 collections = Collections.as_view()
 row = Row.as_view()
 rows = Rows.as_view()
+pool = PoolStats.as_view()
+query_cache_stats = QueryCacheStats.as_view()
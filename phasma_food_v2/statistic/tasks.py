@@ -1,5 +1,8 @@
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.db.models import Count
 
@@ -64,49 +67,53 @@ def platform_statistic() -> dict:
     }
 
 
-def mongo_statistic() -> dict:
-    collections = ["AltSplitSamples", "AlcoholicBeverages", "AltJsonSamples",
-                   "EdibleOils", "SkimmedMilkPowder", "UseCaseOne", "UseCaseTwo"]
-    mongo_dict = {
-        "measurements": {
+def collection_statistic(collection: str) -> dict:
+    """Number of documents in collection per use case and food type.
+    Food type is counted over whole collection, so food type that is used
+    by more use cases has same count in every one of them.
+    """
+    groups = MongoDB().count_by_use_case(collection=collection)
+    food_counts = Counter()
+    for group in groups:
+        if group["foodType"] is not None:
+            food_counts[group["foodType"]] += group["count"]
+
+    food_count_per_use_case = {}
+    for group in groups:
+        case, food = group["useCase"], group["foodType"]
+        if case is None or food is None:
+            continue
+        food_count_per_use_case.setdefault(case, {})[food] = food_counts[food]
+    for foods in food_count_per_use_case.values():
+        foods["total"] = sum(foods.values())
+    return {
+        "total": sum(group["count"] for group in groups),
+        "use_cases": food_count_per_use_case
+    }
+
+
+def empty_statistic() -> dict:
+    """Statistic of collection that does not exist."""
+    return {"total": 0, "use_cases": {}}
 
+
+def statistic_collections() -> List[str]:
+    """MONGO_STATISTIC_COLLECTIONS or all collections of default DB when it is empty."""
+    return settings.MONGO_STATISTIC_COLLECTIONS or MongoDB().collection_list(settings.MONGO_DEFAULT_DB)
+
+
+def mongo_statistic() -> dict:
+    collections = statistic_collections()
+    with ThreadPoolExecutor(max_workers=max(min(len(collections), settings.MONGO_STATISTIC_WORKERS), 1)) as executor:
+        statistics = executor.map(collection_statistic, collections)
+        mongo_dict = {
+            "measurements": dict(zip(collections, statistics))
         }
-    }
-    for collection in collections:
-        use_cases_and_food_types = MongoDB().find_distinct_values(values=["useCase", "foodType"],
-                                                                  collection=collection
-                                                                  )
-        use_cases = use_cases_and_food_types["useCase"]
-        food_type_per_use_case = MongoDB().find_distinct_values_for_use_case(use_cases=use_cases,
-                                                                             collection=collection
-                                                                             )
-        food_count_per_use_case = {}
-        for case, foods in food_type_per_use_case.items():
-            sum_measurements = 0
-            for food in foods:
-                total = MongoDB().counter({"foodType": food},
-                                          collection=collection
-                                          )
-                sum_measurements += total
-                if case in food_count_per_use_case:
-                    food_count_per_use_case[case].update({food: total})
-                else:
-                    food_count_per_use_case[case] = {food: total}
-            food_count_per_use_case[case].update({"total": sum_measurements})
-
-        mongo_dict["measurements"].update(
-            {
-                collection: {
-                    "total": MongoDB().counter(item={}, collection=collection),
-                    "use_cases": food_count_per_use_case
-                }
-            }
-        )
 
     mongo = mongo_dict.get("measurements")
-    edible_oils = mongo.get("EdibleOils")
-    skimmed_milk_powder = mongo.get("SkimmedMilkPowder")
-    alcoholic_beverages = mongo.get("AlcoholicBeverages")
+    edible_oils = mongo.pop("EdibleOils", empty_statistic())
+    skimmed_milk_powder = mongo.pop("SkimmedMilkPowder", empty_statistic())
+    alcoholic_beverages = mongo.pop("AlcoholicBeverages", empty_statistic())
     total = int(edible_oils.get("total")) + int(skimmed_milk_powder.get("total")) + int(
         alcoholic_beverages.get("total"))
     mongo.update({
@@ -122,22 +129,19 @@ def mongo_statistic() -> dict:
             }
         }
     })
-    del mongo_dict["measurements"]["EdibleOils"]
-    del mongo_dict["measurements"]["SkimmedMilkPowder"]
-    del mongo_dict["measurements"]["AlcoholicBeverages"]
 
-    alt_json = mongo.get("AltJsonSamples")
-    uc_one = mongo.get("UseCaseOne")
-    uc_two = mongo.get("UseCaseTwo")
+    alt_json = mongo.setdefault("AltJsonSamples", empty_statistic())
+    uc_one = mongo.get("UseCaseOne", empty_statistic())
+    uc_two = mongo.get("UseCaseTwo", empty_statistic())
     uc_three = mongo.get("UseCaseThree")
     mongo_dict["measurements"]["AltJsonSamples"]["total"] = alt_json["total"] + uc_one["total"] + uc_two["total"] + \
                                                             uc_three["total"]
-    uc_one_counter = Counter(uc_one["use_cases"]["Mycotoxins detection"])
-    uc_two_counter = Counter(uc_two["use_cases"]["Food spoilage"])
+    uc_one_counter = Counter(uc_one["use_cases"].get("Mycotoxins detection", {}))
+    uc_two_counter = Counter(uc_two["use_cases"].get("Food spoilage", {}))
     uc_three_counter = Counter(uc_three["use_cases"]["Food adulteration"])
-    alt_json_uc_one_counter = Counter(alt_json["use_cases"]["UseCase1"])
-    alt_json_uc_two_counter = Counter(alt_json["use_cases"]["UseCase2"])
-    alt_json_uc_three_counter = Counter(alt_json["use_cases"]["UseCase3"])
+    alt_json_uc_one_counter = Counter(alt_json["use_cases"].get("UseCase1", {}))
+    alt_json_uc_two_counter = Counter(alt_json["use_cases"].get("UseCase2", {}))
+    alt_json_uc_three_counter = Counter(alt_json["use_cases"].get("UseCase3", {}))
     one = uc_one_counter + alt_json_uc_one_counter
     two = uc_two_counter + alt_json_uc_two_counter
     three = uc_three_counter + alt_json_uc_three_counter
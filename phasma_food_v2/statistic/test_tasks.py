@@ -0,0 +1,67 @@
+import pytest
+
+from phasma_food_v2.statistic import tasks
+
+GROUPS = {
+    "UseCaseOne": [
+        {"useCase": "Mycotoxins detection", "foodType": "Maize flour", "count": 3},
+        {"useCase": "Mycotoxins detection", "foodType": "Wheat", "count": 2},
+        # Same food type in other use case
+        {"useCase": "Other", "foodType": "Wheat", "count": 1},
+        {"useCase": None, "foodType": "Wheat", "count": 4},
+        {"useCase": "Mycotoxins detection", "foodType": None, "count": 5},
+    ],
+    "EdibleOils": [
+        {"useCase": "Food adulteration", "foodType": "Edible oils", "count": 6},
+    ],
+}
+
+
+class FakeMongoDB:
+    def count_by_use_case(self, collection: str) -> list:
+        return GROUPS.get(collection, [])
+
+
+@pytest.fixture
+def mongo(settings, monkeypatch):
+    settings.MONGO_STATISTIC_COLLECTIONS = ["UseCaseOne", "EdibleOils", "AltJsonSamples"]
+    settings.MONGO_STATISTIC_WORKERS = 2
+    monkeypatch.setattr(tasks, "MongoDB", FakeMongoDB)
+
+
+class TestCollectionStatistic:
+    def test_food_type_is_counted_over_whole_collection(self, mongo):
+        assert tasks.collection_statistic("UseCaseOne") == {
+            "total": 15,
+            "use_cases": {
+                "Mycotoxins detection": {"Maize flour": 3, "Wheat": 7, "total": 10},
+                "Other": {"Wheat": 7, "total": 7},
+            }
+        }
+
+    def test_empty_collection(self, mongo):
+        assert tasks.collection_statistic("AltJsonSamples") == tasks.empty_statistic()
+
+
+class TestMongoStatistic:
+    def test_collections_are_merged(self, mongo):
+        measurements = tasks.mongo_statistic()["measurements"]
+
+        assert sorted(measurements) == ["AltJsonSamples", "UseCaseOne", "UseCaseThree"]
+        assert measurements["UseCaseThree"]["use_cases"]["Food adulteration"] == {
+            "total": 6, "Edible Oils": 6, "Skimmed milk powder": 0, "Alcoholic beverages": 0
+        }
+        assert measurements["AltJsonSamples"]["total"] == 21
+        assert measurements["AltJsonSamples"]["use_cases"]["UseCase1"] == {"Maize flour": 3, "Wheat": 7, "total": 10}
+
+    def test_missing_collections_do_not_share_statistic(self, settings, mongo):
+        settings.MONGO_STATISTIC_COLLECTIONS = ["Unknown"]
+        first = tasks.mongo_statistic()
+        first["measurements"]["AltJsonSamples"]["use_cases"]["UseCase1"]["Fish"] = 1
+        statistic = tasks.empty_statistic()
+        statistic["use_cases"]["Food spoilage"] = {"Fish": 1}
+
+        assert tasks.mongo_statistic()["measurements"]["AltJsonSamples"] == {
+            "total": 0, "use_cases": {"UseCase1": {}, "UseCase2": {}, "UseCase3": {}}
+        }
+        assert tasks.empty_statistic() == {"total": 0, "use_cases": {}}